@@ -0,0 +1,55 @@
+#!/bin/sh
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Builds the shared as2_automation library layer (Lambda_Layer_as2_automation_common.zip) used by
+# every Lambda function of the Linux and Windows automations. The package is pure Python, bytecode
+# is precompiled for each runtime interpreter found so it is not recompiled on every cold start.
+#
+# usage: build-common-layer.sh [output_zip]
+#   PYTHONS  interpreters matching the Lambda runtimes (default "python3.8 python3.9")
+
+set -e
+
+PYTHONS=${PYTHONS:-"python3.8 python3.9"}
+OUTPUT=${1:-Lambda_Layer_as2_automation_common.zip}
+SOURCE_DIR=$(cd "$(dirname "$0")/.." && pwd)
+BUILD_DIR=$(mktemp -d)
+START_DIR=$(pwd)
+
+echo "Copying as2_automation into $BUILD_DIR/python."
+mkdir -p "$BUILD_DIR/python"
+cp -r "$SOURCE_DIR/as2_automation" "$BUILD_DIR/python/"
+find "$BUILD_DIR/python" -type d -name __pycache__ -prune -exec rm -rf {} +
+
+# /opt is read only in Lambda, ship bytecode so it is not recompiled on every cold start
+for PYTHON in $PYTHONS; do
+  if "$PYTHON" -c "" > /dev/null 2>&1; then
+    echo "Precompiling bytecode with $PYTHON."
+    $PYTHON -m compileall -q "$BUILD_DIR/python"
+  else
+    echo "$PYTHON not found, skipping bytecode for that runtime."
+  fi
+done
+
+cd "$BUILD_DIR"
+zip -q -r -9 layer.zip python
+cd "$START_DIR"
+mv "$BUILD_DIR/layer.zip" "$OUTPUT"
+rm -rf "$BUILD_DIR"
+
+echo "Layer written to $OUTPUT, upload it to the SourceS3Bucket before deploying the CloudFormation template."
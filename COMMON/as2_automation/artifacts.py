@@ -0,0 +1,216 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import hashlib
+import logging
+import os
+import posixpath
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .clients import get_client
+
+logger = logging.getLogger(__name__)
+
+# Artifacts are staged on the image builder under this directory unless an entry names its own destination
+default_destination = "/tmp/as2_artifacts"
+
+# Artifact sources are read from S3, or from the S3-compatible object store at the Artifact_Endpoint_Url endpoint
+artifact_endpoint_url = os.environ.get('Artifact_Endpoint_Url')
+
+# Objects are fetched in parts of part_size with ranged GETs and each part is written at its offset on an SFTP channel
+# of its own, so a large installer is spread over the channels like a set of small ones
+part_size = 64 * 1048576
+chunk_size = 1048576
+default_concurrency = 4
+max_concurrency = 16
+
+# Destinations are created and verified through sudo so artifacts can be staged anywhere on the builder,
+# each file is handed to the connecting user while its parts are written
+privileged = "sudo -n "
+
+
+# Raised when an artifact cannot be read from its source, written to the image builder or fails its checksum
+class ArtifactTransferError(Exception):
+    pass
+
+
+# Normalise an entry of the artifact list, either an S3 URI or a dict with its own destination, checksum and mode
+# {"Source": "s3://bucket/key", "Destination": "/opt/installers/app.rpm", "Sha256": "hex digest", "Mode": "0644"}
+def normalise_artifact(entry):
+    if not isinstance(entry, dict) :
+        entry = {'Source' : entry}
+
+    source = entry['Source']
+    bucket, _, key = source[len("s3://"):].partition("/") if source.startswith("s3://") else ("", "", "")
+    if not bucket or not key or key.endswith("/") :
+        raise ValueError("Artifact source " + source + " must be an S3 URI of an object, s3://bucket/key.")
+    destination = entry.get('Destination') or posixpath.join(default_destination, posixpath.basename(key))
+    if not posixpath.isabs(destination) :
+        raise ValueError("Artifact destination " + destination + " must be an absolute path.")
+
+    return {
+        'Source' : source,
+        'Bucket' : bucket,
+        'Key' : key,
+        'Destination' : posixpath.normpath(destination),
+        'Sha256' : entry['Sha256'].lower() if entry.get('Sha256') else None,
+        'Mode' : str(entry.get('Mode', "0644"))
+    }
+
+
+# Byte ranges of the parts of an object, as (offset, length)
+def get_parts(size):
+    return [(offset, min(part_size, size - offset)) for offset in range(0, size, part_size)]
+
+
+# Shell command printing the SHA-256 of a file, or of length bytes from offset, as one line even when the file is missing
+def digest_command(path, offset=None, length=None):
+    if offset is None :
+        return "echo $(" + privileged + "sha256sum < " + shlex.quote(path) + " 2>/dev/null | cut -c1-64)"
+    return ("echo $(" + privileged + "dd if=" + shlex.quote(path) + " iflag=skip_bytes,count_bytes skip=" + str(offset) + " count=" + str(length)
+        + " bs=" + str(chunk_size) + " status=none 2>/dev/null | sha256sum | cut -c1-64)")
+
+
+# Shell script preparing every destination in one round trip, printing one line for each artifact:
+# PRESENT when the destination already holds the declared checksum, READY when the file was created at its full size
+def prepare_script(artifacts):
+    lines = []
+    for index, artifact in enumerate(artifacts) :
+        destination = shlex.quote(artifact['Destination'])
+        create = (privileged + "mkdir -p " + shlex.quote(posixpath.dirname(artifact['Destination'])) + " && " + privileged + "truncate -s 0 " + destination
+            + " && " + privileged + "truncate -s " + str(artifact['Size']) + " " + destination + " && " + privileged + "chown $(id -u):$(id -g) " + destination
+            + " && chmod u+w " + destination + " && echo READY " + str(index) + " || echo FAILED " + str(index))
+        if artifact['Sha256'] :
+            lines.append("if [ \"$(" + digest_command(artifact['Destination']) + ")\" = " + artifact['Sha256'] + " ]; then echo PRESENT " + str(index) + "; else " + create + "; fi")
+        else :
+            lines.append(create)
+    return "\n".join(lines)
+
+
+# Shell script applying the mode of each transferred artifact and printing the SHA-256 of each check, one line per check
+def verify_script(checks, artifacts):
+    lines = [privileged + "chmod " + shlex.quote(artifact['Mode']) + " " + shlex.quote(artifact['Destination']) for artifact in artifacts]
+    lines += [digest_command(path, offset, length) for path, offset, length, expected in checks]
+    return "\n".join(lines)
+
+
+# Fetch one part of an artifact from its source and write it at its offset on the image builder, returns its SHA-256
+def transfer_part(ssh, source, artifact, offset, length, progress):
+    digest = hashlib.sha256()
+    body = source.get_object(Bucket=artifact['Bucket'], Key=artifact['Key'], Range="bytes=" + str(offset) + "-" + str(offset + length - 1))['Body']
+
+    def chunks():
+        for chunk in body.iter_chunks(chunk_size) :
+            digest.update(chunk)
+            yield chunk
+
+    started = time.time()
+    ssh.put_part(artifact['Destination'], offset, chunks())
+    with progress['Lock'] :
+        timing = progress['Timings'].setdefault(artifact['Destination'], [started, started])
+        timing[0] = min(timing[0], started)
+        timing[1] = max(timing[1], time.time())
+    return digest.hexdigest()
+
+
+# Stream the artifacts from their source into the image builder over the SSH session, at most concurrency parts at once
+# Artifacts whose destination already holds their declared checksum are skipped, so a retried install does not push them again
+# Every transferred file is verified on the builder, against its declared checksum or part by part against the checksums
+# of the bytes read from the source, and an ArtifactTransferError lists any artifact that failed
+# Returns the transfer report with the bytes, time and throughput of each artifact and of the whole set
+def push_artifacts(ssh, entries, concurrency=default_concurrency):
+    artifacts = [normalise_artifact(entry) for entry in entries]
+    concurrency = max(1, min(int(concurrency), max_concurrency))
+    source = get_client('s3', endpoint_url=artifact_endpoint_url)
+    started = time.time()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor :
+        try :
+            sizes = list(executor.map(lambda artifact : source.head_object(Bucket=artifact['Bucket'], Key=artifact['Key'])['ContentLength'], artifacts))
+        except Exception as e :
+            raise ArtifactTransferError("Unable to read artifact source: " + str(e))
+        for artifact, size in zip(artifacts, sizes) :
+            artifact['Size'] = size
+
+        # One round trip skips artifacts already present and creates every other destination at its full size
+        states = {}
+        for line in ssh.run(prepare_script(artifacts), log_output=False).std_out.decode(errors='replace').splitlines() :
+            fields = line.split()
+            if len(fields) == 2 and fields[1].isdigit() :
+                states[int(fields[1])] = fields[0]
+        unprepared = [artifact['Destination'] for index, artifact in enumerate(artifacts) if states.get(index) not in ("PRESENT", "READY")]
+        if unprepared :
+            raise ArtifactTransferError("Unable to create artifact destinations on the image builder: " + ", ".join(unprepared))
+        pending = [artifact for index, artifact in enumerate(artifacts) if states[index] == "READY"]
+        logger.info("Pushing %s of %s artifact(s), %s bytes, on up to %s SFTP channels.", len(pending), len(artifacts), sum(artifact['Size'] for artifact in pending), concurrency)
+
+        # Parts of every artifact are queued together, the channels stay busy until the last part of the set
+        progress = {'Lock' : threading.Lock(), 'Timings' : {}}
+        futures = []
+        for artifact in pending :
+            for offset, length in get_parts(artifact['Size']) :
+                futures.append((artifact, offset, length, executor.submit(transfer_part, ssh, source, artifact, offset, length, progress)))
+        checks = []
+        errors = []
+        for artifact, offset, length, future in futures :
+            try :
+                digest = future.result()
+            except Exception as e :
+                errors.append(artifact['Destination'] + " at offset " + str(offset) + ": " + str(e))
+                continue
+            if not artifact['Sha256'] and len(get_parts(artifact['Size'])) == 1 :
+                checks.append((artifact['Destination'], None, None, digest))
+            elif not artifact['Sha256'] :
+                checks.append((artifact['Destination'], offset, length, digest))
+        if errors :
+            raise ArtifactTransferError("Unable to push artifacts: " + "; ".join(errors))
+    transferred = time.time()
+
+    # Files with a declared checksum are verified whole, those without part by part
+    checks += [(artifact['Destination'], None, None, artifact['Sha256']) for artifact in pending if artifact['Sha256']]
+    digests = ssh.run(verify_script(checks, pending), log_output=False).std_out.decode(errors='replace').splitlines()
+    mismatched = sorted({path for (path, offset, length, expected), digest in zip(checks, digests + [""] * len(checks)) if digest.strip() != expected})
+    if mismatched :
+        raise ArtifactTransferError("Artifacts failed checksum verification on the image builder: " + ", ".join(mismatched))
+
+    files = []
+    for artifact in artifacts :
+        timing = progress['Timings'].get(artifact['Destination'])
+        seconds = round(timing[1] - timing[0], 2) if timing else 0
+        files.append({
+            'Source' : artifact['Source'],
+            'Destination' : artifact['Destination'],
+            'Bytes' : artifact['Size'],
+            'Status' : "Transferred" if artifact in pending else "Present",
+            'Parts' : len(get_parts(artifact['Size'])) if artifact in pending else 0,
+            'Seconds' : seconds,
+            'MiBps' : round(artifact['Size'] / 1048576 / seconds, 1) if seconds else None
+        })
+    transferred_bytes = sum(artifact['Size'] for artifact in pending)
+    seconds = transferred - started
+    report = {
+        'Files' : files,
+        'Bytes' : transferred_bytes,
+        'Concurrency' : concurrency,
+        'Seconds' : round(seconds, 2),
+        'VerifySeconds' : round(time.time() - transferred, 2),
+        'MiBps' : round(transferred_bytes / 1048576 / seconds, 1) if seconds else None
+    }
+    logger.info("Pushed %s bytes in %s seconds, %s MiB/s, verified in %s seconds.", transferred_bytes, report['Seconds'], report['MiBps'], report['VerifySeconds'])
+    return report
@@ -0,0 +1,57 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import threading
+import boto3
+from botocore.config import Config
+from . import rate_limit, trace
+
+# Settings shared by every client: standard retry mode backs off on throttling across all AWS APIs,
+# and a larger connection pool lets threads of one invocation share a client without waiting for a socket
+client_config = Config(
+    retries={
+        'max_attempts': 8,
+        'mode': 'standard'
+    },
+    max_pool_connections=50,
+    connect_timeout=5,
+    read_timeout=60
+)
+
+# AWS service clients, built on first use and reused by warm invocations of this container
+clients = {}
+
+# Creating clients from the default boto3 session is not thread safe, threads creating a client take turns
+client_lock = threading.Lock()
+
+
+# Services whose calls wait for a token from the rate limiter shared by every execution
+rate_limited_services = ('appstream',)
+
+
+# Get AWS service client, creating it on first use
+# An endpoint URL points the client at a compatible service, such as an S3-compatible object store
+def get_client(service, region=None, endpoint_url=None):
+    if (service, region, endpoint_url) not in clients :
+        with client_lock :
+            if (service, region, endpoint_url) not in clients :
+                client = boto3.client(service, region_name=region, endpoint_url=endpoint_url, config=client_config)
+                if service in rate_limited_services :
+                    rate_limit.attach_rate_limiter(client)
+                trace.attach_tracer(client)
+                clients[(service, region, endpoint_url)] = client
+    return clients[(service, region, endpoint_url)]
@@ -0,0 +1,91 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# What to do when a command exits non-zero: stop the plan, carry on, or retry with backoff before stopping
+failure_policies = ("fail", "continue", "retry")
+
+# Defaults for commands passed as plain strings or without a full policy
+default_retries = 2
+default_backoff_seconds = 10
+
+# Bytes of stderr kept in the result of a failed command, execution state is limited in size
+error_tail_bytes = 512
+
+
+# Raised when a command with the fail or retry policy fails, the message carries the per-command results
+class CommandFailedError(Exception):
+    pass
+
+
+# Normalise an entry of a command array, either a command string or a dict with its own failure policy
+# {"Command": "...", "OnFailure": "fail" | "continue" | "retry", "Retries": 2, "BackoffSeconds": 10}
+def normalise_command(command, on_failure="fail"):
+    if not isinstance(command, dict) :
+        command = {'Command' : command}
+
+    step = {
+        'Command' : command['Command'],
+        'OnFailure' : command.get('OnFailure', on_failure),
+        'Retries' : command.get('Retries', default_retries if command.get('OnFailure') == "retry" else 0),
+        'BackoffSeconds' : command.get('BackoffSeconds', default_backoff_seconds)
+    }
+    if step['OnFailure'] not in failure_policies :
+        raise ValueError("OnFailure for command " + step['Command'] + " must be one of " + ", ".join(failure_policies) + ".")
+    if step['OnFailure'] != "retry" :
+        step['Retries'] = 0
+    return step
+
+
+# Backoff before a retry, doubling with each attempt
+def retry_delay(step, attempt):
+    return step['BackoffSeconds'] * 2 ** (attempt - 1)
+
+
+# Run a command under its failure policy, run is called with the command and returns a CommandResult
+# Status is Succeeded, Continued (failed under the continue policy) or Failed
+def run_with_policy(run, step):
+    start = time.time()
+    attempts = 0
+    while True :
+        attempts += 1
+        result = run(step['Command'])
+        if result.status_code == 0 :
+            status = "Succeeded"
+            break
+        if attempts <= step['Retries'] :
+            logger.info("Command exited with status %s, retrying in %s seconds: %s", result.status_code, retry_delay(step, attempts), step['Command'])
+            time.sleep(retry_delay(step, attempts))
+            continue
+        status = "Continued" if step['OnFailure'] == "continue" else "Failed"
+        logger.info("Command exited with status %s after %s attempt(s), %s: %s", result.status_code, attempts, status, step['Command'])
+        break
+
+    command_result = {
+        'Command' : step['Command'],
+        'Status' : status,
+        'ExitStatus' : result.status_code,
+        'Attempts' : attempts,
+        'DurationSeconds' : round(time.time() - start, 1)
+    }
+    if status != "Succeeded" and result.std_err :
+        command_result['StdErr'] = result.std_err[-error_tail_bytes:].decode(errors='replace')
+    return command_result
@@ -0,0 +1,237 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from .clients import get_client
+from .metrics import put_metrics
+
+logger = logging.getLogger(__name__)
+
+# Build requests are queued as JSON messages: {"Team": "name", "Priority": 0, "Input": {Step Function input}}
+# Higher priorities are admitted first within a team, teams share the build capacity in proportion to their weight
+default_team = "default"
+default_priority = 0
+
+# Requests read from the queue in one dispatch, the rest stay queued until capacity frees up
+max_requests_read = 100
+
+# Time requests read but not admitted are hidden from other readers while the dispatch decides
+decision_seconds = 60
+
+# Longest a receive waits for a request, long polling asks every SQS server so queued requests are not missed
+# as they can be by a short poll, which only samples some servers. Once the queue is empty the dispatch waits this long
+receive_wait_seconds = 5
+
+# Execution names carry the owning team, so the share of running builds can be counted from the execution list
+execution_name_separator = "_"
+
+
+# Queued build requests in an SQS queue
+class SqsQueue :
+    def __init__(self, url):
+        self.url = url
+
+    # Receive up to count requests, as (request, receipt) pairs
+    def receive(self, count):
+        received = []
+        while len(received) < count :
+            response = get_client('sqs').receive_message(
+                QueueUrl=self.url,
+                MaxNumberOfMessages=min(10, count - len(received)),
+                VisibilityTimeout=decision_seconds,
+                WaitTimeSeconds=receive_wait_seconds,
+                AttributeNames=['SentTimestamp']
+            )
+            if not response.get('Messages') :
+                break
+            for message in response['Messages'] :
+                received.append((parse_request(message['Body'], message['MessageId'], int(message['Attributes']['SentTimestamp']) / 1000), message['ReceiptHandle']))
+        return received
+
+    def delete(self, receipt):
+        get_client('sqs').delete_message(QueueUrl=self.url, ReceiptHandle=receipt)
+
+    # Make a request not admitted by this dispatch visible again for the next one
+    def release(self, receipt):
+        get_client('sqs').change_message_visibility(QueueUrl=self.url, ReceiptHandle=receipt, VisibilityTimeout=0)
+
+    # Approximate number of requests waiting in the queue, not counting those being decided on
+    def depth(self):
+        attributes = get_client('sqs').get_queue_attributes(QueueUrl=self.url, AttributeNames=['ApproximateNumberOfMessages'])['Attributes']
+        return int(attributes['ApproximateNumberOfMessages'])
+
+
+# In memory stand-in for the SQS queue, for local runs and testing
+class LocalQueue :
+    def __init__(self):
+        self.messages = {}
+        self.hidden = set()
+        self.lock = threading.Lock()
+
+    def send(self, body):
+        with self.lock :
+            message_id = uuid.uuid4().hex
+            self.messages[message_id] = (body, time.time())
+            return message_id
+
+    def receive(self, count):
+        with self.lock :
+            visible = [message_id for message_id in self.messages if message_id not in self.hidden][:count]
+            self.hidden.update(visible)
+            return [(parse_request(self.messages[message_id][0], message_id, self.messages[message_id][1]), message_id) for message_id in visible]
+
+    def delete(self, receipt):
+        with self.lock :
+            self.messages.pop(receipt, None)
+            self.hidden.discard(receipt)
+
+    def release(self, receipt):
+        with self.lock :
+            self.hidden.discard(receipt)
+
+    def depth(self):
+        with self.lock :
+            return len(self.messages) - len(self.hidden)
+
+
+# Parse a queued build request, returns None if the message is not a valid request
+def parse_request(body, message_id, enqueued_at):
+    try :
+        request = json.loads(body)
+        team = re.sub(r'[^A-Za-z0-9-]', "-", str(request.get('Team') or default_team))[:32]
+        return {
+            'RequestId' : message_id,
+            'Team' : team,
+            'Priority' : int(request.get('Priority', default_priority)),
+            'Input' : request.get('Input', {}),
+            'EnqueuedAt' : enqueued_at
+        }
+    except Exception as e :
+        logger.error(e)
+        logger.info("Discarding invalid build request %s: %s", message_id, body[:200])
+        return None
+
+
+# Name of the execution started for a request, starting it again for the same request fails instead of duplicating it
+def execution_name(request):
+    return request['Team'] + execution_name_separator + request['RequestId'][:80 - len(request['Team']) - 1]
+
+
+# Team that owns a running execution, executions not started by the dispatcher are counted under the default team
+def execution_team(name):
+    return name.split(execution_name_separator, 1)[0] if execution_name_separator in name else default_team
+
+
+# Running builds of the state machine counted by team
+def get_running_builds(state_machine_arn):
+    running = {}
+    for page in get_client('stepfunctions').get_paginator('list_executions').paginate(stateMachineArn=state_machine_arn, statusFilter='RUNNING') :
+        for execution in page['executions'] :
+            team = execution_team(execution['name'])
+            running[team] = running.get(team, 0) + 1
+    return running
+
+
+# Choose the requests to admit into the free capacity
+# Each build goes to the team with the lowest weighted share of running and admitted builds,
+# ties go to the higher priority and then the longer waiting request
+def select_requests(requests, running, capacity, weights):
+    pending = {}
+    for request in sorted(requests, key=lambda request : (-request['Priority'], request['EnqueuedAt'])) :
+        pending.setdefault(request['Team'], []).append(request)
+
+    load = dict(running)
+    admitted = []
+    while pending and len(admitted) < capacity :
+        team = min(pending, key=lambda team : (
+            load.get(team, 0) / weights.get(team, 1),
+            -pending[team][0]['Priority'],
+            pending[team][0]['EnqueuedAt']
+        ))
+        admitted.append(pending[team].pop(0))
+        load[team] = load.get(team, 0) + 1
+        if not pending[team] :
+            del pending[team]
+    return admitted
+
+
+# Admit queued build requests while there is free capacity, start is called with each admitted request
+# max_builds is a fixed number set with the stack, AppStream image builder quotas are per instance type and the instance
+# type of a request is only chosen once its execution runs, so the capacity is not read from Service Quotas
+# Returns a report of the dispatch, with queue depth, wait time and throughput metrics published as it runs
+def dispatch(queue, running, max_builds, weights, start):
+    capacity = max(0, max_builds - sum(running.values()))
+    received = queue.receive(max_requests_read) if capacity else []
+
+    # Invalid messages would be received again by every dispatch
+    requests = {}
+    for request, receipt in received :
+        if request :
+            requests[request['RequestId']] = (request, receipt)
+        else :
+            queue.delete(receipt)
+
+    admitted = select_requests([request for request, receipt in requests.values()], running, capacity, weights)
+    started = []
+    now = time.time()
+    for request in admitted :
+        receipt = requests.pop(request['RequestId'])[1]
+        try :
+            start(request)
+        except Exception as e :
+            logger.error(e)
+            logger.info("Unable to start build %s for team %s, leaving it queued.", request['RequestId'], request['Team'])
+            queue.release(receipt)
+            continue
+        queue.delete(receipt)
+        started.append(request)
+        waited = int(now - request['EnqueuedAt'])
+        logger.info("Started build %s for team %s at priority %s after %s seconds in the queue.", request['RequestId'], request['Team'], request['Priority'], waited)
+        put_metrics({'Team' : request['Team']}, {'QueueWaitTime' : (waited, "Seconds"), 'BuildsStarted' : (1, "Count")})
+
+    for request, receipt in requests.values() :
+        queue.release(receipt)
+
+    report = {
+        'Capacity' : capacity,
+        'Running' : running,
+        'Started' : [request['RequestId'] for request in started],
+        'QueueDepth' : queue.depth()
+    }
+    put_metrics({'Dispatcher' : "Builds"}, {
+        'QueueDepth' : (report['QueueDepth'], "Count"),
+        'RunningBuilds' : (sum(running.values()) + len(started), "Count"),
+        'BuildsStarted' : (len(started), "Count")
+    })
+    logger.info("Dispatch complete: %s builds running, %s started, %s still queued.", sum(running.values()) + len(started), len(started), report['QueueDepth'])
+    return report
+
+
+# Start a Step Functions execution for an admitted request
+def start_build(state_machine_arn, request):
+    try :
+        get_client('stepfunctions').start_execution(
+            stateMachineArn=state_machine_arn,
+            name=execution_name(request),
+            input=json.dumps(request['Input'])
+        )
+    except get_client('stepfunctions').exceptions.ExecutionAlreadyExists :
+        logger.info("Build %s was already started by a previous dispatch.", request['RequestId'])
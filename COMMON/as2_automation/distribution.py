@@ -0,0 +1,162 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import botocore
+from .clients import get_client
+from .metrics import put_metrics
+
+logger = logging.getLogger(__name__)
+
+# Copies started for each region before it is reported as failed, a copy that ends FAILED is deleted and started again
+max_copy_attempts = 3
+
+# copy_image errors retried on a later poll, the region stays pending meanwhile
+transient_errors = ("ThrottlingException", "LimitExceededException", "ResourceNotAvailableException", "ConcurrentModificationException")
+max_start_retries = 10
+
+# Region states that need no further polling
+settled_states = ("Available", "Failed")
+
+
+# Destination regions from a list or a comma separated string, False when there are none
+def parse_regions(regions):
+    if isinstance(regions, str) :
+        regions = regions.split(",")
+    regions = [region.strip() for region in regions or [] if region and region.strip()]
+    return regions or False
+
+
+# Distribution state of an image, carried in the execution state between polls with one entry for each destination region
+def new_distribution(image_name, source_region, regions):
+    return {
+        'ImageName' : image_name,
+        'SourceRegion' : source_region,
+        'Status' : "Running",
+        'StartedAt' : time.time(),
+        'Regions' : [
+            {'Region' : region, 'Status' : "Pending", 'Attempts' : 0, 'Retries' : 0}
+            for region in parse_regions(regions) or [] if region != source_region
+        ]
+    }
+
+
+# Start copying the image to the region of a pending entry
+# Transient errors leave it pending for the next poll, any other error fails the region
+def start_copy(distribution, copy):
+    try :
+        get_client('appstream', distribution['SourceRegion']).copy_image(
+            SourceImageName=distribution['ImageName'],
+            DestinationImageName=distribution['ImageName'],
+            DestinationRegion=copy['Region'],
+            DestinationImageDescription="Copied from " + distribution['SourceRegion'] + " by the image automation."
+        )
+    except botocore.exceptions.ClientError as error :
+        code = error.response['Error']['Code']
+        if code == "ResourceAlreadyExistsException" :
+            # Started by an earlier invocation whose result was lost, the existing copy is polled
+            logger.info("Copy of %s to %s already exists.", distribution['ImageName'], copy['Region'])
+        elif code in transient_errors and copy['Retries'] < max_start_retries :
+            copy['Retries'] += 1
+            copy['Error'] = code
+            logger.info("Copy of %s to %s not started, %s, retrying on the next poll.", distribution['ImageName'], copy['Region'], code)
+            return
+        else :
+            logger.error(error)
+            copy['Status'] = "Failed"
+            copy['Error'] = code + ": " + error.response['Error'].get('Message', "")
+            return
+    copy['Attempts'] += 1
+    copy['Status'] = "Copying"
+    copy['StartedAt'] = time.time()
+    copy.pop('Error', None)
+    logger.info("Copying %s to %s, attempt %s.", distribution['ImageName'], copy['Region'], copy['Attempts'])
+
+
+# State of the image in a region, None while the copy is not visible there yet and when the describe call failed
+def describe_copy(image_name, region):
+    try :
+        images = get_client('appstream', region).describe_images(Names=[image_name])['Images']
+    except Exception as error :
+        if not (isinstance(error, botocore.exceptions.ClientError) and error.response['Error']['Code'] == "ResourceNotFoundException") :
+            logger.error(error)
+        return None
+    return images[0]['State'] if images else None
+
+
+# Delete a copy that ended FAILED so it can be started again, the image name would otherwise be taken
+def delete_copy(image_name, region):
+    try :
+        get_client('appstream', region).delete_image(Name=image_name)
+    except Exception as error :
+        logger.error(error)
+
+
+# Advance the distribution by one poll
+# Every copy in progress is described at once, one thread per region, then finished copies are recorded, failed copies
+# are deleted and retried, and pending regions are started while fewer than max_concurrent copies are in progress
+def advance_distribution(distribution, max_concurrent):
+    copying = [copy for copy in distribution['Regions'] if copy['Status'] == "Copying"]
+    with ThreadPoolExecutor(max_workers=max(1, len(copying))) as executor :
+        states = list(executor.map(lambda copy : describe_copy(distribution['ImageName'], copy['Region']), copying))
+
+    now = time.time()
+    for copy, state in zip(copying, states) :
+        if state == "AVAILABLE" :
+            copy['Status'] = "Available"
+            copy['Seconds'] = round(now - copy['StartedAt'])
+            copy['ReadyAfterSeconds'] = round(now - distribution['StartedAt'])
+            logger.info("Copy of %s to %s available after %s seconds.", distribution['ImageName'], copy['Region'], copy['Seconds'])
+            put_metrics({'Region' : copy['Region']}, {'ImageCopyTime' : (copy['Seconds'], "Seconds")})
+        elif state == "FAILED" :
+            delete_copy(distribution['ImageName'], copy['Region'])
+            copy['Error'] = "Copy ended in FAILED state"
+            copy['Status'] = "Pending" if copy['Attempts'] < max_copy_attempts else "Failed"
+            logger.info("Copy of %s to %s failed on attempt %s.", distribution['ImageName'], copy['Region'], copy['Attempts'])
+
+    in_progress = len([copy for copy in distribution['Regions'] if copy['Status'] == "Copying"])
+    for copy in distribution['Regions'] :
+        if in_progress >= max_concurrent :
+            break
+        if copy['Status'] == "Pending" :
+            start_copy(distribution, copy)
+            if copy['Status'] == "Copying" :
+                in_progress += 1
+
+    # The image is usable everywhere once the slowest copy is available
+    if all(copy['Status'] in settled_states for copy in distribution['Regions']) :
+        distribution['Status'] = "Complete" if all(copy['Status'] == "Available" for copy in distribution['Regions']) else "Failed"
+        distribution['Seconds'] = max([copy.get('ReadyAfterSeconds', 0) for copy in distribution['Regions']] + [0])
+        logger.info("Distribution of %s %s after %s seconds.", distribution['ImageName'], distribution['Status'].lower(), distribution['Seconds'])
+    return distribution
+
+
+# Notification text listing when the image became available in each region
+def distribution_summary(distribution):
+    lines = [
+        "------------------------------------------------------------------------------",
+        "Image Distribution: " + distribution['Status'] + (", available in every region after " + str(distribution['Seconds']) + " seconds"
+            if distribution['Status'] == "Complete" else ""),
+        "------------------------------------------------------------------------------"
+    ]
+    for copy in distribution['Regions'] :
+        if copy['Status'] == "Available" :
+            lines.append(copy['Region'] + ": available after " + str(copy['ReadyAfterSeconds']) + " seconds, copy took " + str(copy['Seconds']) + " seconds")
+        else :
+            lines.append(copy['Region'] + ": " + copy['Status'] + " after " + str(copy['Attempts']) + " attempt(s)" + (", " + copy['Error'] if copy.get('Error') else ""))
+    return "\n".join(lines) + "\n"
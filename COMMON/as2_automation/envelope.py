@@ -0,0 +1,66 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# Compact execution state agreed between the state machine and the handlers
+# The status polling task reduces the describe_image_builders and describe_images results into:
+#   BuilderStatus : {"Name", "State", "EniPrivateIpAddresses": [ip]}
+#   ImageStatus : {"Name", "State", "Platform": [p], "ImageBuilderName": [name], "AgentVersion": [v], "Applications": [names]}
+# Fields that can be absent are projected as lists, which are empty when the field is absent
+
+
+# First value of a projected list, or default when the field was absent
+def first(values, default=None):
+    return values[0] if values else default
+
+
+# Compact envelope of an image builder, as kept in the execution state
+def builder_envelope(image_builder):
+    address = image_builder.get('NetworkAccessConfiguration', {}).get('EniPrivateIpAddress')
+    return {
+        'Name' : image_builder['Name'],
+        'State' : image_builder['State'],
+        'EniPrivateIpAddresses' : [address] if address else []
+    }
+
+
+# Compact envelope of an image, as kept in the execution state
+def image_envelope(image):
+    return {
+        'Name' : image['Name'],
+        'State' : image['State'],
+        'Platform' : [image['Platform']] if 'Platform' in image else [],
+        'ImageBuilderName' : [image['ImageBuilderName']] if 'ImageBuilderName' in image else [],
+        'AgentVersion' : [image['AppstreamAgentVersion']] if 'AppstreamAgentVersion' in image else [],
+        'Applications' : [application['Name'] for application in image.get('Applications', [])]
+    }
+
+
+# Image builders in the execution state as (name, ip address) pairs, ip address is None until the builder has one
+# A full describe_image_builders response is accepted too, for handlers invoked outside the state machine
+def get_builder_addresses(builder_status):
+    if 'ImageBuilders' in builder_status :
+        builders = [builder_envelope(image_builder) for image_builder in builder_status['ImageBuilders']]
+    else :
+        builders = [builder_status]
+    return [(builder.get('Name'), first(builder.get('EniPrivateIpAddresses'))) for builder in builders]
+
+
+# Name of the image in the execution state, from the compact envelope or a task output listing Images
+def get_image_name(image_status):
+    if 'Images' in image_status :
+        return image_status['Images'][0]['Name']
+    return image_status['Name']
@@ -0,0 +1,46 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+from datetime import datetime
+
+# Image Assistant executable on each image builder platform
+linux_image_assistant = "sudo AppStreamImageAssistant"
+windows_image_assistant = "C:/PROGRA~1/Amazon/Photon/ConsoleImageBuilder/image-assistant.exe"
+
+
+# Generate full image name and Image Assistant create-image command from the automation parameters
+def create_image_command(automation_parameters, image_assistant):
+    # Retrieve image name, default to AS2_Automation_Image
+    image_name = automation_parameters.get('ImageOutputPrefix') or 'AS2_Automation_Image'
+
+    # Retrieve UseLatestAgent, default to True
+    if automation_parameters.get('UseLatestAgent', True) :
+        latest_agent = ' --use-latest-agent-version'
+    else :
+        latest_agent = ' --no-use-latest-agent-version'
+
+    # Retrieve image tags, image is not tagged if none are passed
+    ImageTags = automation_parameters.get('ImageTags', False)
+    if ImageTags :
+        tag_image = ' --tags ' + ImageTags
+    else :
+        tag_image = ''
+
+    # Generate full image name using image name prefix and timestamp
+    full_image_name = image_name + datetime.now().strftime("-%Y-%m-%d-%H-%M-%S")
+
+    return full_image_name, image_assistant + ' create-image --name ' + full_image_name + latest_agent + tag_image
@@ -0,0 +1,154 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Files on a Linux image builder used by the manifest optimiser
+# The base list records which application's manifest first listed each file, one owner and path per line
+optimiser_script = "/tmp/as2_optimise_manifest.sh"
+base_list = "/tmp/as2_manifest_base.txt"
+report_file = "/tmp/as2_manifest_report"
+
+# Pseudo file systems and runtime directories never worth prefetching, lsof and strace both list files under them
+excluded_prefixes = ("/proc/", "/sys/", "/dev/", "/run/")
+
+
+# Shell script optimising a generated manifest in place, the raw manifest is kept next to it as .raw.txt
+# usage as2_optimise_manifest.sh manifest_file app_exe_name budget_mib shared_base
+# Entries are resolved to real paths and kept if they are readable regular files outside the excluded prefixes, once each,
+# in the order they were first listed, which is first-access order for traced manifests
+# With shared_base true, files already owned by another application's manifest are left out and the rest are claimed
+# A non-zero budget_mib keeps files in order while they fit, a file that would exceed the budget is dropped
+# One MANIFEST line per run is appended to the report:
+# MANIFEST app entries_before bytes_before files_after bytes_after shared_files shared_bytes over_budget_files over_budget_bytes
+def optimiser_script_text():
+    return ('''#!/bin/bash
+manifest=$1
+app=$2
+budget=$(( ${3:-0} * 1048576 ))
+shared=${4:-false}
+raw=${manifest%.txt}.raw.txt
+if [ ! -s "$manifest" ]; then
+  echo "No manifest to optimise for $app."
+  exit 0
+fi
+work=$(mktemp -d)
+cp "$manifest" "$raw"
+touch ''' + base_list + ''' ''' + report_file + '''
+
+# Readable regular files listed in the raw manifest, then their sizes and real paths in the same order
+sed 's/ (deleted)$//' "$raw" | while IFS= read -r file; do
+  [[ $file == /* && -f $file && -r $file ]] && printf '%s\\n' "$file"
+done > $work/files
+xargs -r -d '\\n' stat -L -c %s -- < $work/files > $work/sizes
+xargs -r -d '\\n' realpath -- < $work/files > $work/paths
+paste -d '\\t' $work/sizes $work/paths > $work/entries
+
+awk -F '\\t' -v app="$app" -v budget=$budget -v shared=$shared -v entries=$(wc -l < "$raw") -v base=''' + base_list + ''' \\
+  -v kept=$work/kept -v claimed=$work/claimed -v excluded="^(''' + "|".join(excluded_prefixes) + ''')" '
+  FILENAME == base { if (!($2 in owner)) owner[$2] = $1; next }
+  {
+    before += $1
+    if ($2 ~ excluded || seen[$2]++) next
+    if (shared == "true" && ($2 in owner) && owner[$2] != app) { shared_files++; shared_bytes += $1; next }
+    if (budget > 0 && after + $1 > budget) { over_files++; over_bytes += $1; next }
+    files++; after += $1
+    print $2 > kept
+    if (shared == "true" && !($2 in owner)) print app "\\t" $2 > claimed
+  }
+  END {
+    printf "MANIFEST %s %d %d %d %d %d %d %d %d\\n", app, entries, before, files, after, shared_files, shared_bytes, over_files, over_bytes
+  }' ''' + base_list + ''' $work/entries > $work/report
+
+# An application left with an empty manifest is added without one
+if [ -s $work/kept ]; then cp $work/kept "$manifest"; else rm -f "$manifest"; fi
+[ -s $work/claimed ] && cat $work/claimed >> ''' + base_list + '''
+cat $work/report | tee -a ''' + report_file + '''
+rm -rf $work
+''')
+
+
+# Shell command optimising the manifest of one application, appended to its manifest generation step
+# It never fails the step, an application whose manifest could not be optimised is added with the raw manifest
+def optimise_command(manifest_file, app_exe, budget_mib, shared_base):
+    return ("bash " + optimiser_script + " " + manifest_file + " " + app_exe + " " + str(int(budget_mib or 0)) + " "
+        + ("true" if shared_base else "false") + " || true")
+
+
+# Shell command printing the manifest report lines
+def report_collect():
+    return "cat " + report_file + " 2>/dev/null"
+
+
+# Parse the MANIFEST lines of the report into the size of each application's manifest before and after optimisation
+# An application whose step was rerun reports again, its last report is kept
+def parse_manifest_report(lines):
+    manifests = {}
+    for line in lines :
+        fields = line.split()
+        if fields[:1] != ["MANIFEST"] or len(fields) != 10 or not all(field.isdigit() for field in fields[2:]) :
+            continue
+        values = [int(field) for field in fields[2:]]
+        manifests[fields[1]] = {
+            'Application' : fields[1],
+            'EntriesBefore' : values[0],
+            'BytesBefore' : values[1],
+            'FilesAfter' : values[2],
+            'BytesAfter' : values[3],
+            'SharedFiles' : values[4],
+            'SharedBytes' : values[5],
+            'OverBudgetFiles' : values[6],
+            'OverBudgetBytes' : values[7]
+        }
+    if not manifests :
+        return None
+    return {
+        'Applications' : list(manifests.values()),
+        'BytesBefore' : sum(manifest['BytesBefore'] for manifest in manifests.values()),
+        'BytesAfter' : sum(manifest['BytesAfter'] for manifest in manifests.values())
+    }
+
+
+# Size in MiB for the notification, to one decimal place
+def mib(size):
+    return str(round(size / 1048576, 1)) + " MiB"
+
+
+# Notification text listing the manifest of each application before and after optimisation, for every builder that reported
+def manifest_summary(builders):
+    lines = []
+    for builder in builders :
+        report = builder.get('Manifests')
+        if not report :
+            continue
+        lines += [
+            "------------------------------------------------------------------------------",
+            "Application Manifests (" + builder.get('ImageBuilderName', builder.get('IpAddress', "")) + "): "
+                + mib(report['BytesBefore']) + " before optimisation, " + mib(report['BytesAfter']) + " after",
+            "------------------------------------------------------------------------------"
+        ]
+        for manifest in report['Applications'] :
+            line = (manifest['Application'] + ": " + str(manifest['EntriesBefore']) + " entries, " + mib(manifest['BytesBefore'])
+                + " -> " + str(manifest['FilesAfter']) + " files, " + mib(manifest['BytesAfter']))
+            if manifest['SharedFiles'] :
+                line += ", " + str(manifest['SharedFiles']) + " files (" + mib(manifest['SharedBytes']) + ") in the shared base"
+            if manifest['OverBudgetFiles'] :
+                line += ", " + str(manifest['OverBudgetFiles']) + " files (" + mib(manifest['OverBudgetBytes']) + ") over budget"
+            lines.append(line)
+    return "\n".join(lines) + "\n" if lines else ""
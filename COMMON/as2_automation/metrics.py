@@ -0,0 +1,41 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import time
+
+# CloudWatch namespace of the metrics published by the automation functions
+metrics_namespace = "AS2Automation"
+
+
+# Write an embedded metric format record, CloudWatch turns it into metrics without an API call
+# values maps each metric name to a (value, unit) pair, all of them recorded under the same dimensions
+def put_metrics(dimensions, values):
+    record = {
+        '_aws' : {
+            'Timestamp' : int(time.time() * 1000),
+            'CloudWatchMetrics' : [
+                {
+                    'Namespace' : metrics_namespace,
+                    'Dimensions' : [list(dimensions)],
+                    'Metrics' : [{'Name' : name, 'Unit' : unit} for name, (value, unit) in values.items()]
+                }
+            ]
+        }
+    }
+    record.update(dimensions)
+    record.update({name : value for name, (value, unit) in values.items()})
+    print(json.dumps(record))
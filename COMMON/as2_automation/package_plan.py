@@ -0,0 +1,167 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Package manager commands that can be coalesced: [sudo] yum|dnf -y install|update|upgrade|remove|erase [packages] [> /dev/null]
+# Anything else (other options, pipes, command lists, quoting) is left as written
+package_tools = ("yum", "dnf")
+package_actions = {
+    'install' : "install",
+    'update' : "update",
+    'upgrade' : "update",
+    'remove' : "remove",
+    'erase' : "remove"
+}
+package_flags = ("-y", "-q", "--assumeyes", "--quiet")
+shell_characters = re.compile(r'[;&|<>`$\'"(){}\\]')
+
+
+# Parse a package manager command, returns None if it cannot safely be merged with others
+def parse_package_command(command):
+    tokens = command.split()
+    quiet = False
+    if tokens[-2:] == [">", "/dev/null"] :
+        tokens, quiet = tokens[:-2], True
+    elif tokens[-1:] == [">/dev/null"] :
+        tokens, quiet = tokens[:-1], True
+
+    sudo = tokens[:1] == ["sudo"]
+    if sudo :
+        tokens = tokens[1:]
+    if len(tokens) < 2 or tokens[0] not in package_tools or any(shell_characters.search(token) for token in tokens) :
+        return None
+
+    flags = [token for token in tokens[1:] if token in package_flags]
+    arguments = [token for token in tokens[1:] if token not in package_flags]
+    if "-y" not in flags and "--assumeyes" not in flags :
+        return None
+    if not arguments or arguments[0] not in package_actions or any(argument.startswith("-") for argument in arguments) :
+        return None
+
+    action = package_actions[arguments[0]]
+    packages = arguments[1:]
+    if action != "update" and not packages :
+        return None
+
+    return {
+        'Tool' : tokens[0],
+        'Sudo' : sudo,
+        'Action' : action,
+        # A bare update updates every package, represented by None
+        'Packages' : packages or None,
+        'Quiet' : quiet
+    }
+
+
+# Steps are only merged when a failure of the merged transaction is handled the same way as each original command
+def same_policy(step, other):
+    return all(step[key] == other[key] for key in ('OnFailure', 'Retries', 'BackoffSeconds'))
+
+
+# Step whose failure policy a merged transaction runs under, the first step that is not optional
+# Optional steps install packages the automation adds for itself, such as Xvfb, and merge whatever their policy
+# yum skips packages it cannot find, so an optional package missing from the repositories does not fail the others
+def policy_step(steps):
+    return next((step for step in steps if not step.get('Optional')), steps[0])
+
+
+# Whether a step can join a run of package manager steps
+def joins_run(run, step, parsed):
+    if parsed['Tool'] != run[0][1]['Tool'] :
+        return False
+    policy = policy_step([other for other, other_parsed in run])
+    return step.get('Optional') or policy.get('Optional') or same_policy(step, policy)
+
+
+# Merge the packages of a run of consecutive package manager steps into as few transactions as possible
+# Installs and updates commute and are merged across each other, a remove ends the segment they can be merged in,
+# because a later install may depend on a removed package and removing after it would take the install with it
+def merge_run(run):
+    transactions = []
+    segment_start = 0
+    for step, parsed in run :
+        if parsed['Action'] == "remove" :
+            target = transactions[-1] if transactions and transactions[-1]['Action'] == "remove" else None
+        else :
+            target = next((transaction for transaction in transactions[segment_start:] if transaction['Action'] == parsed['Action']), None)
+
+        if target :
+            target['Steps'].append(step)
+            target['Sudo'] = target['Sudo'] or parsed['Sudo']
+            target['Quiet'] = target['Quiet'] and parsed['Quiet']
+            if target['Packages'] is None or parsed['Packages'] is None :
+                target['Packages'] = None
+            else :
+                target['Packages'] += [package for package in parsed['Packages'] if package not in target['Packages']]
+        else :
+            transactions.append(dict(parsed, Steps=[step], Packages=parsed['Packages'] and list(parsed['Packages'])))
+            if parsed['Action'] == "remove" :
+                segment_start = len(transactions)
+
+    merged = []
+    for transaction in transactions :
+        if len(transaction['Steps']) == 1 :
+            merged.append(transaction['Steps'][0])
+            continue
+        command = ("sudo " if transaction['Sudo'] else "") + transaction['Tool'] + " -y " + transaction['Action']
+        if transaction['Packages'] :
+            command += " " + " ".join(transaction['Packages'])
+        if transaction['Quiet'] :
+            command += " > /dev/null"
+        step = dict(policy_step(transaction['Steps']), Command=command)
+        step['CoalescedCommands'] = [original['Command'] for original in transaction['Steps']]
+        logger.info("Coalesced %s package commands into: %s", len(transaction['Steps']), command)
+        merged.append(step)
+    return merged
+
+
+# Count the transactions saved by a step yielded from the optimised plan
+def record_saving(step, report):
+    report['TransactionsSaved'] += len(step.get('CoalescedCommands', [step])) - 1
+    report['TransactionsAfter'] = report['TransactionsBefore'] - report['TransactionsSaved']
+    return step
+
+
+# Coalesce consecutive yum/dnf commands of a command plan, with no other command between them, into fewer transactions
+# Steps are read and yielded as a stream, report is filled with the package transactions saved as the plan is read
+def coalesce_package_commands(plan, report):
+    report.update({
+        'TransactionsBefore' : 0,
+        'TransactionsAfter' : 0,
+        'TransactionsSaved' : 0
+    })
+    run = []
+    for step in plan :
+        # Steps of a parallel group are left alone, they run at the same time as each other
+        parsed = parse_package_command(step['Command']) if not step.get('Group') else None
+        if parsed :
+            report['TransactionsBefore'] += 1
+        if run and parsed and joins_run(run, step, parsed) :
+            run.append((step, parsed))
+            continue
+        for merged in merge_run(run) :
+            yield record_saving(merged, report)
+        run = [(step, parsed)] if parsed else []
+        if not parsed :
+            yield step
+
+    for merged in merge_run(run) :
+        yield record_saving(merged, report)
+    logger.info("Package transactions in command plan: %s, after coalescing: %s.", report['TransactionsBefore'], report['TransactionsAfter'])
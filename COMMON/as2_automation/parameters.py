@@ -0,0 +1,76 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Lambda environment variables, read once per container
+environment = None
+
+# Marks a parameter that has no default and must be present in the event data
+REQUIRED = object()
+
+
+# Default value read from a Lambda environment variable
+class Env :
+    def __init__(self, name):
+        self.name = name
+
+
+# Get Lambda environment variable, raising KeyError if it is not defined and has no default
+def get_env(name, default=REQUIRED):
+    global environment
+    if environment is None :
+        environment = dict(os.environ)
+    if default is REQUIRED :
+        return environment[name]
+    return environment.get(name, default)
+
+
+# Resolve every parameter in the schema from the source dictionary, injecting defaults for those not found
+# The schema is a list of (name, default) pairs, where default is a value, an Env or REQUIRED
+def resolve(source, schema):
+    parameters = {}
+    for name, default in schema :
+        if name in source :
+            parameters[name] = source[name]
+            logger.info("%s found in event data, setting to: %s.", name, parameters[name])
+        elif default is REQUIRED :
+            raise KeyError("Required parameter " + name + " not found in event data.")
+        elif isinstance(default, Env) :
+            parameters[name] = get_env(default.name)
+            logger.info("%s not found in event data, defaulting to %s environment variable: %s.", name, default.name, parameters[name])
+        else :
+            parameters[name] = default
+            logger.info("%s not found in event data, defaulting to: %s.", name, default)
+    return parameters
+
+
+# Get SSH key parameter name from event data, by name or ARN, defaulting to the ARN in the Lambda environment
+def get_ssh_key_name(event):
+    if 'ImageBuilderSSHKeyARN' in event :
+        ImageBuilderSSHKeyARN = event['ImageBuilderSSHKeyARN']
+    elif 'ImageBuilderSSHKeyName' in event :
+        return event['ImageBuilderSSHKeyName']
+    else :
+        ImageBuilderSSHKeyARN = get_env('Default_ImageBuilderSSHKeyARN')
+
+    # Obtain SSH key name from ARN, split the ARN then remove the leading word parameter
+    ARNtoName = ImageBuilderSSHKeyARN.split(':')
+    return ARNtoName[5].lstrip("parameter")
@@ -0,0 +1,108 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import hashlib
+import json
+import logging
+from urllib.parse import urlparse
+from .clients import get_client
+
+logger = logging.getLogger(__name__)
+
+# Command plans kept outside the execution state are JSON Lines files, one ImageBuilderCommands entry per line,
+# either a command string or an object. Blank lines and lines starting with # are ignored
+comment_prefix = b"#"
+
+
+# Split a plan location into its source and path, s3://bucket/key or a local file path (file:// or plain)
+def parse_location(location):
+    parsed = urlparse(location)
+    if parsed.scheme == "s3" :
+        return "s3", parsed.netloc, parsed.path.lstrip("/")
+    if parsed.scheme in ("", "file") :
+        return "file", None, parsed.path
+    raise ValueError("Unsupported command plan location " + location + ", use s3://bucket/key or a file path.")
+
+
+# Stream the lines of a plan without their line endings, S3 objects are read in chunks
+# etag pins the S3 object that was described, a plan replaced since fails with PreconditionFailed
+def iter_plan_lines(location, etag=None):
+    source, bucket, path = parse_location(location)
+    if source == "s3" :
+        request = {
+            'Bucket' : bucket,
+            'Key' : path
+        }
+        if etag :
+            request['IfMatch'] = etag
+        body = get_client('s3').get_object(**request)['Body']
+        try :
+            for line in body.iter_lines() :
+                yield line
+        finally :
+            body.close()
+    else :
+        with open(path, 'rb') as plan_file :
+            for line in plan_file :
+                yield line.rstrip(b"\r\n")
+
+
+# Parse one plan line, returns None for blank and comment lines
+def parse_plan_line(line, number):
+    line = line.strip()
+    if not line or line.startswith(comment_prefix) :
+        return None
+    try :
+        return json.loads(line)
+    except ValueError as e :
+        raise ValueError("Line " + str(number) + " of command plan is not valid JSON: " + str(e))
+
+
+# Read a plan once to validate it and build the reference carried in the execution state instead of the commands
+def describe_plan(location):
+    etag = None
+    source, bucket, path = parse_location(location)
+    if source == "s3" :
+        etag = get_client('s3').head_object(Bucket=bucket, Key=path)['ETag']
+
+    digest = hashlib.sha256()
+    entries = 0
+    for number, line in enumerate(iter_plan_lines(location, etag), 1) :
+        digest.update(line + b"\n")
+        if parse_plan_line(line, number) is not None :
+            entries += 1
+
+    reference = {
+        'Location' : location,
+        'Sha256' : digest.hexdigest(),
+        'ETag' : etag,
+        'Entries' : entries
+    }
+    logger.info("Command plan %s has %s entries, sha256 %s.", location, entries, reference['Sha256'])
+    return reference
+
+
+# Stream the entries of a described plan, its content hash is checked when the stream ends
+def iter_plan_entries(reference):
+    digest = hashlib.sha256()
+    for number, line in enumerate(iter_plan_lines(reference['Location'], reference.get('ETag')), 1) :
+        digest.update(line + b"\n")
+        entry = parse_plan_line(line, number)
+        if entry is not None :
+            yield entry
+
+    if digest.hexdigest() != reference['Sha256'] :
+        raise ValueError("Command plan " + reference['Location'] + " changed after it was described, expected sha256 " + reference['Sha256'] + ".")
@@ -0,0 +1,137 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import botocore
+from .clients import get_client
+from .plan_source import describe_plan
+from .remote import get_key_type, key_classes, load_builder_credentials
+
+logger = logging.getLogger(__name__)
+
+
+# Raised when any preflight check fails, the message carries the consolidated report
+class PreflightError(Exception):
+    pass
+
+
+# Check the SSM parameter exists and holds a private key of a type the Linux functions can load
+def check_ssh_key(parameter_name):
+    response = get_client('ssm').get_parameters(
+        Names=[parameter_name],WithDecryption=True
+    )
+    if response['InvalidParameters'] :
+        raise Exception("SSM parameter " + parameter_name + " not found.")
+    if "PRIVATE KEY" not in response['Parameters'][0]['Value'] :
+        raise Exception("SSM parameter " + parameter_name + " does not contain a private key.")
+    key_type = get_key_type(response['Parameters'][0]['Value'])
+    if key_type not in key_classes :
+        raise Exception("SSM parameter " + parameter_name + " does not contain an Ed25519, ECDSA or RSA private key in OpenSSH or PEM format.")
+    return "SSH key parameter " + parameter_name + " found, holding a " + key_type + " key."
+
+
+# Check the image builder administrator secret can be read and decoded
+def check_builder_secret():
+    user, password = load_builder_credentials()
+    return "Builder credentials decoded for user " + user + "."
+
+
+# Check the S3 bucket holds at least one object under the package prefix
+def check_package_prefix(bucket, prefix):
+    response = get_client('s3').list_objects_v2(Bucket=bucket, Prefix=prefix + "/", MaxKeys=1)
+    if not response.get('KeyCount') :
+        raise Exception("No objects found under s3://" + bucket + "/" + prefix + "/.")
+    return "Package prefix s3://" + bucket + "/" + prefix + "/ found."
+
+
+# Check the subnet has a free IP address for each image builder ENI
+def check_subnet(subnet_id, required_ips=1):
+    subnet = get_client('ec2').describe_subnets(SubnetIds=[subnet_id])['Subnets'][0]
+    if subnet['AvailableIpAddressCount'] < required_ips :
+        raise Exception("Subnet " + subnet_id + " has " + str(subnet['AvailableIpAddressCount']) + " free IP addresses, " + str(required_ips) + " required.")
+    return "Subnet " + subnet_id + " has " + str(subnet['AvailableIpAddressCount']) + " free IP addresses."
+
+
+# Check the security group has an inbound rule allowing the remote access port
+def check_security_group(group_id, port):
+    group = get_client('ec2').describe_security_groups(GroupIds=[group_id])['SecurityGroups'][0]
+    for rule in group['IpPermissions'] :
+        if rule['IpProtocol'] == "-1" :
+            return "Security group " + group_id + " allows all traffic."
+        if rule['IpProtocol'] == "tcp" and rule['FromPort'] <= port <= rule['ToPort'] :
+            return "Security group " + group_id + " allows TCP port " + str(port) + "."
+    raise Exception("Security group " + group_id + " has no inbound rule allowing TCP port " + str(port) + ".")
+
+
+# Check the base image exists and is available, by name or ARN
+def check_image(image):
+    if image.startswith("arn:") :
+        response = get_client('appstream').describe_images(Arns=[image])
+    else :
+        response = get_client('appstream').describe_images(Names=[image])
+    state = response['Images'][0]['State']
+    if state != "AVAILABLE" :
+        raise Exception("Image " + image + " is " + state + ".")
+    return "Image " + image + " is available."
+
+
+# Check the command plan exists, can be read and holds valid JSON lines
+def check_command_plan(location):
+    reference = describe_plan(location)
+    return "Command plan " + location + " found, holding " + str(reference['Entries']) + " entries."
+
+
+# Get existing Image Builder with the requested name, the Create Builder function reuses it instead of creating one
+# Only a builder that does not exist gives None, any other error fails the preflight
+def get_existing_builder(name):
+    try :
+        return get_client('appstream').describe_image_builders(Names=[name], MaxResults=1)['ImageBuilders'][0]
+    except botocore.exceptions.ClientError as error :
+        if error.response['Error']['Code'] != "ResourceNotFoundException" :
+            raise
+        return None
+
+
+# Run one check, recording its outcome and duration
+def run_check(name, check, args):
+    start = time.time()
+    try :
+        detail = check(*args)
+        status = "Passed"
+    except Exception as e :
+        detail = str(e)
+        status = "Failed"
+    logger.info("Preflight check %s %s: %s", name, status, detail)
+    return {
+        'Name' : name,
+        'Status' : status,
+        'Detail' : detail,
+        'DurationMs' : round((time.time() - start) * 1000)
+    }
+
+
+# Run every check at the same time and return the consolidated report
+# Checks are (name, function, args) tuples, the report status is Failed if any check failed
+def run_checks(checks):
+    with ThreadPoolExecutor(max_workers=len(checks)) as executor :
+        results = list(executor.map(lambda check : run_check(*check), checks))
+    return {
+        'Status' : "Failed" if any(result['Status'] == "Failed" for result in results) else "Passed",
+        'Checks' : results
+    }
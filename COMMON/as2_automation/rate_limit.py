@@ -0,0 +1,201 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import os
+import random
+import threading
+import time
+from . import clients
+from .metrics import put_metrics
+
+logger = logging.getLogger(__name__)
+
+# AppStream API calls from every function and execution share one token bucket per region
+# The bucket is an item of the DynamoDB table named by the Rate_Limit_Table environment variable,
+# without it the bucket is held in memory and only shared by the threads of one container
+# The store and the bucket limits are read from the environment on first use, None until then
+store = None
+bucket_rate = None
+bucket_capacity = None
+
+# Adaptive rate: halved on each throttling response, regained gradually while calls succeed
+min_rate = 0.25
+recovery_per_second = 0.05
+throttle_window_seconds = 1
+
+# Longest a call waits for a token, it is then sent without one so the limiter can never fail a task
+max_wait_seconds = 30
+
+# Longest a caller backs off after another caller saved the bucket first, jittered so racing callers spread out
+contention_backoff_seconds = 0.05
+
+throttling_codes = ("ThrottlingException", "Throttling", "TooManyRequestsException", "RequestLimitExceeded")
+
+
+# In memory bucket store, used in place of DynamoDB when no table is configured and when testing
+class LocalBucketStore :
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def load(self, name):
+        with self.lock :
+            return dict(self.items[name]) if name in self.items else None
+
+    # Save the bucket unless another caller saved it since it was loaded, returns False when it lost the race
+    def save(self, name, state, previous):
+        with self.lock :
+            current = self.items.get(name)
+            if (current or {}).get('Version') != (previous or {}).get('Version') :
+                return False
+            self.items[name] = dict(state)
+            return True
+
+
+# Bucket store shared by every execution, one DynamoDB item per bucket with optimistic locking on a version number
+class DynamoBucketStore :
+    def __init__(self, table):
+        self.table = table
+
+    def load(self, name):
+        item = clients.get_client('dynamodb').get_item(
+            TableName=self.table,
+            Key={'BucketName' : {'S' : name}},
+            ConsistentRead=True
+        ).get('Item')
+        if not item :
+            return None
+        return {key : float(item[key]['N']) for key in ('Tokens', 'Rate', 'Updated', 'Throttled', 'Version')}
+
+    def save(self, name, state, previous):
+        request = {
+            'TableName' : self.table,
+            'Item' : dict({key : {'N' : repr(value)} for key, value in state.items()}, BucketName={'S' : name})
+        }
+        if previous :
+            request['ConditionExpression'] = "Version = :version"
+            request['ExpressionAttributeValues'] = {':version' : {'N' : repr(previous['Version'])}}
+        else :
+            request['ConditionExpression'] = "attribute_not_exists(BucketName)"
+        try :
+            clients.get_client('dynamodb').put_item(**request)
+            return True
+        except clients.get_client('dynamodb').exceptions.ConditionalCheckFailedException :
+            return False
+
+
+# Get the bucket store, choosing it from the environment on first use
+def get_store():
+    global store
+    if store is None :
+        rate_limit_table = os.environ.get('Rate_Limit_Table')
+        store = DynamoBucketStore(rate_limit_table) if rate_limit_table else LocalBucketStore()
+    return store
+
+
+# Get the bucket rate in calls per second and its burst capacity, reading them from the environment on first use
+def get_limits():
+    global bucket_rate, bucket_capacity
+    if bucket_rate is None :
+        bucket_rate = float(os.environ.get('AppStream_Rate_Limit', 4))
+    if bucket_capacity is None :
+        bucket_capacity = float(os.environ.get('AppStream_Burst_Limit', 8))
+    return bucket_rate, bucket_capacity
+
+
+# Bucket state at the given time, refilled at its current rate and with the rate partly recovered
+def refill(previous, now):
+    rate, capacity = get_limits()
+    if not previous :
+        return {'Tokens' : capacity, 'Rate' : rate, 'Updated' : now, 'Throttled' : 0.0, 'Version' : 1.0}
+    elapsed = max(0.0, now - previous['Updated'])
+    return {
+        'Tokens' : min(capacity, previous['Tokens'] + elapsed * previous['Rate']),
+        'Rate' : min(rate, previous['Rate'] + elapsed * recovery_per_second),
+        'Updated' : now,
+        'Throttled' : previous['Throttled'],
+        'Version' : previous['Version'] + 1
+    }
+
+
+# Wait for a token from the named bucket, returns the time waited in milliseconds
+def acquire(name, operation):
+    started = time.time()
+    while True :
+        now = time.time()
+        try :
+            previous = get_store().load(name)
+            state = refill(previous, now)
+            if state['Tokens'] >= 1 :
+                state['Tokens'] -= 1
+                if get_store().save(name, state, previous) :
+                    break
+                # Another caller saved the bucket since it was loaded, back off briefly before loading it again
+                delay = random.uniform(0, contention_backoff_seconds)
+            else :
+                # Jitter spreads the callers that were waiting for the same token
+                delay = (1 - state['Tokens']) / state['Rate'] * random.uniform(1, 1.5)
+        except Exception as e :
+            logger.error(e)
+            logger.info("Rate limit store unavailable, sending %s without a token.", operation)
+            break
+        if now - started >= max_wait_seconds :
+            logger.info("No AppStream API token after %s seconds, sending %s without one.", max_wait_seconds, operation)
+            break
+        time.sleep(min(delay, max_wait_seconds - (now - started)))
+
+    waited_ms = int((time.time() - started) * 1000)
+    put_metrics({'Operation' : operation}, {'RateLimitWaitTime' : (waited_ms, "Milliseconds")})
+    return waited_ms
+
+
+# Halve the rate of the named bucket after a throttling response, once per throttle window however many callers saw it
+def throttled(name, operation):
+    put_metrics({'Operation' : operation}, {'Throttles' : (1, "Count")})
+    for attempt in range(5) :
+        now = time.time()
+        try :
+            previous = get_store().load(name)
+            state = refill(previous, now)
+            if now - state['Throttled'] < throttle_window_seconds :
+                return
+            state['Rate'] = max(min_rate, state['Rate'] / 2)
+            state['Tokens'] = min(state['Tokens'], 0.0)
+            state['Throttled'] = now
+            if get_store().save(name, state, previous) :
+                logger.info("%s throttled, AppStream API rate reduced to %.2f calls per second.", operation, state['Rate'])
+                return
+        except Exception as e :
+            logger.error(e)
+            return
+
+
+# Attach the shared rate limiter to an AppStream client
+# Every attempt of a call, including the client's own retries, waits for a token before it is sent
+def attach_rate_limiter(client):
+    name = "appstream:" + client.meta.region_name
+
+    def before_send(event_name, **kwargs):
+        acquire(name, event_name.split('.')[-1])
+
+    def needs_retry(event_name, response, **kwargs):
+        if response and response[1].get('Error', {}).get('Code') in throttling_codes :
+            throttled(name, event_name.split('.')[-1])
+
+    client.meta.events.register('before-send.appstream', before_send)
+    client.meta.events.register('needs-retry.appstream', needs_retry)
+    return client
@@ -0,0 +1,87 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import statistics
+from . import telemetry
+
+logger = logging.getLogger(__name__)
+
+# Each build is compared with the median of the builds of its image prefix recorded before it, over a rolling baseline
+baseline_builds = 10
+min_baseline_builds = 3
+
+# Slowdown over the baseline median that is flagged as a regression
+regression_threshold = 0.25
+
+# Phases this short in the baseline are not flagged, a few seconds of variation would exceed any threshold
+min_baseline_seconds = 10
+
+# Record fields that explain a regression when they differ from the previous build
+build_inputs = ('InputsFingerprint', 'InstanceType', 'BuilderReused')
+
+
+# Phase durations of a build as one level, with the command steps named Commands.STEP
+def flatten_phases(phases):
+    flat = {name : seconds for name, seconds in phases.items() if name != 'Commands'}
+    flat.update({"Commands." + step : seconds for step, seconds in (phases.get('Commands') or {}).items()})
+    return flat
+
+
+# Phases of each build slower than the median of its rolling baseline by more than the threshold
+# Builds resumed from a checkpoint only ran part of the plan and failed builds stopped part way, both are left out
+def find_regressions(builds, window=baseline_builds, threshold=regression_threshold):
+    builds = [build for build in builds if not build.get('Resumed') and not build.get('Error')]
+    regressions = []
+    for index, build in enumerate(builds) :
+        baseline = builds[max(0, index - window):index]
+        if len(baseline) < min_baseline_builds :
+            continue
+        changes = [name for name in build_inputs if build.get(name) != baseline[-1].get(name)]
+        baseline_phases = [flatten_phases(previous['Phases']) for previous in baseline]
+        for phase, seconds in sorted(flatten_phases(build['Phases']).items()) :
+            history = [phases[phase] for phases in baseline_phases if phases.get(phase) is not None]
+            if seconds is None or len(history) < min_baseline_builds :
+                continue
+            median = statistics.median(history)
+            if median >= min_baseline_seconds and seconds > median * (1 + threshold) :
+                regressions.append({
+                    'ImagePrefix' : build['ImagePrefix'],
+                    'ImageName' : build['ImageName'],
+                    'RecordedAt' : build['RecordedAt'],
+                    'Phase' : phase,
+                    'Seconds' : seconds,
+                    'BaselineSeconds' : median,
+                    'BaselineBuilds' : len(history),
+                    'IncreasePercent' : round((seconds / median - 1) * 100),
+                    'ChangedInputs' : changes
+                })
+    return regressions
+
+
+# Regressions of every image prefix given, or of every prefix in the telemetry store
+def regression_report(image_prefixes=None, window=baseline_builds, threshold=regression_threshold, latest_only=False):
+    if not telemetry.get_store() :
+        raise ValueError("Set Telemetry_Table or Telemetry_Database to read build telemetry.")
+    regressions = []
+    for image_prefix in image_prefixes or telemetry.get_store().prefixes() :
+        builds = telemetry.load_builds(image_prefix)
+        found = find_regressions(builds, window, threshold)
+        if latest_only and builds :
+            found = [regression for regression in found if regression['RecordedAt'] == builds[-1]['RecordedAt']]
+        logger.info("%s: %s builds, %s phase regressions.", image_prefix, len(builds), len(found))
+        regressions += found
+    return regressions
@@ -0,0 +1,309 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import base64
+import json
+import logging
+import random
+import select
+import socket
+import struct
+import time
+from collections import namedtuple
+from io import StringIO
+from . import trace
+from .clients import get_client
+
+# paramiko is in the layer of the Linux functions that open SSH sessions and pywinrm in that of the Windows functions
+# that open WinRM sessions, each of those connects on every invocation so its library is imported here, during init
+# Functions without the layer, such as the preflight checks, never open a session and go without
+try :
+    import paramiko
+except ImportError :
+    paramiko = None
+try :
+    import winrm
+except ImportError :
+    winrm = None
+
+logger = logging.getLogger(__name__)
+
+# User account embeded in Linux base image
+ssh_username = "as2-automation"
+
+# Secrets Manager secret holding the Windows image builder administrator credentials
+builder_secret_name = "as2/builder/pw"
+
+# Connection attempts to a Linux image builder are retried with exponential backoff and full jitter until the deadline
+# Builders report RUNNING a few seconds before sshd accepts connections
+connect_deadline_seconds = 90
+connect_base_delay_seconds = 1
+connect_max_delay_seconds = 15
+probe_timeout_seconds = 3
+
+# Command output is read from its channel in blocks of this size, waiting at most this long for more at a time
+channel_read_bytes = 32768
+channel_wait_seconds = 1
+
+# Flow control window of the SFTP channels writing file parts, large enough to keep a fast link busy between acknowledgements
+sftp_window_size = 8 * 1048576
+
+# paramiko key classes by the key type named in the private key
+# PEM keys written by ssh-keygen -m PEM name their type in the header, OpenSSH keys in the public key they embed
+key_classes = {
+    'ssh-ed25519' : "Ed25519Key",
+    'ecdsa-sha2-nistp256' : "ECDSAKey",
+    'ecdsa-sha2-nistp384' : "ECDSAKey",
+    'ecdsa-sha2-nistp521' : "ECDSAKey",
+    'ssh-rsa' : "RSAKey"
+}
+pem_key_types = {
+    "RSA PRIVATE KEY" : 'ssh-rsa',
+    "EC PRIVATE KEY" : 'ecdsa-sha2-nistp256'
+}
+openssh_key_magic = b"openssh-key-v1\x00"
+
+# Output and exit status of a remote command, SSH results use the field names of pywinrm responses
+CommandResult = namedtuple('CommandResult', ['std_out', 'std_err', 'status_code'])
+
+
+# Get SSH private key for Linux image builders from SSM Parameter Store
+def load_ssh_key(parameter_name):
+    response = get_client('ssm').get_parameters(
+        Names=[parameter_name],WithDecryption=True
+    )
+
+    for parameter in response['Parameters']:
+        # Keys are redacted from recorded traces, sessions of a replayed trace need no key
+        if parameter['Value'] == trace.redacted_value :
+            return None
+        return parse_ssh_key(parameter['Value'])
+
+
+# Key type named by a private key, or None if it cannot be read without decoding the key
+def get_key_type(text):
+    lines = text.strip().splitlines()
+    if not lines or not lines[0].startswith("-----BEGIN ") :
+        return None
+    label = lines[0][len("-----BEGIN "):].rstrip("-")
+    if label in pem_key_types :
+        return pem_key_types[label]
+    if label != "OPENSSH PRIVATE KEY" :
+        return None
+
+    # openssh-key-v1: magic, cipher name, KDF name, KDF options, key count, then the public key starting with its type
+    try :
+        blob = base64.b64decode("".join(line for line in lines[1:] if not line.startswith("-----")))
+        if not blob.startswith(openssh_key_magic) :
+            return None
+        offset = len(openssh_key_magic)
+        for field in range(3) :
+            offset += 4 + struct.unpack(">I", blob[offset:offset + 4])[0]
+        offset += 4 + 4
+        length = struct.unpack(">I", blob[offset:offset + 4])[0]
+        return blob[offset + 4:offset + 4 + length].decode()
+    except (ValueError, struct.error, UnicodeDecodeError) :
+        return None
+
+
+# Load an Ed25519, ECDSA or RSA private key, the type is detected from the key itself so no parse is spent on the wrong class
+def parse_ssh_key(text):
+    key_type = get_key_type(text)
+    if key_type not in key_classes :
+        raise paramiko.SSHException("Unsupported SSH private key type " + str(key_type) + ", expected an OpenSSH or PEM private key of type "
+            + ", ".join(sorted(set(key_classes))) + ".")
+    return getattr(paramiko, key_classes[key_type]).from_private_key(file_obj=StringIO(text))
+
+
+# Get Windows image builder administrator username and password from Secrets Manager
+def load_builder_credentials(secret_name=builder_secret_name):
+    secret_response = get_client('secretsmanager').get_secret_value(SecretId=secret_name)
+
+    if 'SecretString' in secret_response:
+        secret = json.loads(secret_response['SecretString'])
+    else:
+        secret = json.loads(base64.b64decode(secret_response['SecretBinary']))
+
+    return secret['as2_builder_admin_user'], secret['as2_builder_admin_pw']
+
+
+# Raised when no SSH session could be opened to an image builder before the deadline
+class SSHConnectError(Exception):
+    def __init__(self, message, attempts=0, elapsed_ms=0):
+        super().__init__(message)
+        self.attempts = attempts
+        self.elapsed_ms = elapsed_ms
+
+
+# Command session on a Linux image builder over SSH
+class SSHSession :
+    def __init__(self, ip, client, attempts=1, latency_ms=0):
+        self.ip = ip
+        self.client = client
+        self.connect_stats = {
+            'Attempts' : attempts,
+            'LatencyMs' : latency_ms
+        }
+
+    # Run shell command on a new channel of the session's transport, so several commands can run at once
+    # Output lines are logged prefixed with the builder address and the label, if any
+    def run(self, cmd, log_output=True, label=None):
+        stdin, stdout, stderr = self.client.exec_command(cmd)
+        stdin.flush()
+
+        # Output and error output are drained as they arrive, reading one to the end first would stall a command that
+        # fills the flow control window of the other
+        channel = stdout.channel
+        std_out = []
+        std_err = []
+        while True :
+            if channel.recv_ready() :
+                std_out.append(channel.recv(channel_read_bytes))
+            elif channel.recv_stderr_ready() :
+                std_err.append(channel.recv_stderr(channel_read_bytes))
+            elif channel.eof_received or channel.closed :
+                break
+            else :
+                select.select([channel], [], [], channel_wait_seconds)
+        std_out = b"".join(std_out)
+        std_err = b"".join(std_err)
+        status_code = channel.recv_exit_status()
+
+        if log_output :
+            prefix = self.ip + " " + label if label else self.ip
+            for line in std_out.splitlines():
+                logger.info("[%s] %s", prefix, line.decode(errors='replace'))
+
+        return CommandResult(std_out, std_err, status_code)
+
+    # Write text to a file on the image builder, content is a string or an iterable of chunks written as they are produced
+    def put_file(self, path, content):
+        if isinstance(content, str) :
+            content = [content]
+        sftp = self.client.open_sftp()
+        with sftp.file(path, 'w') as remote_file :
+            remote_file.set_pipelined(True)
+            for chunk in content :
+                remote_file.write(chunk)
+        sftp.close()
+
+    # Write chunks into an existing file from the given offset, on an SFTP channel of its own so parts of one file
+    # and separate files are written at the same time over the session's transport
+    def put_part(self, path, offset, content):
+        sftp = paramiko.SFTPClient.from_transport(self.client.get_transport(), window_size=sftp_window_size)
+        try :
+            with sftp.file(path, 'r+') as remote_file :
+                remote_file.set_pipelined(True)
+                remote_file.seek(offset)
+                for chunk in content :
+                    remote_file.write(chunk)
+        finally :
+            sftp.close()
+
+    def close(self):
+        self.client.close()
+
+
+# Command session on a Windows image builder over WinRM
+class WinRMSession :
+    def __init__(self, ip, session):
+        self.ip = ip
+        self.session = session
+
+    # Run PowerShell command
+    def run(self, cmd, log_output=False):
+        result = self.session.run_ps(cmd)
+        if log_output :
+            logger.info("[%s] %s", self.ip, result.std_out)
+        return CommandResult(result.std_out, result.std_err, result.status_code)
+
+    # Run cmd.exe command
+    def run_cmd(self, cmd, log_output=False):
+        result = self.session.run_cmd(cmd)
+        if log_output :
+            logger.info("[%s] %s", self.ip, result.std_out)
+        return CommandResult(result.std_out, result.std_err, result.status_code)
+
+    # WinRM runs each command in its own shell, there is no connection to close
+    def close(self):
+        pass
+
+
+# Check whether the port accepts TCP connections, cheaper than a full SSH handshake while sshd is starting
+def probe_port(ip, port, timeout=probe_timeout_seconds):
+    try:
+        with socket.create_connection((ip, port), timeout=timeout) :
+            return True
+    except OSError :
+        return False
+
+
+# Establish ssh connection to Linux image builder, returns an SSHSession or raises SSHConnectError after the deadline
+# With compress set, traffic is zlib compressed, worth it for compressible artifacts over a slow link
+# The session and its commands are recorded while a trace is recorded, and come from the trace while one is replayed
+def connect_ssh(ip, privkey, username=ssh_username, port=22, deadline_seconds=connect_deadline_seconds, compress=False):
+    return trace.traced_connect("ssh", ip, lambda : open_ssh(ip, privkey, username, port, deadline_seconds, compress), (SSHConnectError,))
+
+
+# Open ssh connection, retried until the deadline
+# Authentication failures are not retried, the key will not change between attempts
+def open_ssh(ip, privkey, username, port, deadline_seconds, compress=False):
+    start = time.time()
+    deadline = start + deadline_seconds
+    attempts = 0
+    while True :
+        attempts += 1
+        error = None
+        if probe_port(ip, port) :
+            # Start SSH client
+            ssh = paramiko.SSHClient()
+
+            # Automatically adding the hostname and new host key to the local HostKeys object
+            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+            try:
+                ssh.connect(hostname=ip, port=port, username=username, pkey=privkey, compress=compress,
+                    timeout=probe_timeout_seconds, banner_timeout=probe_timeout_seconds * 5, auth_timeout=probe_timeout_seconds * 5)
+                latency_ms = round((time.time() - start) * 1000)
+                logger.info("Connected to %s with %s key after %s attempt(s) in %sms.", ip, privkey.get_name(), attempts, latency_ms)
+                return SSHSession(ip, ssh, attempts, latency_ms)
+            except paramiko.AuthenticationException as e:
+                ssh.close()
+                raise SSHConnectError("Authentication to " + ip + " failed: " + str(e), attempts, round((time.time() - start) * 1000))
+            except Exception as e:
+                ssh.close()
+                error = e
+        else :
+            error = "port " + str(port) + " not accepting connections"
+
+        remaining = deadline - time.time()
+        if remaining <= 0 :
+            elapsed_ms = round((time.time() - start) * 1000)
+            raise SSHConnectError("Unable to connect to " + ip + " after " + str(attempts) + " attempt(s) in " + str(elapsed_ms) + "ms: " + str(error), attempts, elapsed_ms)
+        delay = min(remaining, random.uniform(0, min(connect_max_delay_seconds, connect_base_delay_seconds * 2 ** (attempts - 1))))
+        logger.info("Connection attempt %s to %s failed (%s), retrying in %.1f seconds.", attempts, ip, error, delay)
+        time.sleep(delay)
+
+
+# Open WinRM session to Windows image builder with the administrator credentials
+# The session and its commands are recorded while a trace is recorded, and come from the trace while one is replayed
+def connect_winrm(ip, credentials):
+    return trace.traced_connect("winrm", ip, lambda : open_winrm(ip, credentials))
+
+
+def open_winrm(ip, credentials):
+    return WinRMSession(ip, winrm.Session(ip, auth=credentials))
@@ -0,0 +1,194 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import logging
+import time
+import botocore
+from .clients import get_client
+from .distribution import parse_regions
+from .metrics import put_metrics
+
+logger = logging.getLogger(__name__)
+
+# Longest a fleet may take to stop, update and start again before it is reported as failed
+fleet_timeout_seconds = 3600
+
+# Fleet states that need no further polling, a rollout moves to the next wave once every fleet of the wave is settled
+settled_states = ("Complete", "Failed", "Skipped")
+
+
+# Fleet names from a list or a comma separated string, False when there are none
+def parse_fleets(fleets):
+    return parse_regions(fleets)
+
+
+# Rollout state of an image, carried in the execution state between polls with one entry for each fleet
+# Fleets are updated in waves of wave_size, in the order they are listed
+def new_rollout(image_name, fleets, wave_size, restart=True):
+    wave_size = max(1, int(wave_size))
+    return {
+        'ImageName' : image_name,
+        'Status' : "Running",
+        'StartedAt' : time.time(),
+        'Restart' : bool(restart),
+        'Wave' : 0,
+        'Fleets' : [
+            {'Fleet' : fleet, 'Wave' : index // wave_size + 1, 'Status' : "Pending"}
+            for index, fleet in enumerate(parse_fleets(fleets) or [])
+        ]
+    }
+
+
+# Current description of each named fleet, with one batched describe_fleets call
+# A missing fleet fails the whole call, the fleets are then described one at a time so only the missing ones map to None
+def describe_fleets(names):
+    if not names :
+        return {}
+    appstream = get_client('appstream')
+    try :
+        return {fleet['Name'] : fleet for fleet in appstream.describe_fleets(Names=names)['Fleets']}
+    except botocore.exceptions.ClientError as error :
+        if error.response['Error']['Code'] != "ResourceNotFoundException" :
+            logger.error(error)
+            return {}
+        if len(names) == 1 :
+            return {names[0] : None}
+    return dict(pair for name in names for pair in describe_fleets([name]).items())
+
+
+# Record why a fleet failed, a fleet that failed after it was stopped is started again on its previous image
+def fail_fleet(entry, reason, restore=False):
+    entry['Status'] = "Failed"
+    entry['Error'] = reason
+    logger.info("Rollout to fleet %s failed, %s.", entry['Fleet'], reason)
+    if restore :
+        try :
+            get_client('appstream').start_fleet(Name=entry['Fleet'])
+        except Exception as error :
+            logger.error(error)
+
+
+# Point a fleet at the image, a fleet that was running is started again so its instances use the new image
+def update_image(rollout, entry):
+    appstream = get_client('appstream')
+    try :
+        appstream.update_fleet(Name=entry['Fleet'], ImageName=rollout['ImageName'])
+    except botocore.exceptions.ClientError as error :
+        logger.error(error)
+        fail_fleet(entry, error.response['Error']['Code'] + ": " + error.response['Error'].get('Message', ""), entry['Status'] == "Stopping")
+        return
+    if entry['Status'] != "Stopping" :
+        complete_fleet(entry, time.time())
+        return
+    try :
+        appstream.start_fleet(Name=entry['Fleet'])
+    except botocore.exceptions.ClientError as error :
+        logger.error(error)
+        fail_fleet(entry, error.response['Error']['Code'] + ": " + error.response['Error'].get('Message', ""))
+        return
+    entry['Status'] = "Starting"
+    logger.info("Fleet %s updated to %s, starting.", entry['Fleet'], rollout['ImageName'])
+
+
+# Record the cutover time of a fleet, from the start of its update until it serves sessions from the new image
+def complete_fleet(entry, now):
+    entry['Status'] = "Complete"
+    entry['Seconds'] = round(now - entry['StartedAt'])
+    logger.info("Fleet %s cut over after %s seconds.", entry['Fleet'], entry['Seconds'])
+    put_metrics({'Fleet' : entry['Fleet']}, {'FleetCutoverTime' : (entry['Seconds'], "Seconds")})
+
+
+# Begin updating the pending fleets of the current wave, fleets that could not be described stay pending for the next poll
+# Running fleets are stopped first when the rollout restarts fleets, other fleets are updated in place
+def start_fleets(rollout):
+    wave = [entry for entry in rollout['Fleets'] if entry['Wave'] == rollout['Wave'] and entry['Status'] == "Pending"]
+    fleets = describe_fleets([entry['Fleet'] for entry in wave])
+    now = time.time()
+    for entry in wave :
+        if entry['Fleet'] not in fleets :
+            continue
+        entry['StartedAt'] = now
+        fleet = fleets[entry['Fleet']]
+        if not fleet :
+            fail_fleet(entry, "Fleet not found")
+        elif fleet.get('ImageName') == rollout['ImageName'] :
+            complete_fleet(entry, now)
+        elif fleet['State'] == "RUNNING" and rollout['Restart'] and fleet.get('FleetType') != "ELASTIC" :
+            try :
+                get_client('appstream').stop_fleet(Name=entry['Fleet'])
+                entry['Status'] = "Stopping"
+                logger.info("Stopping fleet %s.", entry['Fleet'])
+            except botocore.exceptions.ClientError as error :
+                logger.error(error)
+                fail_fleet(entry, error.response['Error']['Code'] + ": " + error.response['Error'].get('Message', ""))
+        else :
+            update_image(rollout, entry)
+
+
+# Advance the rollout by one poll
+# Every fleet of the current wave that is stopping or starting is described in one call, stopped fleets are updated
+# and started, and once the wave is settled the next wave begins, or the remaining waves are skipped if a fleet failed
+def advance_rollout(rollout):
+    start_fleets(rollout)
+    waiting = [entry for entry in rollout['Fleets'] if entry['Status'] in ("Stopping", "Starting")]
+    fleets = describe_fleets([entry['Fleet'] for entry in waiting])
+    now = time.time()
+    for entry in waiting :
+        fleet = fleets.get(entry['Fleet'])
+        if now - entry['StartedAt'] > fleet_timeout_seconds :
+            fail_fleet(entry, "Fleet not running after " + str(fleet_timeout_seconds) + " seconds")
+        elif not fleet :
+            continue
+        elif entry['Status'] == "Stopping" and fleet['State'] == "STOPPED" :
+            update_image(rollout, entry)
+        elif entry['Status'] == "Starting" and fleet['State'] == "RUNNING" :
+            complete_fleet(entry, now)
+        elif entry['Status'] == "Starting" and fleet['State'] == "STOPPED" and fleet.get('FleetErrors') :
+            fail_fleet(entry, ", ".join(error['ErrorCode'] + ": " + error.get('ErrorMessage', "") for error in fleet['FleetErrors']))
+
+    while rollout['Status'] == "Running" and all(entry['Status'] in settled_states for entry in rollout['Fleets'] if entry['Wave'] <= rollout['Wave']) :
+        failed = [entry['Fleet'] for entry in rollout['Fleets'] if entry['Status'] == "Failed"]
+        remaining = [entry for entry in rollout['Fleets'] if entry['Wave'] > rollout['Wave']]
+        if failed or not remaining :
+            for entry in remaining :
+                entry['Status'] = "Skipped"
+            rollout['Status'] = "Failed" if failed else "Complete"
+            rollout['Seconds'] = round(now - rollout['StartedAt'])
+            logger.info("Rollout of %s %s after %s seconds%s.", rollout['ImageName'], rollout['Status'].lower(), rollout['Seconds'],
+                ", halted after wave " + str(rollout['Wave']) + " as " + ", ".join(failed) + " failed" if failed and remaining else "")
+        else :
+            rollout['Wave'] += 1
+            logger.info("Starting wave %s of the rollout of %s.", rollout['Wave'], rollout['ImageName'])
+            start_fleets(rollout)
+    return rollout
+
+
+# Notification text listing the cutover time of each fleet
+def rollout_summary(rollout):
+    lines = [
+        "------------------------------------------------------------------------------",
+        "Fleet Rollout: " + rollout['Status'] + (", every fleet updated after " + str(rollout['Seconds']) + " seconds"
+            if rollout['Status'] == "Complete" else ""),
+        "------------------------------------------------------------------------------"
+    ]
+    for entry in rollout['Fleets'] :
+        line = entry['Fleet'] + " (wave " + str(entry['Wave']) + "): "
+        if entry['Status'] == "Complete" :
+            lines.append(line + "cut over in " + str(entry['Seconds']) + " seconds")
+        else :
+            lines.append(line + entry['Status'] + (", " + entry['Error'] if entry.get('Error') else ""))
+    return "\n".join(lines) + "\n"
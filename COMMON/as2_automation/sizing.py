@@ -0,0 +1,136 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import logging
+import os
+import statistics
+from .telemetry import load_builds
+
+logger = logging.getLogger(__name__)
+
+# Image builder instance types: (vCPUs, memory GiB, hourly price Linux, hourly price Windows)
+# Prices are example on-demand list prices, set the Instance_Prices environment variable to a JSON object of
+# {"instance type": hourly price} with the prices of your region and platform to replace them
+instance_types = {
+    'stream.standard.small' : (2, 2, 0.05, 0.10),
+    'stream.standard.medium' : (2, 4, 0.10, 0.19),
+    'stream.standard.large' : (2, 8, 0.19, 0.29),
+    'stream.standard.xlarge' : (4, 16, 0.38, 0.57),
+    'stream.standard.2xlarge' : (8, 32, 0.76, 1.14),
+    'stream.compute.large' : (2, 3.75, 0.23, 0.32),
+    'stream.compute.xlarge' : (4, 7.5, 0.45, 0.64),
+    'stream.compute.2xlarge' : (8, 15, 0.90, 1.27),
+    'stream.compute.4xlarge' : (16, 30, 1.80, 2.54),
+    'stream.compute.8xlarge' : (32, 60, 3.59, 5.08),
+    'stream.memory.large' : (2, 15.25, 0.30, 0.39),
+    'stream.memory.xlarge' : (4, 30.5, 0.60, 0.78),
+    'stream.memory.2xlarge' : (8, 61, 1.19, 1.56),
+    'stream.memory.4xlarge' : (16, 122, 2.38, 3.12),
+    'stream.memory.8xlarge' : (32, 244, 4.76, 6.24)
+}
+
+# Memory headroom kept above the peak memory used by recorded builds when choosing a smaller type
+memory_headroom = 1.2
+
+# Candidates listed with a recommendation
+candidates_reported = 5
+
+
+# Hourly price of each instance type for the platform, with overrides from the Instance_Prices environment variable
+def get_prices(platform):
+    column = 3 if platform == "Windows" else 2
+    prices = {name : spec[column] for name, spec in instance_types.items()}
+    prices.update(json.loads(os.environ.get('Instance_Prices') or "{}"))
+    return prices
+
+
+# Install duration expected on an instance type from builds recorded on another type
+# The CPU busy share of the install scales with the vCPU count, the rest (downloads, I/O waits) does not
+def estimate_seconds(seconds, cpu_percent, vcpus_recorded, vcpus):
+    busy = min(1.0, (cpu_percent or 0) / 100)
+    return seconds * ((1 - busy) + busy * vcpus_recorded / vcpus)
+
+
+# Recommend the cheapest instance type expected to install within the target duration, from recorded builds
+# Types with recorded builds use their median install time, others are estimated from the most recorded type
+# Installs resumed from a checkpoint only ran part of the plan and failed builds stopped part way, both are left out
+# Returns None when there are no recorded builds to base a recommendation on, or no type has the memory they need,
+# and the caller falls back to its default type
+def recommend(builds, platform, target_seconds):
+    by_type = {}
+    for build in builds :
+        if build.get('InstanceType') in instance_types and (build.get('Phases') or {}).get('Install') and not build.get('Resumed') and not build.get('Error') :
+            by_type.setdefault(build['InstanceType'], []).append(build)
+    if not by_type :
+        return None
+
+    basis_type = max(by_type, key=lambda name : len(by_type[name]))
+    basis = by_type[basis_type]
+    basis_seconds = statistics.median(build['Phases']['Install'] for build in basis)
+    basis_cpu = statistics.median((build.get('Utilisation') or {}).get('CpuAveragePercent') or 0 for build in basis)
+    peak_memory_gib = max(((build.get('Utilisation') or {}).get('MemoryPeakMiB') or 0) for builds_of_type in by_type.values() for build in builds_of_type) / 1024
+
+    prices = get_prices(platform)
+    candidates = []
+    for name, (vcpus, memory_gib, linux_price, windows_price) in instance_types.items() :
+        if name not in prices or memory_gib < peak_memory_gib * memory_headroom :
+            continue
+        if name in by_type :
+            seconds = statistics.median(build['Phases']['Install'] for build in by_type[name])
+        else :
+            seconds = estimate_seconds(basis_seconds, basis_cpu, instance_types[basis_type][0], vcpus)
+        candidates.append({
+            'InstanceType' : name,
+            'EstimatedSeconds' : round(seconds),
+            'EstimatedCost' : round(prices[name] * seconds / 3600, 4),
+            'RecordedBuilds' : len(by_type.get(name, []))
+        })
+    if not candidates :
+        logger.info("No instance type has %.1f GiB of memory, the recorded peak with headroom.", peak_memory_gib * memory_headroom)
+        return None
+
+    meeting = sorted([candidate for candidate in candidates if candidate['EstimatedSeconds'] <= target_seconds], key=lambda candidate : (candidate['EstimatedCost'], candidate['EstimatedSeconds']))
+    if meeting :
+        choice = meeting[0]
+    else :
+        # Nothing is expected to meet the target, the fastest type gets closest to it
+        choice = min(candidates, key=lambda candidate : (candidate['EstimatedSeconds'], candidate['EstimatedCost']))
+    return {
+        'InstanceType' : choice['InstanceType'],
+        'MeetsTarget' : choice['EstimatedSeconds'] <= target_seconds,
+        'TargetSeconds' : target_seconds,
+        'BasedOn' : {
+            'InstanceType' : basis_type,
+            'Builds' : len(basis),
+            'InstallSeconds' : round(basis_seconds),
+            'CpuAveragePercent' : basis_cpu,
+            'MemoryPeakGiB' : round(peak_memory_gib, 1)
+        },
+        'Candidates' : (meeting or sorted(candidates, key=lambda candidate : candidate['EstimatedSeconds']))[:candidates_reported]
+    }
+
+
+# Recommend an instance type for an image prefix from the builds recorded in the telemetry store
+def recommend_instance_type(image_prefix, platform, target_seconds):
+    builds = load_builds(image_prefix)
+    recommendation = recommend(builds, platform, target_seconds)
+    if recommendation :
+        logger.info("Recommended %s for %s from %s recorded builds, estimated install %s seconds against a target of %s.",
+            recommendation['InstanceType'], image_prefix, len(builds), recommendation['Candidates'][0]['EstimatedSeconds'], target_seconds)
+    else :
+        logger.info("Unable to recommend an instance type for %s from %s recorded builds.", image_prefix, len(builds))
+    return recommendation
@@ -0,0 +1,349 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+from .clients import get_client
+
+logger = logging.getLogger(__name__)
+
+# Build telemetry is stored in the DynamoDB table named by the Telemetry_Table environment variable, one item for each
+# image builder of an execution, keyed by image prefix and recording time so the latest builds of a prefix are one query
+# Without a table, records are stored in the SQLite database at the Telemetry_Database path, for local use
+# The store is chosen from the environment on first use, None until then and False when neither is set
+store = None
+builds_read_limit = 50
+
+# Failed executions are recorded with the error caught by the state machine, its cause cut to this many characters
+max_cause_length = 1000
+
+# Automation parameters that shape what is built, builds with the same inputs fingerprint installed the same plan
+fingerprint_parameters = ('ImageBuilderImage', 'ImageBuilderCommands', 'ImageBuilderCommandsPlan', 'ImageBuilderExtraCommands',
+    'PackageS3Bucket', 'CreateManifests', 'DeleteTempManifests', 'RemoveXvfb', 'CoalescePackageCommands', 'CombineImageCreation')
+
+# States of the state machine that bound the phases measured from the execution history
+create_state = "Create Image Builder"
+install_state = "Remote Software Install - Script"
+image_assistant_state = "Run Image Assistant"
+image_status_state = "Check Image Status"
+
+# Seconds between utilisation samples taken on the image builder while the command plan runs
+sample_interval_seconds = 10
+
+# Files on a Linux image builder used by the sampler
+vmstat_log = "/tmp/as2_vmstat.log"
+vmstat_pid = "/tmp/as2_vmstat.pid"
+
+# Windows image builders sample performance counters with typeperf, started through WMI so it outlives the WinRM shell
+typeperf_log = "C:\\temp\\as2_perf.csv"
+typeperf_counters = [
+    "\\Processor(_Total)\\% Processor Time",
+    "\\Memory\\Available MBytes",
+    "\\PhysicalDisk(_Total)\\Disk Read Bytes/sec",
+    "\\PhysicalDisk(_Total)\\Disk Write Bytes/sec"
+]
+
+
+# Shell command starting vmstat in the background on a Linux image builder
+def linux_sampler_start():
+    return ("nohup vmstat -n " + str(sample_interval_seconds) + " > " + vmstat_log + " 2>&1 < /dev/null & echo $! > " + vmstat_pid)
+
+
+# Shell command stopping the Linux sampler and printing the total memory followed by the samples
+def linux_sampler_collect():
+    return ("kill $(cat " + vmstat_pid + " 2>/dev/null) 2>/dev/null; rm -f " + vmstat_pid
+        + "; grep MemTotal /proc/meminfo; cat " + vmstat_log + " 2>/dev/null; rm -f " + vmstat_log)
+
+
+# PowerShell command starting typeperf in the background on a Windows image builder
+def windows_sampler_start():
+    command_line = "typeperf " + " ".join('"' + counter + '"' for counter in typeperf_counters) + " -si " + str(sample_interval_seconds) + " -f CSV -o " + typeperf_log + " -y"
+    return "Invoke-CimMethod -ClassName Win32_Process -MethodName Create -Arguments @{CommandLine='" + command_line + "'} | Out-Null"
+
+
+# PowerShell command stopping the Windows sampler and printing the total memory followed by the samples
+def windows_sampler_collect():
+    return ("Stop-Process -Name typeperf -ErrorAction SilentlyContinue; Start-Sleep -Seconds 1; "
+        + "(Get-CimInstance Win32_ComputerSystem).TotalPhysicalMemory; "
+        + "Get-Content -Path " + typeperf_log + " -ErrorAction SilentlyContinue; "
+        + "Remove-Item -Path " + typeperf_log + " -ErrorAction SilentlyContinue")
+
+
+# Parse the Linux sampler output into samples of CPU, I/O wait, used memory and disk throughput
+# The first vmstat line after the headers averages everything since boot and is skipped
+def parse_linux_samples(lines):
+    memory_total_kib = None
+    samples = []
+    rows = 0
+    for line in lines :
+        fields = line.split()
+        if fields[:1] == ["MemTotal:"] :
+            memory_total_kib = int(fields[1])
+        elif len(fields) >= 16 and all(field.isdigit() for field in fields[:16]) :
+            rows += 1
+            if rows == 1 :
+                continue
+            values = [int(field) for field in fields[:16]]
+            samples.append({
+                'Cpu' : values[12] + values[13],
+                'IoWait' : values[15],
+                'MemoryUsedKiB' : (memory_total_kib - values[3] - values[4] - values[5]) if memory_total_kib else None,
+                'DiskReadKiBps' : values[8],
+                'DiskWriteKiBps' : values[9]
+            })
+    return summarise_samples(samples, memory_total_kib)
+
+
+# Parse the Windows sampler output, typeperf writes a CSV header and then one quoted row per sample
+def parse_windows_samples(lines):
+    memory_total_kib = None
+    samples = []
+    for line in lines :
+        line = line.strip()
+        if line.isdigit() :
+            memory_total_kib = int(line) // 1024
+        elif line.startswith('"') and not line.startswith('"(PDH') :
+            try :
+                cpu, available_mib, read_bytes, write_bytes = [float(value.strip('"')) for value in line.split('","')[1:5]]
+            except ValueError :
+                continue
+            samples.append({
+                'Cpu' : cpu,
+                'IoWait' : None,
+                'MemoryUsedKiB' : (memory_total_kib - available_mib * 1024) if memory_total_kib else None,
+                'DiskReadKiBps' : read_bytes / 1024,
+                'DiskWriteKiBps' : write_bytes / 1024
+            })
+    return summarise_samples(samples, memory_total_kib)
+
+
+# Average of the values that were sampled, None if there are none
+def average(values):
+    values = [value for value in values if value is not None]
+    return round(sum(values) / len(values), 1) if values else None
+
+
+# Summarise the utilisation samples of one build
+def summarise_samples(samples, memory_total_kib):
+    if not samples :
+        return None
+    memory_used = [sample['MemoryUsedKiB'] for sample in samples if sample['MemoryUsedKiB'] is not None]
+    return {
+        'Samples' : len(samples),
+        'IntervalSeconds' : sample_interval_seconds,
+        'CpuAveragePercent' : average(sample['Cpu'] for sample in samples),
+        'CpuPeakPercent' : round(max(sample['Cpu'] for sample in samples), 1),
+        'IoWaitAveragePercent' : average(sample['IoWait'] for sample in samples),
+        'MemoryTotalMiB' : memory_total_kib // 1024 if memory_total_kib else None,
+        'MemoryPeakMiB' : int(max(memory_used) // 1024) if memory_used else None,
+        'DiskReadAverageKiBps' : average(sample['DiskReadKiBps'] for sample in samples),
+        'DiskWriteAverageKiBps' : average(sample['DiskWriteKiBps'] for sample in samples)
+    }
+
+
+# Sort key of a telemetry record, its recording time followed by the image builder name
+def record_key(record):
+    return "%.3f_%s" % (record['RecordedAt'], record['ImageBuilderName'])
+
+
+# Telemetry store in a SQLite database, used in place of DynamoDB for local use
+class SqliteTelemetryStore :
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("CREATE TABLE IF NOT EXISTS builds (ImagePrefix TEXT, RecordKey TEXT, InstanceType TEXT, "
+            "InputsFingerprint TEXT, Record TEXT, PRIMARY KEY (ImagePrefix, RecordKey))")
+        return connection
+
+    def put(self, record):
+        with closing(self.connect()) as connection, connection :
+            connection.execute("INSERT OR REPLACE INTO builds VALUES (?, ?, ?, ?, ?)",
+                (record['ImagePrefix'], record_key(record), record['InstanceType'], record['InputsFingerprint'], json.dumps(record)))
+
+    # Most recent records of an image prefix, oldest first
+    def query(self, image_prefix, limit):
+        with closing(self.connect()) as connection :
+            rows = connection.execute("SELECT Record FROM builds WHERE ImagePrefix = ? ORDER BY RecordKey DESC LIMIT ?", (image_prefix, limit)).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def prefixes(self):
+        with closing(self.connect()) as connection :
+            return [row[0] for row in connection.execute("SELECT DISTINCT ImagePrefix FROM builds ORDER BY ImagePrefix")]
+
+
+# Telemetry store in DynamoDB, the full record is kept as JSON next to the attributes it is queried by
+class DynamoTelemetryStore :
+    def __init__(self, table):
+        self.table = table
+
+    def put(self, record):
+        item = {
+            'ImagePrefix' : {'S' : record['ImagePrefix']},
+            'RecordKey' : {'S' : record_key(record)},
+            'InputsFingerprint' : {'S' : record['InputsFingerprint']},
+            'Record' : {'S' : json.dumps(record)}
+        }
+        if record['InstanceType'] :
+            item['InstanceType'] = {'S' : record['InstanceType']}
+        get_client('dynamodb').put_item(TableName=self.table, Item=item)
+
+    def query(self, image_prefix, limit):
+        response = get_client('dynamodb').query(
+            TableName=self.table,
+            KeyConditionExpression="ImagePrefix = :prefix",
+            ExpressionAttributeValues={':prefix' : {'S' : image_prefix}},
+            ScanIndexForward=False,
+            Limit=limit
+        )
+        return [json.loads(item['Record']['S']) for item in reversed(response['Items'])]
+
+    # Image prefixes with recorded builds, read with a scan so only used by reports
+    def prefixes(self):
+        prefixes = set()
+        for page in get_client('dynamodb').get_paginator('scan').paginate(TableName=self.table, ProjectionExpression="ImagePrefix") :
+            prefixes.update(item['ImagePrefix']['S'] for item in page['Items'])
+        return sorted(prefixes)
+
+
+# Get the telemetry store, choosing it from the environment on first use, False when neither variable is set
+def get_store():
+    global store
+    if store is None :
+        if os.environ.get('Telemetry_Table') :
+            store = DynamoTelemetryStore(os.environ['Telemetry_Table'])
+        elif os.environ.get('Telemetry_Database') :
+            store = SqliteTelemetryStore(os.environ['Telemetry_Database'])
+        else :
+            store = False
+    return store
+
+
+# Store the telemetry record of one build
+def record_build(record):
+    if not get_store() :
+        logger.info("Neither Telemetry_Table nor Telemetry_Database is set, build telemetry is not stored.")
+        return None
+    get_store().put(record)
+    logger.info("Build telemetry stored for %s, %s.", record['ImagePrefix'], record_key(record))
+    return record_key(record)
+
+
+# Read the most recent build telemetry records of an image prefix, oldest first
+def load_builds(image_prefix, limit=builds_read_limit):
+    if not get_store() :
+        return []
+    return get_store().query(image_prefix, limit)
+
+
+# Hash of the automation parameters that shape what is built
+def inputs_fingerprint(parameters):
+    inputs = {name : parameters.get(name) for name in fingerprint_parameters}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
+
+
+# Phase durations measured from the execution history, in seconds
+# Provisioning runs from creating the image builder until the install task starts, including the waits for the builder,
+# snapshot from the Run Image Assistant task, or the end of an install that created the image, until the image was
+# last described, and total from the start of the execution
+def execution_phases(execution_arn):
+    entered = {}
+    exited = {}
+    started = None
+    for page in get_client('stepfunctions').get_paginator('get_execution_history').paginate(executionArn=execution_arn, includeExecutionData=False) :
+        for event in page['events'] :
+            if event['type'] == "ExecutionStarted" :
+                started = event['timestamp'].timestamp()
+            elif 'stateEnteredEventDetails' in event :
+                entered.setdefault(event['stateEnteredEventDetails']['name'], []).append(event['timestamp'].timestamp())
+            elif 'stateExitedEventDetails' in event :
+                exited.setdefault(event['stateExitedEventDetails']['name'], []).append(event['timestamp'].timestamp())
+
+    phases = {}
+    if create_state in entered and install_state in entered :
+        phases['Provisioning'] = round(entered[install_state][0] - entered[create_state][0])
+    if image_assistant_state in entered :
+        snapshot_start = entered[image_assistant_state][0]
+    else :
+        snapshot_start = max(exited.get(install_state, [None]))
+    if snapshot_start and image_status_state in exited :
+        phases['Snapshot'] = round(exited[image_status_state][-1] - snapshot_start)
+    if started :
+        phases['Total'] = round(time.time() - started)
+    return phases
+
+
+# Name a plan step in the telemetry, Linux steps are numbered and Windows steps named
+def step_name(step):
+    return step if isinstance(step, str) else "Step-" + str(step)
+
+
+# Phase durations of one image builder, from the install task results and the execution history
+# Manifest generation is the time spent in the add-application steps that generated a manifest
+def builder_phases(builder, execution):
+    phases = dict(execution)
+    phases.update(builder.get('Phases') or {})
+    commands = {step_name(result['Step']) : result['DurationSeconds'] for result in builder.get('Commands', []) if 'DurationSeconds' in result and result['Status'] != "Skipped"}
+    if builder.get('ManifestSteps') :
+        phases['ManifestGeneration'] = round(sum(commands.get(step_name(step), 0) for step in builder['ManifestSteps']), 1)
+    if 'ImageCreation' in phases and 'Snapshot' in phases :
+        phases['Snapshot'] += phases['ImageCreation']
+    phases['Commands'] = commands
+    return phases
+
+
+# Telemetry records of a finished execution, one for each image builder the install task reported on
+# Installs resumed from a checkpoint only ran part of the plan, they are recorded but marked as resumed
+# A failed execution carries the error the state machine caught, its records keep the phases measured before it failed
+# Linux install results list every builder under Builders, Windows results describe their single builder
+def build_records(event, image_name, image_state, platform):
+    parameters = event.get('AutomationParameters', {})
+    install = event.get('InstallStatus') or {}
+    execution_arn = (event.get('Execution') or {}).get('Id')
+    execution = execution_phases(execution_arn) if execution_arn else {}
+    # Distribution runs until the copy to the slowest region was available
+    if (event.get('Distribution') or {}).get('Seconds') is not None :
+        execution['Distribution'] = event['Distribution']['Seconds']
+    # Rollout runs until the last fleet cut over to the image
+    if (event.get('Rollout') or {}).get('Seconds') is not None :
+        execution['Rollout'] = event['Rollout']['Seconds']
+    records = []
+    for builder in install.get('Builders', [install]) :
+        records.append({
+            'RecordedAt' : time.time(),
+            'ImagePrefix' : parameters.get('ImageOutputPrefix'),
+            'ImageName' : image_name,
+            'ImageState' : image_state,
+            'ExecutionId' : execution_arn,
+            'ImageBuilderName' : builder.get('ImageBuilderName') or parameters.get('ImageBuilderName'),
+            'InstanceType' : parameters.get('ImageBuilderType'),
+            'Platform' : platform,
+            'InputsFingerprint' : inputs_fingerprint(parameters),
+            'BuilderReused' : bool(parameters.get('PreExistingBuilder')),
+            'Resumed' : bool(builder.get('Resumed')),
+            'Phases' : builder_phases(builder, execution),
+            'Utilisation' : builder.get('Utilisation')
+        })
+        if event.get('Error') :
+            records[-1]['Error'] = event['Error'].get('Error')
+            records[-1]['Cause'] = (event['Error'].get('Cause') or "")[:max_cause_length]
+    return records
@@ -0,0 +1,484 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import base64
+import datetime
+import functools
+import gzip
+import importlib.util
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from . import clients
+
+logger = logging.getLogger(__name__)
+
+# Invocations of the traced handlers are recorded when Trace_Location is set, to an s3://bucket/prefix/ URI or a local folder
+# The variable is read on each invocation rather than when the module is imported
+
+# Responses of calls returning secrets are recorded with their values replaced, replayed handlers never see the secrets
+redacted_operations = (('ssm', 'GetParameter'), ('ssm', 'GetParameters'), ('secretsmanager', 'GetSecretValue'))
+redacted_fields = ('Value', 'SecretString', 'SecretBinary')
+redacted_value = "REDACTED"
+
+# Environment variables recorded with a trace and restored on replay
+# The automation's own variables are mixed case, the upper case variables of the runtime and its credentials are left out
+recorded_environment = ('AWS_REGION', 'AWS_LAMBDA_FUNCTION_NAME')
+
+# Streamed bodies longer than this are passed to the handler unread and replayed as zeros of the same length,
+# artifacts streamed into image builders would otherwise be held in memory and written to the trace
+recorded_body_limit = 1048576
+
+# Recorder or Replayer of the current invocation, None when neither is running
+active = None
+
+# Context of a replayed invocation, the remaining time follows the recorded timeline
+ReplayContext = namedtuple('ReplayContext', ['function_name', 'aws_request_id', 'invoked_function_arn', 'get_remaining_time_in_millis'])
+
+
+# Raised by a replay when the handler makes a call the trace has no record of
+class TraceMismatchError(Exception):
+    pass
+
+
+# JSON form of request parameters, responses and command output
+# Dates, bytes and streamed bodies are tagged so they are restored to the same types on replay
+def encode(value):
+    if isinstance(value, dict) :
+        return {str(key) : encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)) :
+        return [encode(item) for item in value]
+    if isinstance(value, datetime.datetime) :
+        return {'__datetime__' : value.isoformat()}
+    if isinstance(value, bytes) :
+        try :
+            return {'__bytes__' : value.decode('utf-8')}
+        except UnicodeDecodeError :
+            return {'__base64__' : base64.b64encode(value).decode()}
+    if value is None or isinstance(value, (str, int, float, bool)) :
+        return value
+    return repr(value)
+
+
+def decode(value):
+    if isinstance(value, list) :
+        return [decode(item) for item in value]
+    if not isinstance(value, dict) :
+        return value
+    if len(value) == 1 :
+        tag, item = next(iter(value.items()))
+        if tag == '__datetime__' :
+            return datetime.datetime.fromisoformat(item)
+        if tag == '__bytes__' :
+            return item.encode('utf-8')
+        if tag == '__base64__' :
+            return base64.b64decode(item)
+        if tag == '__stream__' :
+            from botocore.response import StreamingBody
+            data = decode(item)
+            return StreamingBody(io.BytesIO(data), len(data))
+        if tag == '__unrecorded_stream__' :
+            from botocore.response import StreamingBody
+            return StreamingBody(ZeroStream(item), item)
+    return {key : decode(item) for key, item in value.items()}
+
+
+# Stream of zeros standing in for a body too long to record
+class ZeroStream (io.RawIOBase) :
+    def __init__(self, length):
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self.remaining)
+        buffer[:count] = bytes(count)
+        self.remaining -= count
+        return count
+
+
+# Replace secret values in a recorded response, JSON secrets keep their keys so replayed handlers can still parse them
+def redact(response):
+    for field in redacted_fields :
+        if isinstance(response.get(field), str) :
+            try :
+                secret = json.loads(response[field])
+                response[field] = json.dumps({key : redacted_value for key in secret}) if isinstance(secret, dict) else redacted_value
+            except ValueError :
+                response[field] = redacted_value
+        elif field in response :
+            response[field] = redacted_value
+    for item in response.values() :
+        for entry in (item if isinstance(item, list) else [item]) :
+            if isinstance(entry, dict) :
+                redact(entry)
+    return response
+
+
+# Records the AWS calls and remote commands of one handler invocation
+class Recorder :
+    def __init__(self, function_name, event, context):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.header = {
+            'Trace' : 1,
+            'Function' : function_name,
+            'RecordedAt' : self.started,
+            'Event' : encode(event),
+            'Environment' : {key : value for key, value in os.environ.items() if key in recorded_environment or key != key.upper()},
+            'RemainingMs' : context.get_remaining_time_in_millis() if hasattr(context, 'get_remaining_time_in_millis') else None,
+            'InvokedFunctionArn' : getattr(context, 'invoked_function_arn', None)
+        }
+        self.events = []
+
+    def record(self, started, event):
+        event['At'] = round(started - self.started, 3)
+        event['Seconds'] = round(time.time() - started, 3)
+        with self.lock :
+            self.events.append(event)
+
+    def finish(self, result=None, error=None):
+        footer = {'Seconds' : round(time.time() - self.started, 3)}
+        if error :
+            footer['Error'] = type(error).__name__ + ": " + str(error)
+        else :
+            footer['Result'] = encode(result)
+        return [self.header] + self.events + [footer]
+
+
+# Feeds the recorded responses and command results back to a handler, in place of AWS and the image builders
+# Calls are matched by service and operation, or builder and command, preferring the recorded call with the same arguments
+# Each replayed call waits for its recorded duration divided by speed, a speed of 0 replays without waiting
+class Replayer :
+    def __init__(self, lines, speed=1.0):
+        self.header, self.footer = lines[0], lines[-1]
+        self.events = lines[1:-1]
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.queues = {}
+        for event in self.events :
+            self.queues.setdefault(self.key(event), []).append(event)
+        self.replayed = []
+        self.mismatches = []
+        self.differences = []
+        self.waited = 0.0
+
+    @staticmethod
+    def key(event):
+        if event['Kind'] == "aws" :
+            return ("aws", event['Service'], event['Operation'])
+        return (event['Kind'], event['Target'], event.get('Method'))
+
+    def next(self, key, argument):
+        with self.lock :
+            queue = self.queues.get(key) or []
+            matching = [event for event in queue if event.get('Params', event.get('Argument')) == argument]
+            if not queue :
+                self.mismatches.append("No recorded " + " ".join(str(part) for part in key if part))
+                raise TraceMismatchError(self.mismatches[-1])
+            event = (matching or queue)[0]
+            if not matching :
+                self.differences.append("Arguments of " + " ".join(str(part) for part in key if part) + " differ from the recording")
+            queue.remove(event)
+            self.replayed.append(event)
+        if self.speed > 0 :
+            time.sleep(event['Seconds'] / self.speed)
+            with self.lock :
+                self.waited += event['Seconds'] / self.speed
+        return event
+
+    # Position on the recorded timeline, the end of the latest replayed call
+    def elapsed(self):
+        with self.lock :
+            return max([event['At'] + event['Seconds'] for event in self.replayed] + [0])
+
+    def context(self):
+        remaining = self.header.get('RemainingMs') or 900000
+        return ReplayContext(self.header['Function'], "replay", self.header.get('InvokedFunctionArn') or
+            "arn:aws:lambda:" + os.environ.get('AWS_REGION', "us-east-1") + ":000000000000:function:" + self.header['Function'],
+            lambda : max(0, int(remaining - self.elapsed() * 1000)))
+
+
+# Botocore hooks attached to every client, they record or replay the call when a trace is active
+# Calls are identified by the parameters the handler passed, before they are serialised into the request
+def before_parameters(params, context, **kwargs):
+    if active :
+        context['trace_params'] = encode(params)
+        context['trace_started'] = time.time()
+
+
+def before_call(model, context, **kwargs):
+    if isinstance(active, Replayer) :
+        from botocore.awsrequest import AWSResponse
+        event = active.next(("aws", model.service_model.service_name, model.name), context.get('trace_params'))
+        return AWSResponse(None, event['Status'], {}, None), decode(event['Response'])
+    return None
+
+
+def after_call(http_response, parsed, model, context, **kwargs):
+    if not isinstance(active, Recorder) or 'trace_started' not in context :
+        return
+    from botocore.response import StreamingBody
+    response = {}
+    for key, value in parsed.items() :
+        if isinstance(value, StreamingBody) and int(http_response.headers.get('content-length') or 0) > recorded_body_limit :
+            response[key] = {'__unrecorded_stream__' : int(http_response.headers['content-length'])}
+        elif isinstance(value, StreamingBody) :
+            # The body can only be read once, the handler is given a copy of what was read
+            data = value.read()
+            parsed[key] = StreamingBody(io.BytesIO(data), len(data))
+            response[key] = {'__stream__' : encode(data)}
+        elif key == 'ResponseMetadata' :
+            response[key] = {field : value[field] for field in ('RequestId', 'HTTPStatusCode') if field in value}
+        else :
+            response[key] = encode(value)
+    service = model.service_model.service_name
+    if (service, model.name) in redacted_operations :
+        redact(response)
+    active.record(context['trace_started'], {
+        'Kind' : "aws",
+        'Service' : service,
+        'Operation' : model.name,
+        'Params' : context.get('trace_params'),
+        'Status' : http_response.status_code,
+        'Response' : response
+    })
+
+
+def attach_tracer(client):
+    client.meta.events.register('before-parameter-build', before_parameters)
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    return client
+
+
+# Session on an image builder whose commands are recorded, or replayed without a session when the trace is replayed
+class TracedSession :
+    def __init__(self, session, target, connect_stats=None):
+        self.session = session
+        self.target = target
+        if connect_stats is not None :
+            self.connect_stats = connect_stats
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def call(self, method, argument, invoke):
+        if isinstance(active, Replayer) :
+            from .remote import CommandResult
+            result = active.next(("command", self.target, method), argument).get('Result')
+            return CommandResult(**decode(result)) if result else None
+        started = time.time()
+        result = invoke()
+        if isinstance(active, Recorder) :
+            active.record(started, {
+                'Kind' : "command",
+                'Target' : self.target,
+                'Method' : method,
+                'Argument' : argument,
+                'Result' : encode(result._asdict()) if result is not None else None
+            })
+        return result
+
+    def run(self, cmd, *args, **kwargs):
+        return self.call('run', cmd, lambda : self.session.run(cmd, *args, **kwargs))
+
+    def run_cmd(self, cmd, *args, **kwargs):
+        return self.call('run_cmd', cmd, lambda : self.session.run_cmd(cmd, *args, **kwargs))
+
+    # Only the path of written files is recorded, the content is still generated on replay so its cost is profiled
+    def put_file(self, path, content):
+        if isinstance(active, Replayer) :
+            for chunk in ([content] if isinstance(content, str) else content) :
+                pass
+        return self.call('put_file', path, lambda : self.session.put_file(path, content))
+
+    # Parts are recorded by path and offset, their content is still read on replay like that of written files
+    def put_part(self, path, offset, content):
+        if isinstance(active, Replayer) :
+            for chunk in content :
+                pass
+        return self.call('put_part', path + "@" + str(offset), lambda : self.session.put_part(path, offset, content))
+
+    def close(self):
+        if self.session :
+            self.session.close()
+
+
+# Open a session on an image builder through connect, recording the connection and its commands when recording,
+# or a replayed session when replaying, connection errors of the given types are recorded and raised again on replay
+def traced_connect(protocol, target, connect, errors=()):
+    if isinstance(active, Replayer) :
+        event = active.next(("connect", target, protocol), target)
+        if event.get('Error') :
+            error_type = next((error for error in errors if error.__name__ == event['Error']['Type']), RuntimeError)
+            error = error_type(event['Error']['Message'])
+            error.__dict__.update(event['Error']['Attributes'])
+            raise error
+        return TracedSession(None, target, event.get('Stats'))
+    if not isinstance(active, Recorder) :
+        return connect()
+    started = time.time()
+    try :
+        session = connect()
+    except errors as error :
+        active.record(started, {'Kind' : "connect", 'Target' : target, 'Method' : protocol, 'Argument' : target,
+            'Error' : {'Type' : type(error).__name__, 'Message' : str(error), 'Attributes' : encode(vars(error))}})
+        raise
+    active.record(started, {'Kind' : "connect", 'Target' : target, 'Method' : protocol, 'Argument' : target,
+        'Stats' : getattr(session, 'connect_stats', None)})
+    return TracedSession(session, target, getattr(session, 'connect_stats', None))
+
+
+# Compact trace file, one JSON line for the invocation, each call and the outcome, gzip compressed
+def write_trace(lines, path):
+    with gzip.open(path, 'wt') as trace_file :
+        for line in lines :
+            trace_file.write(json.dumps(line, separators=(',', ':')) + "\n")
+
+
+def read_trace(path):
+    with gzip.open(path, 'rt') as trace_file :
+        return [json.loads(line) for line in trace_file if line.strip()]
+
+
+# Save a trace to the Trace_Location, the upload itself is not recorded
+def save_trace(lines, function_name, trace_location):
+    name = function_name + "/" + time.strftime("%Y%m%d-%H%M%S", time.gmtime(lines[0]['RecordedAt'])) + "-" + str(os.getpid()) + ".jsonl.gz"
+    if trace_location.startswith("s3://") :
+        bucket, _, prefix = trace_location[5:].partition("/")
+        key = prefix.rstrip("/") + "/" + name if prefix else name
+        body = gzip.compress("".join(json.dumps(line, separators=(',', ':')) + "\n" for line in lines).encode())
+        clients.get_client('s3').put_object(Bucket=bucket, Key=key, Body=body)
+        return "s3://" + bucket + "/" + key
+    path = os.path.join(trace_location, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_trace(lines, path)
+    return path
+
+
+# Record every invocation of a Lambda handler when Trace_Location is set, a failure to save the trace never fails the handler
+def traced(handler):
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global active
+        trace_location = os.environ.get('Trace_Location')
+        if not trace_location or active :
+            return handler(event, context)
+        function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME') or handler.__module__
+        recorder = active = Recorder(function_name, event, context)
+        try :
+            result = handler(event, context)
+        except Exception as error :
+            lines = recorder.finish(error=error)
+            raise
+        else :
+            lines = recorder.finish(result=result)
+        finally :
+            active = None
+            try :
+                logger.info("Trace of %s calls saved to %s.", len(lines) - 2, save_trace(lines, function_name, trace_location))
+            except Exception as error :
+                logger.error(error)
+        return result
+    return wrapper
+
+
+# Settings the layer reads from the environment on first use, cleared so a replay reads them from the recorded environment
+environment_settings = (('parameters', 'environment'), ('rate_limit', 'store'), ('rate_limit', 'bucket_rate'),
+    ('rate_limit', 'bucket_capacity'), ('telemetry', 'store'))
+
+
+# Load a handler module from its lambda_function.py file
+def load_handler(path):
+    spec = importlib.util.spec_from_file_location("replayed_lambda_function", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.lambda_handler
+
+
+# Replay a trace against a handler, returning the result and how the wall time split between the handler and replayed waits
+# Calls missing from the trace are mismatches, calls whose arguments changed, such as image names holding the time, are differences
+def replay(lines, handler_path, speed=1.0, profile=False):
+    global active
+    replayer = Replayer(lines, speed)
+    os.environ.update(replayer.header.get('Environment') or {})
+    os.environ.setdefault('AWS_DEFAULT_REGION', os.environ.get('AWS_REGION', "us-east-1"))
+    for module_name, setting in environment_settings :
+        module = sys.modules.get(__package__ + "." + module_name)
+        if module :
+            setattr(module, setting, None)
+    handler = load_handler(handler_path)
+    profiler = None
+    if profile :
+        import cProfile
+        profiler = cProfile.Profile()
+    outcome = {}
+    active = replayer
+    started = time.time()
+    try :
+        if profiler :
+            profiler.enable()
+        outcome['Result'] = handler(decode(replayer.header['Event']), replayer.context())
+    except Exception as error :
+        outcome['Error'] = type(error).__name__ + ": " + str(error)
+    finally :
+        if profiler :
+            profiler.disable()
+        active = None
+    outcome['Seconds'] = round(time.time() - started, 3)
+    outcome['WaitedSeconds'] = round(replayer.waited, 3)
+    outcome['HandlerSeconds'] = round(outcome['Seconds'] - replayer.waited, 3)
+    outcome['Replayed'] = len(replayer.replayed)
+    outcome['Unused'] = sum(len(queue) for queue in replayer.queues.values())
+    outcome['Mismatches'] = replayer.mismatches
+    outcome['Differences'] = replayer.differences
+    outcome['MatchesRecording'] = (encode(outcome.get('Result')) == replayer.footer.get('Result')
+        and outcome.get('Error') == replayer.footer.get('Error'))
+    return outcome, profiler
+
+
+# Time spent in each kind of recorded call, overlapping calls of parallel threads are only counted once in the total
+def trace_summary(lines):
+    header, events, footer = lines[0], lines[1:-1], lines[-1]
+    totals = {}
+    for event in events :
+        name = event['Service'] + ":" + event['Operation'] if event['Kind'] == "aws" else event['Kind'] + " " + event['Method']
+        count, seconds = totals.get(name, (0, 0.0))
+        totals[name] = (count + 1, seconds + event['Seconds'])
+    waiting, end = 0.0, 0.0
+    for event in sorted(events, key=lambda event : event['At']) :
+        start, finish = max(event['At'], end), event['At'] + event['Seconds']
+        if finish > start :
+            waiting += finish - start
+        end = max(end, finish)
+    return {
+        'Function' : header['Function'],
+        'Seconds' : footer['Seconds'],
+        'WaitingSeconds' : round(waiting, 3),
+        'HandlerSeconds' : round(footer['Seconds'] - waiting, 3),
+        'Calls' : {name : {'Count' : count, 'Seconds' : round(seconds, 3)} for name, (count, seconds) in sorted(totals.items(), key=lambda item : -item[1][1])},
+        'Slowest' : [{'Name' : event.get('Operation') or (event['Method'] + " " + event['Argument'])[:80], 'Seconds' : event['Seconds']}
+            for event in sorted(events, key=lambda event : -event['Seconds'])[:5]],
+        'Outcome' : "Error: " + footer['Error'] if 'Error' in footer else "Succeeded"
+    }
@@ -0,0 +1,133 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import hashlib
+import logging
+import os
+import sys
+import threading
+
+# The scripts run from a checkout, the as2_automation package is found in the folder above
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from as2_automation import artifacts
+from as2_automation.remote import SSHSession
+
+
+# Push a set of artifacts from an in memory source into a local paramiko SSH and SFTP server and compare throughput
+# one channel at a time with several, the server writes under a temporary directory and runs commands with bash
+if __name__ == "__main__" :
+    import argparse
+    import multiprocessing
+    import shutil
+    import socket
+    import subprocess
+    import tempfile
+    import paramiko
+
+    parser = argparse.ArgumentParser(prog="python scripts/artifact_benchmark.py")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--files", type=int, default=8, help="Number of 16 MiB artifacts pushed with one 160 MiB artifact")
+    parser.add_argument("--compress", action="store_true")
+    arguments = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    artifacts.privileged = ""
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    client_key = paramiko.ECDSAKey.generate()
+
+    class LocalServer (paramiko.ServerInterface) :
+        def get_allowed_auths(self, username):
+            return "publickey"
+
+        def check_auth_publickey(self, username, key):
+            return paramiko.AUTH_SUCCESSFUL if key.get_base64() == client_key.get_base64() else paramiko.AUTH_FAILED
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED if kind == "session" else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+        def check_channel_exec_request(self, channel, command):
+            def run():
+                result = subprocess.run(["bash", "-c", command.decode()], capture_output=True)
+                channel.sendall(result.stdout)
+                channel.sendall_stderr(result.stderr)
+                channel.send_exit_status(result.returncode)
+                channel.close()
+            threading.Thread(target=run, daemon=True).start()
+            return True
+
+    class LocalSFTPServer (paramiko.SFTPServerInterface) :
+        def open(self, path, flags, attr):
+            handle = paramiko.SFTPHandle(flags)
+            handle.readfile = handle.writefile = os.fdopen(os.open(path, flags, 0o644), "r+b" if flags & os.O_RDWR else "wb" if flags & os.O_WRONLY else "rb")
+            return handle
+
+        def stat(self, path):
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+
+        lstat = stat
+
+    def serve(listener):
+        host_key = paramiko.ECDSAKey.generate()
+        while True :
+            connection, address = listener.accept()
+            transport = paramiko.Transport(connection)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, LocalSFTPServer)
+            transport.start_server(server=LocalServer())
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(4)
+    server = multiprocessing.get_context("fork").Process(target=serve, args=(listener,), daemon=True)
+    server.start()
+
+    # Source objects of random content, fetched by range like S3
+    objects = {"installers/suite.tar" : os.urandom(160 * 1048576)}
+    objects.update({"installers/plugin" + str(index) + ".rpm" : os.urandom(16 * 1048576) for index in range(arguments.files)})
+
+    class SimulatedSource :
+        def head_object(self, Bucket, Key):
+            return {'ContentLength' : len(objects[Key])}
+
+        def get_object(self, Bucket, Key, Range):
+            start, end = (int(value) for value in Range[len("bytes="):].split("-"))
+            data = objects[Key][start:end + 1]
+
+            class Body :
+                def iter_chunks(self, size):
+                    for offset in range(0, len(data), size) :
+                        yield data[offset:offset + size]
+            return {'Body' : Body()}
+
+    artifacts.get_client = lambda service, endpoint_url=None : SimulatedSource()
+    entries = [{'Source' : "s3://artifacts/" + key, 'Destination' : os.path.join(root, "staged", key)} for key in objects]
+    entries[0]['Sha256'] = hashlib.sha256(objects["installers/suite.tar"]).hexdigest()
+
+    print("Pushing " + str(len(entries)) + " artifacts, " + str(round(sum(len(data) for data in objects.values()) / 1048576)) + " MiB, into a local paramiko server"
+        + (" with compression" if arguments.compress else "") + ":")
+    for concurrency in arguments.concurrency :
+        shutil.rmtree(os.path.join(root, "staged"), ignore_errors=True)
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect("127.0.0.1", port=listener.getsockname()[1], username="as2-automation", pkey=client_key, compress=arguments.compress,
+            look_for_keys=False, allow_agent=False)
+        report = artifacts.push_artifacts(SSHSession("127.0.0.1", client), entries, concurrency)
+        client.close()
+        print("  " + str(concurrency).rjust(2) + " channel(s): " + str(report['Seconds']) + " seconds, " + str(report['MiBps']) + " MiB/s, verified in "
+            + str(report['VerifySeconds']) + " seconds")
+    server.terminate()
+    shutil.rmtree(root)
@@ -0,0 +1,36 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import logging
+import os
+import sys
+
+# The scripts run from a checkout, the as2_automation package is found in the folder above
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from as2_automation.sizing import recommend_instance_type
+
+
+# Print the recommendation for an image prefix
+# Usage: python scripts/recommend_instance_type.py IMAGE_PREFIX [TARGET_MINUTES] [Linux|Windows], with Telemetry_Table or Telemetry_Database set
+if __name__ == "__main__" :
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if len(sys.argv) < 2 :
+        sys.exit("Usage: python scripts/recommend_instance_type.py IMAGE_PREFIX [TARGET_MINUTES] [Linux|Windows]")
+    target_minutes = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+    recommendation = recommend_instance_type(sys.argv[1], sys.argv[3] if len(sys.argv) > 3 else "Linux", target_minutes * 60)
+    print(json.dumps(recommendation, indent=2))
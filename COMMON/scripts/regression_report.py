@@ -0,0 +1,52 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+# The scripts run from a checkout, the as2_automation package is found in the folder above
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from as2_automation.regression import baseline_builds, regression_report, regression_threshold
+
+
+# Print the phase regressions of the recorded builds, exiting with status 1 if any were found
+# Usage: python scripts/regression_report.py [--window N] [--threshold FRACTION] [--latest] [--json] [IMAGE_PREFIX ...]
+if __name__ == "__main__" :
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(prog="python scripts/regression_report.py", description="Flag build phases that regressed against a rolling baseline.")
+    parser.add_argument('image_prefixes', nargs='*', help="image prefixes to report on, every prefix in the telemetry store by default")
+    parser.add_argument('--window', type=int, default=baseline_builds, help="builds in the rolling baseline")
+    parser.add_argument('--threshold', type=float, default=regression_threshold, help="slowdown over the baseline median that is flagged, 0.25 is 25%%")
+    parser.add_argument('--latest', action='store_true', help="only report on the latest build of each prefix")
+    parser.add_argument('--json', action='store_true', help="print the regressions as JSON")
+    arguments = parser.parse_args()
+
+    regressions = regression_report(arguments.image_prefixes, arguments.window, arguments.threshold, arguments.latest)
+    if arguments.json :
+        print(json.dumps(regressions, indent=2))
+    else :
+        for regression in regressions :
+            print(time.strftime("%Y-%m-%d %H:%M", time.gmtime(regression['RecordedAt'])) + "  " + regression['ImageName'] + "  " + regression['Phase']
+                + ": " + str(regression['Seconds']) + "s against a baseline of " + str(regression['BaselineSeconds']) + "s (+" + str(regression['IncreasePercent']) + "%)"
+                + (", changed: " + ", ".join(regression['ChangedInputs']) if regression['ChangedInputs'] else ""))
+        if not regressions :
+            print("No phase regressions found.")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,55 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+# The scripts run from a checkout, the as2_automation package is found in the folder above
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from as2_automation import trace
+
+
+# Summarise a trace, or replay it against a handler and report the handler's own time
+# Usage: python scripts/replay_trace.py summary TRACE
+#        python scripts/replay_trace.py replay TRACE HANDLER_FILE [--speed N] [--profile]
+if __name__ == "__main__" :
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(prog="python scripts/replay_trace.py", description="Summarise or replay recorded handler invocations.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    summary_parser = commands.add_parser('summary', help="print where the recorded invocation spent its time")
+    summary_parser.add_argument('trace', help="trace file (.jsonl.gz)")
+    replay_parser = commands.add_parser('replay', help="run a handler against the recorded calls")
+    replay_parser.add_argument('trace', help="trace file (.jsonl.gz)")
+    replay_parser.add_argument('handler', help="lambda_function.py of the handler, such as LINUX/Lambda/FN02_AS2_Linux_Automation_Scripted_Install/lambda_function.py")
+    replay_parser.add_argument('--speed', type=float, default=0, help="1 replays the recorded timing, 10 ten times faster, 0 without waiting (default)")
+    replay_parser.add_argument('--profile', action='store_true', help="print the functions where the handler spent most time")
+    arguments = parser.parse_args()
+
+    lines = trace.read_trace(arguments.trace)
+    if arguments.command == "summary" :
+        print(json.dumps(trace.trace_summary(lines), indent=2))
+        sys.exit(0)
+
+    outcome, profiler = trace.replay(lines, arguments.handler, arguments.speed, arguments.profile)
+    print(json.dumps({key : value for key, value in outcome.items() if key != 'Result'}, indent=2, default=str))
+    if profiler :
+        import pstats
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+    sys.exit(1 if outcome['Mismatches'] else 0)
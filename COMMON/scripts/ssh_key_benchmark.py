@@ -0,0 +1,120 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+import os
+import socket
+import sys
+import time
+
+# The scripts run from a checkout, the as2_automation package is found in the folder above
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from as2_automation.remote import open_ssh, parse_ssh_key, ssh_username
+
+
+# Benchmark loading a key of each type and connecting with it to a local paramiko server offering the host keys of sshd
+# Lambda allocates CPU in proportion to memory, a full vCPU at 1769 MB, so the client CPU time measured here is scaled
+# to each memory size, the server's share of the handshake runs on the image builder and is not scaled
+if __name__ == "__main__" :
+    import argparse
+    import multiprocessing
+    import statistics
+    import threading
+    import paramiko
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+    full_vcpu_memory_mb = 1769
+    parser = argparse.ArgumentParser(prog="python scripts/ssh_key_benchmark.py")
+    parser.add_argument("--memory", type=int, nargs="+", default=[256, 512, 1024, full_vcpu_memory_mb], help="Lambda memory sizes in MB, the functions are configured with 256")
+    parser.add_argument("--rounds", type=int, default=20)
+    arguments = parser.parse_args()
+
+    # Keys in the formats written by as2-automate-setup.sh, RSA and ECDSA as PEM and Ed25519 in the OpenSSH format
+    def private_key_text(key, private_format):
+        return key.private_bytes(serialization.Encoding.PEM, private_format, serialization.NoEncryption()).decode()
+
+    keys = {
+        'ed25519' : private_key_text(ed25519.Ed25519PrivateKey.generate(), serialization.PrivateFormat.OpenSSH),
+        'ecdsa' : private_key_text(ec.generate_private_key(ec.SECP256R1()), serialization.PrivateFormat.TraditionalOpenSSL),
+        'rsa' : private_key_text(rsa.generate_private_key(65537, 2048), serialization.PrivateFormat.TraditionalOpenSSL)
+    }
+    authorized = {parse_ssh_key(text).get_base64() for text in keys.values()}
+
+    class BenchmarkServer (paramiko.ServerInterface) :
+        def get_allowed_auths(self, username):
+            return "publickey"
+
+        def check_auth_publickey(self, username, key):
+            return paramiko.AUTH_SUCCESSFUL if username == ssh_username and key.get_base64() in authorized else paramiko.AUTH_FAILED
+
+    # Serve each connection until the client closes it, in a separate process so only client CPU time is measured
+    def serve(listener):
+        host_keys = [paramiko.RSAKey.generate(2048), paramiko.ECDSAKey.generate(), parse_ssh_key(keys['ed25519'])]
+
+        def handle(connection):
+            transport = paramiko.Transport(connection)
+            for host_key in host_keys :
+                transport.add_server_key(host_key)
+            # The port probe of open_ssh closes its connection without sending a banner
+            try :
+                transport.start_server(server=BenchmarkServer())
+            except (paramiko.SSHException, EOFError) :
+                transport.close()
+                return
+            while transport.is_active() :
+                time.sleep(0.01)
+
+        while True :
+            connection, address = listener.accept()
+            threading.Thread(target=handle, args=(connection,), daemon=True).start()
+
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    port = listener.getsockname()[1]
+    server = multiprocessing.get_context("fork").Process(target=serve, args=(listener,), daemon=True)
+    server.start()
+
+    results = {}
+    for key_type, text in keys.items() :
+        samples = []
+        for attempt in range(arguments.rounds + 1) :
+            started, cpu_started = time.perf_counter(), time.process_time()
+            privkey = parse_ssh_key(text)
+            loaded, cpu_loaded = time.perf_counter(), time.process_time()
+            session = open_ssh("127.0.0.1", privkey, ssh_username, port, 10)
+            connected, cpu_connected = time.perf_counter(), time.process_time()
+            session.close()
+            # The first round warms up imports and caches
+            if attempt :
+                samples.append(((loaded - started) * 1000, (cpu_loaded - cpu_started) * 1000, (connected - loaded) * 1000, (cpu_connected - cpu_loaded) * 1000))
+        results[key_type] = [statistics.median(sample[index] for sample in samples) for index in range(4)]
+    server.terminate()
+
+    print("Median of " + str(arguments.rounds) + " rounds, key load and handshake in ms, measured wall time (client CPU time):")
+    for key_type, (load, load_cpu, handshake, handshake_cpu) in results.items() :
+        print("  " + key_type.ljust(8) + " load " + str(round(load, 2)) + " (" + str(round(load_cpu, 2)) + "), handshake "
+            + str(round(handshake, 1)) + " (" + str(round(handshake_cpu, 1)) + ")")
+    print("Projected key load and handshake in ms by Lambda memory size:")
+    print("  " + "MB".ljust(8) + "".join(key_type.rjust(10) for key_type in results))
+    for memory in arguments.memory :
+        scale = max(1.0, full_vcpu_memory_mb / memory)
+        projected = [(load_cpu + handshake_cpu) * scale + max(0.0, load - load_cpu) + max(0.0, handshake - handshake_cpu)
+            for load, load_cpu, handshake, handshake_cpu in results.values()]
+        print("  " + str(memory).ljust(8) + "".join(str(round(value, 1)).rjust(10) for value in projected))
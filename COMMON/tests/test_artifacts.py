@@ -0,0 +1,154 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import hashlib
+import io
+import os
+import subprocess
+import threading
+import pytest
+from as2_automation import artifacts, remote
+
+botocore_response = pytest.importorskip("botocore.response")
+
+
+# Objects served by ranged GETs, recording the ranges read
+class SimulatedS3 :
+    def __init__(self, objects):
+        self.objects = objects
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength' : len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = (int(value) for value in Range[len("bytes="):].split("-"))
+        with self.lock :
+            self.ranges.append((Key, start, end))
+        data = self.objects[Key][start:end + 1]
+        return {'Body' : botocore_response.StreamingBody(io.BytesIO(data), len(data))}
+
+
+# Image builder standing in for the SSH session, scripts run in a local shell and parts are written to local files
+# Parts written at a corrupt offset have their first byte flipped, as a transfer that went wrong would leave them
+class LocalBuilder :
+    def __init__(self, corrupt=()):
+        self.corrupt = corrupt
+        self.parts = []
+        self.lock = threading.Lock()
+
+    def run(self, cmd, log_output=True):
+        result = subprocess.run(["bash", "-c", cmd], capture_output=True)
+        return remote.CommandResult(result.stdout, result.stderr, result.returncode)
+
+    def put_part(self, path, offset, content):
+        data = b"".join(content)
+        if offset in self.corrupt :
+            data = bytes([data[0] ^ 0xff]) + data[1:]
+        with self.lock :
+            self.parts.append((path, offset, len(data)))
+        with open(path, 'r+b') as part_file :
+            part_file.seek(offset)
+            part_file.write(data)
+
+
+# Parts of 1 KiB read in chunks of 256 bytes, destinations created without sudo
+@pytest.fixture
+def source(monkeypatch):
+    monkeypatch.setattr(artifacts, 'part_size', 1024)
+    monkeypatch.setattr(artifacts, 'chunk_size', 256)
+    monkeypatch.setattr(artifacts, 'privileged', "")
+    s3 = SimulatedS3({
+        'installers/app.bin' : os.urandom(2500),
+        'installers/small.bin' : os.urandom(300)
+    })
+    monkeypatch.setattr(artifacts, 'get_client', lambda service, endpoint_url=None : s3)
+    return s3
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Objects are split into parts at every part size, the last part holding the rest
+def test_parts():
+    size = 2 * artifacts.part_size + 452
+    assert artifacts.get_parts(size) == [(0, artifacts.part_size), (artifacts.part_size, artifacts.part_size), (2 * artifacts.part_size, 452)]
+    assert artifacts.get_parts(artifacts.part_size) == [(0, artifacts.part_size)]
+    assert artifacts.get_parts(0) == []
+
+
+# Each part is read with its own range and written at its offset, and the file on the builder matches the source
+def test_parts_written_at_offsets(source, tmp_path):
+    destination = str(tmp_path / "opt" / "app.bin")
+    builder = LocalBuilder()
+    report = artifacts.push_artifacts(builder, [{'Source' : "s3://bucket/installers/app.bin", 'Destination' : destination, 'Mode' : "0600"}])
+
+    assert sorted(builder.parts) == [(destination, 0, 1024), (destination, 1024, 1024), (destination, 2048, 452)]
+    assert sorted(source.ranges) == [("installers/app.bin", 0, 1023), ("installers/app.bin", 1024, 2047), ("installers/app.bin", 2048, 2499)]
+    with open(destination, 'rb') as pushed :
+        assert pushed.read() == source.objects['installers/app.bin']
+    assert oct(os.stat(destination).st_mode & 0o777) == "0o600"
+    assert report['Files'][0]['Status'] == "Transferred"
+    assert report['Files'][0]['Parts'] == 3
+    assert report['Bytes'] == 2500
+
+
+# An artifact whose destination already holds its declared checksum is not read or written again
+def test_present_artifacts_skipped(source, tmp_path):
+    present = tmp_path / "small.bin"
+    present.write_bytes(source.objects['installers/small.bin'])
+    entries = [
+        {'Source' : "s3://bucket/installers/small.bin", 'Destination' : str(present), 'Sha256' : sha256(source.objects['installers/small.bin'])},
+        {'Source' : "s3://bucket/installers/app.bin", 'Destination' : str(tmp_path / "app.bin"), 'Sha256' : sha256(source.objects['installers/app.bin'])}
+    ]
+    builder = LocalBuilder()
+    report = artifacts.push_artifacts(builder, entries)
+
+    assert [file['Status'] for file in report['Files']] == ["Present", "Transferred"]
+    assert {path for path, offset, length in builder.parts} == {str(tmp_path / "app.bin")}
+    assert {key for key, start, end in source.ranges} == {"installers/app.bin"}
+    assert report['Bytes'] == 2500
+
+    # Pushed again, both are already present
+    builder = LocalBuilder()
+    report = artifacts.push_artifacts(builder, entries)
+    assert [file['Status'] for file in report['Files']] == ["Present", "Present"]
+    assert builder.parts == []
+
+
+# A file not matching its declared checksum is rejected
+def test_declared_checksum_mismatch_rejected(source, tmp_path):
+    destination = str(tmp_path / "app.bin")
+    with pytest.raises(artifacts.ArtifactTransferError) as error :
+        artifacts.push_artifacts(LocalBuilder(), [{'Source' : "s3://bucket/installers/app.bin", 'Destination' : destination, 'Sha256' : sha256(b"other")}])
+    assert destination in str(error.value)
+
+
+# Without a declared checksum, each part written is checked against the bytes read from the source
+def test_corrupt_part_rejected(source, tmp_path):
+    destination = str(tmp_path / "app.bin")
+    with pytest.raises(artifacts.ArtifactTransferError) as error :
+        artifacts.push_artifacts(LocalBuilder(corrupt=(1024,)), [{'Source' : "s3://bucket/installers/app.bin", 'Destination' : destination}])
+    assert "checksum verification" in str(error.value)
+    assert destination in str(error.value)
+
+    # A retried push writes the whole file again
+    artifacts.push_artifacts(LocalBuilder(), [{'Source' : "s3://bucket/installers/app.bin", 'Destination' : destination}])
+    with open(destination, 'rb') as pushed :
+        assert pushed.read() == source.objects['installers/app.bin']
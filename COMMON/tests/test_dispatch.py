@@ -0,0 +1,127 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import pytest
+from as2_automation import dispatch
+
+
+@pytest.fixture(autouse=True)
+def no_metrics(monkeypatch):
+    monkeypatch.setattr(dispatch, 'put_metrics', lambda *args : None)
+
+
+# Queue of 12 requests from one team and 3 from another, the last of them at a higher priority
+def shared_queue():
+    queue = dispatch.LocalQueue()
+    for index in range(12) :
+        queue.send(json.dumps({'Team' : "render", 'Priority' : 0, 'Input' : {}}))
+    for index in range(3) :
+        queue.send(json.dumps({'Team' : "desktop", 'Priority' : 1 if index == 2 else 0, 'Input' : {'Index' : index}}))
+    return queue
+
+
+# Two teams share a capacity of 4, the team with fewer running builds is admitted first and its higher priority request leads
+def test_teams_share_capacity():
+    queue = shared_queue()
+    running = {}
+    order = []
+    for round_number in range(4) :
+        admitted = []
+        report = dispatch.dispatch(queue, running, 4, {}, admitted.append)
+        order.append([request['Team'] + "/P" + str(request['Priority']) for request in admitted])
+        assert report['Started'] == [request['RequestId'] for request in admitted]
+        # Half of the admitted builds are still running at the next dispatch
+        running = {}
+        for request in admitted[:2] :
+            running[request['Team']] = running.get(request['Team'], 0) + 1
+    assert order == [
+        ["desktop/P1", "render/P0", "render/P0", "desktop/P0"],
+        ["render/P0", "desktop/P0"],
+        ["render/P0", "render/P0"],
+        ["render/P0", "render/P0"]
+    ]
+    assert queue.depth() == 15 - 10
+
+
+# Team weights scale the share of the capacity each team is given
+def test_weights_scale_shares():
+    admitted = dispatch.select_requests(
+        [dispatch.parse_request(json.dumps({'Team' : team}), team + str(index), index) for team in ("render", "desktop") for index in range(6)],
+        {}, 6, {'render' : 2})
+    assert [request['Team'] for request in admitted].count("render") == 4
+
+
+# No request is read while the capacity is used up
+def test_full_capacity_admits_nothing():
+    queue = shared_queue()
+    admitted = []
+    report = dispatch.dispatch(queue, {'render' : 4}, 4, {}, admitted.append)
+    assert admitted == []
+    assert report['Capacity'] == 0
+    assert queue.depth() == 15
+
+
+# A request whose execution could not be started stays queued, an invalid message is discarded
+def test_failed_starts_stay_queued():
+    queue = dispatch.LocalQueue()
+    queue.send("not json")
+    queue.send(json.dumps({'Team' : "render"}))
+
+    def start(request):
+        raise RuntimeError("StartExecution failed")
+
+    report = dispatch.dispatch(queue, {}, 4, {}, start)
+    assert report['Started'] == []
+    assert queue.depth() == 1
+    assert [request['Team'] for request, receipt in queue.receive(10)] == ["render"]
+
+
+# Execution names carry the team, so running builds are counted by team from the execution list
+def test_execution_names():
+    request = dispatch.parse_request(json.dumps({'Team' : "Render Farm!"}), "a" * 100, 0)
+    name = dispatch.execution_name(request)
+    assert len(name) == 80
+    assert dispatch.execution_team(name) == "Render-Farm-"
+    assert dispatch.execution_team("manual-execution") == dispatch.default_team
+
+
+# SQS client answering receives from a list of messages, up to the number asked for, and recording the requests
+class SimulatedSqs :
+    def __init__(self, count):
+        self.messages = [{'MessageId' : "m" + str(index), 'ReceiptHandle' : "r" + str(index), 'Body' : json.dumps({'Team' : "render"}),
+            'Attributes' : {'SentTimestamp' : str(1000 * index)}} for index in range(count)]
+        self.requests = []
+
+    def receive_message(self, **request):
+        self.requests.append(request)
+        batch, self.messages = self.messages[:request['MaxNumberOfMessages']], self.messages[request['MaxNumberOfMessages']:]
+        return {'Messages' : batch} if batch else {}
+
+
+# Every receive long polls, and batches are read until the queue is empty or enough requests were read
+def test_sqs_receive_long_polls(monkeypatch):
+    sqs = SimulatedSqs(23)
+    monkeypatch.setattr(dispatch, 'get_client', lambda service : sqs)
+    received = dispatch.SqsQueue("queue").receive(100)
+    assert [receipt for request, receipt in received] == ["r" + str(index) for index in range(23)]
+    assert [request['MaxNumberOfMessages'] for request in sqs.requests] == [10, 10, 10, 10]
+    assert all(request['WaitTimeSeconds'] == dispatch.receive_wait_seconds for request in sqs.requests)
+
+    sqs = SimulatedSqs(23)
+    monkeypatch.setattr(dispatch, 'get_client', lambda service : sqs)
+    assert len(dispatch.SqsQueue("queue").receive(15)) == 15
+    assert [request['MaxNumberOfMessages'] for request in sqs.requests] == [10, 5]
@@ -0,0 +1,127 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import botocore
+import pytest
+from as2_automation import distribution
+
+# Simulated copy durations, in minutes as the distribution is polled every minute
+copy_minutes = {'us-west-2' : 20, 'eu-west-1' : 30, 'eu-central-1' : 25, 'ap-southeast-2' : 40, 'ap-northeast-1' : 35}
+
+
+# In memory AppStream in every region, copy_image raises the error queued for the region and a copy ends in the state
+# queued for its attempt, otherwise it becomes available after its copy time
+class SimulatedAppStream :
+    def __init__(self, clock):
+        self.clock = clock
+        self.copies = {}
+        self.errors = {}
+        self.failures = {}
+        self.deleted = []
+
+    def client(self, service, region):
+        appstream = self
+
+        class Client :
+            def copy_image(self, SourceImageName, DestinationImageName, DestinationRegion, DestinationImageDescription):
+                if appstream.errors.get(DestinationRegion) :
+                    code = appstream.errors[DestinationRegion].pop(0)
+                    raise botocore.exceptions.ClientError({'Error' : {'Code' : code, 'Message' : "Simulated"}}, "CopyImage")
+                attempts = appstream.copies.get(DestinationRegion, (0, 0))[1] + 1
+                appstream.copies[DestinationRegion] = (appstream.clock.now, attempts)
+
+            def describe_images(self, Names):
+                started, attempts = appstream.copies[region]
+                if attempts in appstream.failures.get(region, ()) :
+                    return {'Images' : [{'Name' : Names[0], 'State' : "FAILED"}]}
+                ready = appstream.clock.now - started >= copy_minutes[region] * 60
+                return {'Images' : [{'Name' : Names[0], 'State' : "AVAILABLE" if ready else "PENDING"}]}
+
+            def delete_image(self, Name):
+                appstream.deleted.append(region)
+
+        return Client()
+
+
+@pytest.fixture
+def appstream(clock, monkeypatch):
+    simulated = SimulatedAppStream(clock)
+    monkeypatch.setattr(distribution, 'get_client', simulated.client)
+    monkeypatch.setattr(distribution, 'put_metrics', lambda *args : None)
+    monkeypatch.setattr(distribution, 'time', clock)
+    return simulated
+
+
+# Poll the distribution every minute until it settles, returning the most copies in progress at once
+def run_distribution(state, clock, max_concurrent):
+    most_copying = 0
+    for poll in range(1000) :
+        distribution.advance_distribution(state, max_concurrent)
+        most_copying = max(most_copying, len([copy for copy in state['Regions'] if copy['Status'] == "Copying"]))
+        if state['Status'] != "Running" :
+            return most_copying
+        clock.sleep(60)
+    raise AssertionError("Distribution did not settle")
+
+
+# Five regions with three copies at a time, a throttled start is retried on the next poll and a failed copy is started again
+def test_distribution_completes_with_retries(appstream, clock):
+    appstream.errors['eu-west-1'] = ["ThrottlingException"]
+    appstream.failures['ap-northeast-1'] = [1]
+    state = distribution.new_distribution("Image", "us-east-1", ",".join(["us-east-1"] + list(copy_minutes)))
+    assert [copy['Region'] for copy in state['Regions']] == list(copy_minutes)
+
+    assert run_distribution(state, clock, 3) == 3
+    assert state['Status'] == "Complete"
+    copies = {copy['Region'] : copy for copy in state['Regions']}
+    assert copies['eu-west-1']['Retries'] == 1
+    assert copies['ap-northeast-1']['Attempts'] == 2
+    assert appstream.deleted == ['ap-northeast-1']
+    assert all(copy['Seconds'] == copy_minutes[region] * 60 for region, copy in copies.items())
+    assert state['Seconds'] == max(copy['ReadyAfterSeconds'] for copy in copies.values())
+    assert state['Seconds'] < sum(copy_minutes.values()) * 60
+    assert "available in every region after " + str(state['Seconds']) + " seconds" in distribution.distribution_summary(state)
+
+
+# Copying to more regions at once finishes the distribution sooner
+def test_concurrency_shortens_distribution(appstream, clock):
+    durations = []
+    for max_concurrent in (1, 5) :
+        appstream.copies.clear()
+        state = distribution.new_distribution("Image", "us-east-1", list(copy_minutes))
+        run_distribution(state, clock, max_concurrent)
+        durations.append(state['Seconds'])
+    assert durations[1] < durations[0]
+    assert durations[1] == max(copy_minutes.values()) * 60
+
+
+# An error that is not transient fails the region and the distribution, a copy failing on every attempt fails its region
+def test_distribution_failures(appstream, clock):
+    appstream.errors['eu-west-1'] = ["InvalidAccountStatusException"]
+    appstream.failures['us-west-2'] = list(range(1, distribution.max_copy_attempts + 1))
+    state = distribution.new_distribution("Image", "us-east-1", ["us-west-2", "eu-west-1", "eu-central-1"])
+    run_distribution(state, clock, 3)
+    assert state['Status'] == "Failed"
+    assert [copy['Status'] for copy in state['Regions']] == ["Failed", "Failed", "Available"]
+    assert state['Regions'][0]['Attempts'] == distribution.max_copy_attempts
+    assert state['Regions'][1]['Error'].startswith("InvalidAccountStatusException")
+
+
+# Regions are read from a list or a comma separated string
+def test_parse_regions():
+    assert distribution.parse_regions(" us-west-2, ,eu-west-1 ") == ["us-west-2", "eu-west-1"]
+    assert distribution.parse_regions([]) is False
+    assert distribution.parse_regions(None) is False
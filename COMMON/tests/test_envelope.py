@@ -0,0 +1,107 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+from as2_automation.envelope import builder_envelope, get_builder_addresses, get_image_name, image_envelope
+
+
+# describe_images result for an image with the given number of applications
+def described_image(application_count):
+    applications = [
+        {
+            'Name' : "application-" + str(index),
+            'DisplayName' : "Application " + str(index),
+            'IconURL' : "https://appstream2-images.s3.amazonaws.com/icons/" + "0" * 40 + "/application-" + str(index) + ".png",
+            'LaunchPath' : "/usr/local/bin/application-" + str(index),
+            'LaunchParameters' : "",
+            'Enabled' : True,
+            'Metadata' : {},
+            'WorkingDirectory' : "/home/as2-user",
+            'Description' : "Application " + str(index) + " added by the image automation",
+            'Arn' : "arn:aws:appstream:us-east-1:123456789012:application/application-" + str(index),
+            'AppBlockArn' : "",
+            'IconS3Location' : {},
+            'Platforms' : ["AMAZON_LINUX2"],
+            'InstanceFamilies' : ["GENERAL_PURPOSE"],
+            'CreatedTime' : "2022-01-01T00:00:00Z"
+        } for index in range(application_count)
+    ]
+    return {
+        'Name' : "AS2_Automation_Image_2022-01-01_00-00-00",
+        'Arn' : "arn:aws:appstream:us-east-1:123456789012:image/AS2_Automation_Image_2022-01-01_00-00-00",
+        'BaseImageArn' : "arn:aws:appstream:us-east-1::image/AppStream-AmazonLinux2-01-01-2022",
+        'DisplayName' : "AS2 Automation Image",
+        'State' : "AVAILABLE",
+        'Visibility' : "PRIVATE",
+        'ImageBuilderSupported' : True,
+        'ImageBuilderName' : "AS2_Automation_Builder",
+        'Platform' : "AMAZON_LINUX2",
+        'Description' : "Image created by the AppStream 2.0 image automation",
+        'StateChangeReason' : {},
+        'Applications' : applications,
+        'CreatedTime' : "2022-01-01T00:00:00Z",
+        'PublicBaseImageReleasedDate' : "2022-01-01T00:00:00Z",
+        'AppstreamAgentVersion' : "01-01-2022",
+        'ImagePermissions' : {'allowFleet' : True, 'allowImageBuilder' : True},
+        'ImageErrors' : []
+    }
+
+
+# The envelope of an image with 50 applications keeps the fields later states read in a small fraction of the full result
+def test_image_envelope_is_compact():
+    image = described_image(50)
+    envelope = image_envelope(image)
+    assert envelope == {
+        'Name' : image['Name'],
+        'State' : "AVAILABLE",
+        'Platform' : ["AMAZON_LINUX2"],
+        'ImageBuilderName' : ["AS2_Automation_Builder"],
+        'AgentVersion' : ["01-01-2022"],
+        'Applications' : ["application-" + str(index) for index in range(50)]
+    }
+    full = len(json.dumps({'Images' : [image]}, separators=(',', ':')))
+    compact = len(json.dumps(envelope, separators=(',', ':')))
+    assert compact * 10 < full
+
+
+# Fields absent from the result are projected as empty lists
+def test_image_envelope_without_optional_fields():
+    assert image_envelope({'Name' : "Image", 'State' : "PENDING"}) == {
+        'Name' : "Image",
+        'State' : "PENDING",
+        'Platform' : [],
+        'ImageBuilderName' : [],
+        'AgentVersion' : [],
+        'Applications' : []
+    }
+
+
+# Builder addresses are read from the compact envelope and from a full describe_image_builders response
+def test_builder_addresses():
+    assert get_builder_addresses({'Name' : "builder", 'State' : "RUNNING", 'EniPrivateIpAddresses' : ["10.0.0.5"]}) == [("builder", "10.0.0.5")]
+    assert get_builder_addresses({'Name' : "builder", 'State' : "PENDING", 'EniPrivateIpAddresses' : []}) == [("builder", None)]
+    described = {'ImageBuilders' : [
+        {'Name' : "first", 'State' : "RUNNING", 'NetworkAccessConfiguration' : {'EniPrivateIpAddress' : "10.0.0.5"}},
+        {'Name' : "second", 'State' : "PENDING"}
+    ]}
+    assert get_builder_addresses(described) == [("first", "10.0.0.5"), ("second", None)]
+    assert builder_envelope(described['ImageBuilders'][1]) == {'Name' : "second", 'State' : "PENDING", 'EniPrivateIpAddresses' : []}
+
+
+# The image name is read from the compact envelope and from a task output listing Images
+def test_image_name():
+    assert get_image_name({'Name' : "Image"}) == "Image"
+    assert get_image_name({'Images' : [{'Name' : "Image"}]}) == "Image"
@@ -0,0 +1,67 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import os
+import subprocess
+import sys
+import pytest
+
+pytest.importorskip("boto3")
+
+common_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+repo_folder = os.path.join(common_folder, "..")
+
+# Cold start import budget of a function handler in milliseconds, the SSH and WinRM libraries of the layers included
+# boto3 and botocore come with the runtime and are imported before the handler, so their time is not counted
+import_budget_ms = int(os.environ.get('IMPORT_BUDGET_MS', 1500))
+
+# Each handler is imported this many times in a fresh interpreter and the fastest import counts
+# The bytecode cache is shared by the tests, as the layers ship their bytecode precompiled
+import_runs = 2
+
+handler_folders = sorted(
+    os.path.join(repo_folder, platform, "Lambda", name)
+    for platform in ("LINUX", "WINDOWS")
+    for name in os.listdir(os.path.join(repo_folder, platform, "Lambda"))
+    if os.path.isfile(os.path.join(repo_folder, platform, "Lambda", name, "lambda_function.py"))
+)
+
+
+# Cumulative import time of the handler module in microseconds, read from the -X importtime report
+def handler_import_us(folder, pycache):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([common_folder] + sys.path)
+    env['PYTHONPYCACHEPREFIX'] = pycache
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import boto3, botocore.session; import lambda_function"],
+        cwd=folder, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    for line in result.stderr.splitlines() :
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == "lambda_function" :
+            return int(fields[1])
+    raise AssertionError("No import time reported for lambda_function:\n" + result.stderr)
+
+
+@pytest.fixture(scope='module')
+def pycache(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("pycache"))
+
+
+@pytest.mark.parametrize('folder', handler_folders, ids=[os.path.basename(folder) for folder in handler_folders])
+def test_handler_import_within_budget(folder, pycache):
+    import_ms = min(handler_import_us(folder, pycache) for run in range(import_runs)) / 1000
+    assert import_ms <= import_budget_ms, os.path.basename(folder) + " imports in " + str(round(import_ms)) + "ms, over the budget of " + str(import_budget_ms) + "ms"
@@ -0,0 +1,120 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import subprocess
+import pytest
+from as2_automation import manifest
+
+MiB = 1048576
+
+
+# Optimiser script writing its base list and report under a temporary directory
+@pytest.fixture
+def optimiser(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest, 'base_list', str(tmp_path / "base.txt"))
+    monkeypatch.setattr(manifest, 'report_file', str(tmp_path / "report"))
+    script = tmp_path / "optimise.sh"
+    script.write_text(manifest.optimiser_script_text())
+    return script
+
+
+# A runtime of 40 shared libraries of 256 KiB each, and 10 files of 1 MiB owned by each of three applications
+# Each raw manifest lists the runtime, the application's files, repeated entries, a symlink and entries that are never kept
+@pytest.fixture
+def manifests(tmp_path):
+    def create(path, size):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file :
+            file.truncate(size)
+        return path
+
+    runtime = [create(str(tmp_path / "usr/lib" / ("lib" + str(index) + ".so")), 262144) for index in range(40)]
+    os.symlink(runtime[0], str(tmp_path / "usr/lib/libcurrent.so"))
+    files = {}
+    for app in ("editor", "viewer", "terminal") :
+        own = [create(str(tmp_path / "opt" / app / ("data" + str(index))), MiB) for index in range(10)]
+        raw = runtime + own + runtime[:10] + [str(tmp_path / "usr/lib/libcurrent.so"), "/proc/self/maps", "/dev/null",
+            str(tmp_path / "deleted.tmp") + " (deleted)", "relative/path"]
+        files[app] = tmp_path / ("as2_manifest_" + app + ".txt")
+        files[app].write_text("\n".join(raw) + "\n")
+    return files
+
+
+# Run the optimiser on each manifest in turn and parse the report
+def optimise(optimiser, manifests, budget_mib, shared_base):
+    for app, path in manifests.items() :
+        subprocess.run(["bash", str(optimiser), str(path), app, str(budget_mib), "true" if shared_base else "false"], check=True, stdout=subprocess.DEVNULL)
+    with open(manifest.report_file) as report :
+        return {entry['Application'] : entry for entry in manifest.parse_manifest_report(report.read().splitlines())['Applications']}
+
+
+# Repeated entries, pseudo files and paths that are not readable files are dropped, the raw manifest is kept beside it
+def test_manifests_are_cleaned(optimiser, manifests):
+    report = optimise(optimiser, manifests, 0, False)
+    for app, entry in report.items() :
+        assert entry['EntriesBefore'] == 65
+        assert entry['FilesAfter'] == 50
+        assert entry['BytesAfter'] == 20 * MiB
+        assert entry['SharedFiles'] == entry['OverBudgetFiles'] == 0
+        kept = manifests[app].read_text().splitlines()
+        assert len(kept) == len(set(kept)) == 50
+        assert kept[0].endswith("/usr/lib/lib0.so")
+        assert manifests[app].with_suffix(".raw.txt").read_text().count("\n") == 65
+
+
+# With a shared base the runtime stays in the manifest of the first application that listed it
+def test_shared_base(optimiser, manifests):
+    report = optimise(optimiser, manifests, 0, True)
+    assert (report['editor']['FilesAfter'], report['editor']['SharedFiles']) == (50, 0)
+    for app in ("viewer", "terminal") :
+        assert (report[app]['FilesAfter'], report[app]['BytesAfter']) == (10, 10 * MiB)
+        assert (report[app]['SharedFiles'], report[app]['SharedBytes']) == (40, 10 * MiB)
+
+
+# Files are kept in first access order while they fit the budget
+def test_budget(optimiser, manifests):
+    report = optimise(optimiser, manifests, 15, False)
+    for entry in report.values() :
+        assert (entry['FilesAfter'], entry['BytesAfter']) == (45, 15 * MiB)
+        assert (entry['OverBudgetFiles'], entry['OverBudgetBytes']) == (5, 5 * MiB)
+
+
+# An application whose manifest lists no readable files is added without a manifest
+def test_empty_manifest_is_removed(optimiser, tmp_path):
+    path = tmp_path / "as2_manifest_empty.txt"
+    path.write_text("/dev/null\nrelative/path\n")
+    subprocess.run(["bash", str(optimiser), str(path), "empty", "0", "false"], check=True, stdout=subprocess.DEVNULL)
+    assert not path.exists()
+
+
+# The last report of an application is kept, and the notification lists every application of each builder that reported
+def test_report_and_summary():
+    report = manifest.parse_manifest_report([
+        "MANIFEST editor 65 1 1 1 0 0 0 0",
+        "noise",
+        "MANIFEST editor 65 31457280 50 20971520 0 0 5 5242880",
+        "MANIFEST viewer 65 31457280 10 10485760 40 10485760 0 0"
+    ])
+    assert [entry['Application'] for entry in report['Applications']] == ["editor", "viewer"]
+    assert (report['BytesBefore'], report['BytesAfter']) == (60 * MiB, 30 * MiB)
+    assert manifest.parse_manifest_report(["MANIFEST editor 1 2"]) is None
+    summary = manifest.manifest_summary([{'ImageBuilderName' : "builder", 'Manifests' : report}, {'ImageBuilderName' : "idle"}])
+    assert "Application Manifests (builder): 60.0 MiB before optimisation, 30.0 MiB after" in summary
+    assert "editor: 65 entries, 30.0 MiB -> 50 files, 20.0 MiB, 5 files (5.0 MiB) over budget" in summary
+    assert "viewer: 65 entries, 30.0 MiB -> 10 files, 10.0 MiB, 40 files (10.0 MiB) in the shared base" in summary
+    assert "idle" not in summary
+    assert manifest.manifest_summary([]) == ""
@@ -0,0 +1,81 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from as2_automation.commands import normalise_command
+from as2_automation.package_plan import coalesce_package_commands, parse_package_command
+
+
+# Coalesce a list of command entries, returning the commands of the optimised plan and the report
+def coalesce(steps):
+    report = {}
+    plan = list(coalesce_package_commands([normalise_command(step) for step in steps], report))
+    return [step['Command'] for step in plan], report
+
+
+# Only plain package manager commands that assume yes are parsed
+def test_parse_package_command():
+    assert parse_package_command("sudo yum -y install git vim > /dev/null") == {
+        'Tool' : "yum", 'Sudo' : True, 'Action' : "install", 'Packages' : ["git", "vim"], 'Quiet' : True
+    }
+    assert parse_package_command("dnf -y upgrade")['Packages'] is None
+    assert parse_package_command("sudo yum install git") is None
+    assert parse_package_command("sudo yum -y install git && reboot") is None
+    assert parse_package_command("sudo yum -y --enablerepo=epel install git") is None
+    assert parse_package_command("sudo yum -y remove") is None
+
+
+# Installs and updates merge across each other, a remove ends the segment installs can be merged in
+def test_installs_merge_until_a_remove():
+    commands, report = coalesce([
+        {'Command' : "sudo yum -y install git"},
+        {'Command' : "sudo yum -y update"},
+        {'Command' : "sudo yum -y install vim"},
+        {'Command' : "sudo yum -y remove nano"},
+        {'Command' : "sudo yum -y remove ed"},
+        {'Command' : "sudo yum -y install emacs"},
+        {'Command' : "echo done"},
+        {'Command' : "sudo yum -y install tmux"}
+    ])
+    assert commands == [
+        "sudo yum -y install git vim",
+        "sudo yum -y update",
+        "sudo yum -y remove nano ed",
+        "sudo yum -y install emacs",
+        "echo done",
+        "sudo yum -y install tmux"
+    ]
+    assert (report['TransactionsBefore'], report['TransactionsAfter'], report['TransactionsSaved']) == (7, 5, 2)
+
+
+# Commands with different failure policies are not merged
+def test_policies_are_kept():
+    commands, report = coalesce([
+        {'Command' : "sudo yum -y install git"},
+        {'Command' : "sudo yum -y install vim", 'OnFailure' : "continue"},
+        {'Command' : "sudo yum -y install emacs", 'OnFailure' : "continue"}
+    ])
+    assert commands == ["sudo yum -y install git", "sudo yum -y install vim emacs"]
+
+
+# Optional packages merge with the commands next to them, the merged transaction runs under the policy of those commands
+def test_optional_packages_merge():
+    xvfb = dict(normalise_command("sudo yum -y install Xvfb > /dev/null", "continue"), Optional=True)
+    report = {}
+    plan = list(coalesce_package_commands([xvfb, normalise_command("sudo yum -y install git > /dev/null"), normalise_command("sudo yum -y install vim", "continue")], report))
+    assert [step['Command'] for step in plan] == ["sudo yum -y install Xvfb git > /dev/null", "sudo yum -y install vim"]
+    assert plan[0]['OnFailure'] == "fail"
+    assert 'Optional' not in plan[0]
+    assert list(coalesce_package_commands([xvfb], {})) == [xvfb]
@@ -0,0 +1,155 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import importlib.util
+import json
+import os
+import botocore
+import pytest
+from as2_automation import preflight
+
+linux_handler_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "LINUX", "Lambda", "FN00_AS2_Linux_Automation_Preflight", "lambda_function.py")
+
+
+# Check that passes or fails according to its argument
+def check_outcome(passed):
+    if not passed :
+        raise Exception("Check failed.")
+    return "Check passed."
+
+
+# In memory AppStream holding one image builder named existing, given an error code every call fails with it instead
+class SimulatedAppStream :
+    def __init__(self, error=None):
+        self.error = error
+
+    def describe_image_builders(self, Names, MaxResults):
+        if self.error :
+            raise botocore.exceptions.ClientError({'Error' : {'Code' : self.error, 'Message' : "Error"}}, "DescribeImageBuilders")
+        if Names[0] != "existing" :
+            raise botocore.exceptions.ClientError({'Error' : {'Code' : "ResourceNotFoundException", 'Message' : "Image builder not found"}}, "DescribeImageBuilders")
+        return {'ImageBuilders' : [{'Name' : "existing"}]}
+
+
+def test_report_lists_every_check():
+    report = preflight.run_checks([
+        ('First', check_outcome, (True,)),
+        ('Second', check_outcome, (False,)),
+        ('Third', check_outcome, (True,))
+    ])
+
+    assert report['Status'] == "Failed"
+    assert [check['Name'] for check in report['Checks']] == ['First', 'Second', 'Third']
+    assert [check['Status'] for check in report['Checks']] == ["Passed", "Failed", "Passed"]
+    assert report['Checks'][1]['Detail'] == "Check failed."
+    assert all(check['DurationMs'] >= 0 for check in report['Checks'])
+
+
+def test_report_passes_when_every_check_passes():
+    report = preflight.run_checks([
+        ('First', check_outcome, (True,)),
+        ('Second', check_outcome, (True,))
+    ])
+
+    assert report['Status'] == "Passed"
+
+
+# Load the Linux Preflight handler with its checks replaced, each returning or failing as given in outcomes
+def load_linux_handler(monkeypatch, outcomes):
+    spec = importlib.util.spec_from_file_location("linux_preflight_handler", linux_handler_file)
+    handler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(handler)
+    monkeypatch.setattr(handler, 'get_existing_builder', lambda name : None)
+    for name in ('check_ssh_key', 'check_image', 'check_subnet', 'check_security_group', 'check_command_plan') :
+        monkeypatch.setattr(handler, name, lambda *args, passed=outcomes.get(name, True) : check_outcome(passed))
+    return handler
+
+
+def test_handler_error_carries_report(monkeypatch):
+    handler = load_linux_handler(monkeypatch, {'check_subnet' : False, 'check_command_plan' : False})
+    event = {
+        'ImageBuilderSSHKeyName' : "as2-key",
+        'ImageBuilderName' : "builder",
+        'ImageBuilderImage' : "base-image",
+        'ImageBuilderSubnet' : "subnet-1",
+        'ImageBuilderSecurityGroup' : "sg-1",
+        'ImageBuilderCommandsLocation' : "s3://plans/plan.jsonl"
+    }
+
+    with pytest.raises(preflight.PreflightError) as error :
+        handler.lambda_handler(event, None)
+
+    report = json.loads(str(error.value))
+    assert report['Status'] == "Failed"
+    assert {check['Name'] : check['Status'] for check in report['Checks']} == {
+        'SSHKey' : "Passed",
+        'BaseImage' : "Passed",
+        'Subnet' : "Failed",
+        'SecurityGroup' : "Passed",
+        'CommandPlan' : "Failed"
+    }
+
+
+def test_handler_skips_plan_check_without_location(monkeypatch):
+    handler = load_linux_handler(monkeypatch, {})
+    event = {
+        'ImageBuilderSSHKeyName' : "as2-key",
+        'ImageBuilderName' : "builder",
+        'ImageBuilderImage' : "base-image",
+        'ImageBuilderSubnet' : "subnet-1",
+        'ImageBuilderSecurityGroup' : "sg-1"
+    }
+
+    report = handler.lambda_handler(event, None)
+
+    assert report['Status'] == "Passed"
+    assert [check['Name'] for check in report['Checks']] == ['SSHKey', 'BaseImage', 'Subnet', 'SecurityGroup']
+
+
+def test_existing_builder(monkeypatch):
+    monkeypatch.setattr(preflight, 'get_client', lambda service : SimulatedAppStream())
+
+    assert preflight.get_existing_builder("existing") == {'Name' : "existing"}
+    assert preflight.get_existing_builder("missing") is None
+
+
+def test_existing_builder_other_errors_fail(monkeypatch):
+    monkeypatch.setattr(preflight, 'get_client', lambda service : SimulatedAppStream("AccessDeniedException"))
+
+    with pytest.raises(botocore.exceptions.ClientError) :
+        preflight.get_existing_builder("existing")
+
+
+def test_command_plan(tmp_path):
+    plan = tmp_path / "plan.jsonl"
+    plan.write_text('# Packages\n"yum install -y git"\n\n{"Command" : "make"}\n')
+
+    assert preflight.check_command_plan(str(plan)) == "Command plan " + str(plan) + " found, holding 2 entries."
+
+
+def test_command_plan_failures(tmp_path):
+    invalid = tmp_path / "invalid.jsonl"
+    invalid.write_text('"yum install -y git"\nnot json\n')
+
+    report = preflight.run_checks([
+        ('Missing', preflight.check_command_plan, (str(tmp_path / "missing.jsonl"),)),
+        ('Invalid', preflight.check_command_plan, (str(invalid),))
+    ])
+
+    assert report['Status'] == "Failed"
+    assert [check['Status'] for check in report['Checks']] == ["Failed", "Failed"]
+    assert report['Checks'][1]['Detail'].startswith("Line 2 of command plan is not valid JSON")
@@ -0,0 +1,102 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import threading
+import time
+import pytest
+from as2_automation import rate_limit
+
+
+# In memory bucket of 10 calls per second with a burst of 10, and no metrics
+@pytest.fixture
+def bucket(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'store', rate_limit.LocalBucketStore())
+    monkeypatch.setattr(rate_limit, 'bucket_rate', 10.0)
+    monkeypatch.setattr(rate_limit, 'bucket_capacity', 10.0)
+    monkeypatch.setattr(rate_limit, 'put_metrics', lambda *args : None)
+    return "appstream:test"
+
+
+# The burst is served at once and the calls after it wait for tokens at the bucket rate, with up to 50% jitter
+def test_calls_wait_for_tokens(bucket, clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    started = clock.now
+    waits = [rate_limit.acquire(bucket, "DescribeImageBuilders") for call in range(30)]
+    assert waits[:10] == [0] * 10
+    assert all(wait > 0 for wait in waits[10:])
+    assert 2.0 <= clock.now - started <= 3.0
+
+
+# Concurrent callers share one bucket, together they never exceed its rate after the burst
+def test_concurrent_callers_share_the_bucket(bucket, monkeypatch):
+    monkeypatch.setattr(rate_limit, 'bucket_rate', 50.0)
+    calls = []
+
+    def poll():
+        for attempt in range(3) :
+            rate_limit.acquire(bucket, "DescribeImageBuilders")
+            calls.append(time.time())
+
+    started = time.time()
+    workers = [threading.Thread(target=poll) for index in range(20)]
+    for worker in workers :
+        worker.start()
+    for worker in workers :
+        worker.join()
+    assert len(calls) == 60
+    assert max(calls) - started >= (60 - 10) / 50.0 * 0.95
+
+
+# A throttling response halves the rate once per throttle window however many callers saw it, down to the minimum rate
+def test_throttling_halves_the_rate(bucket, clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    rate_limit.acquire(bucket, "DescribeImages")
+    rate_limit.throttled(bucket, "DescribeImages")
+    rate_limit.throttled(bucket, "DescribeImages")
+    assert rate_limit.store.load(bucket)['Rate'] == 5.0
+    for window in range(10) :
+        clock.sleep(rate_limit.throttle_window_seconds)
+        rate_limit.throttled(bucket, "DescribeImages")
+    assert rate_limit.store.load(bucket)['Rate'] == rate_limit.min_rate
+
+
+# A save based on a bucket another caller has saved since is rejected
+def test_store_rejects_stale_saves():
+    store = rate_limit.LocalBucketStore()
+    first = rate_limit.refill(None, 0.0)
+    assert store.save("bucket", first, None)
+    second = rate_limit.refill(first, 1.0)
+    assert store.save("bucket", second, first)
+    assert not store.save("bucket", rate_limit.refill(first, 1.0), first)
+    assert store.load("bucket")['Version'] == 2.0
+
+
+# A caller that loses the race to save the bucket backs off briefly before it loads the bucket again
+def test_lost_save_backs_off(bucket, clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, 'time', clock)
+    saves = []
+
+    class RacingStore (rate_limit.LocalBucketStore) :
+        def save(self, name, state, previous):
+            saves.append(clock.now)
+            return len(saves) > 2 and super().save(name, state, previous)
+
+    monkeypatch.setattr(rate_limit, 'store', RacingStore())
+    started = clock.now
+    rate_limit.acquire(bucket, "DescribeImageBuilders")
+    assert len(saves) == 3
+    assert all(0 <= later - earlier <= rate_limit.contention_backoff_seconds for earlier, later in zip(saves, saves[1:]))
+    assert clock.now > started
@@ -0,0 +1,87 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import os
+import subprocess
+import sys
+from as2_automation import regression, telemetry
+
+scripts_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+
+
+# Build of the as2-app prefix recorded at the given index, with its install time and a short connect phase
+def build(index, install, connect=2, **fields):
+    return dict({
+        'ImagePrefix' : "as2-app",
+        'ImageName' : "as2-app_" + str(index),
+        'ImageBuilderName' : "builder",
+        'RecordedAt' : 1000.0 + index,
+        'InstanceType' : "stream.standard.large",
+        'InputsFingerprint' : "0123456789abcdef",
+        'BuilderReused' : False,
+        'Phases' : {'Connect' : connect, 'Install' : install, 'Commands' : {'Step-1' : install - 10}}
+    }, **fields)
+
+
+# A build is compared with the median of the builds before it, so an outlier in the baseline does not hide a slowdown
+def test_compares_with_baseline_median():
+    builds = [build(index, install) for index, install in enumerate([600, 610, 2000, 590, 800])]
+    regressions = regression.find_regressions(builds)
+    assert [(found['ImageName'], found['Phase']) for found in regressions] == [("as2-app_4", "Commands.Step-1"), ("as2-app_4", "Install")]
+    latest = regressions[-1]
+    assert latest['BaselineSeconds'] == 605.0
+    assert latest['BaselineBuilds'] == 4
+    assert latest['IncreasePercent'] == 32
+
+
+# Only slowdowns over the threshold are flagged, and phases too short in the baseline are never flagged
+def test_threshold_and_short_phases():
+    builds = [build(index, 600) for index in range(5)] + [build(5, 740, connect=9)]
+    assert regression.find_regressions(builds) == []
+    assert [found['Phase'] for found in regression.find_regressions(builds, threshold=0.2)] == ["Commands.Step-1", "Install"]
+
+
+# Builds without enough baseline, resumed builds and failed builds are left out, and changed inputs are reported
+def test_baseline_selection():
+    builds = [build(0, 600), build(1, 600), build(2, 900)]
+    assert regression.find_regressions(builds) == []
+    builds = [build(0, 600), build(1, 600), build(2, 200, Resumed=True), build(3, 600, Error="CommandFailedError"), build(4, 600),
+        build(5, 900, InstanceType="stream.standard.medium")]
+    regressions = regression.find_regressions(builds)
+    assert [found['ImageName'] for found in regressions] == ["as2-app_5", "as2-app_5"]
+    assert regressions[0]['ChangedInputs'] == ["InstanceType"]
+
+
+# The report script exits with status 1 when a regression is found, so it can gate a pipeline, and 0 otherwise
+def test_report_exit_status(tmp_path):
+    database = str(tmp_path / "telemetry.db")
+    store = telemetry.SqliteTelemetryStore(database)
+    for index in range(4) :
+        store.put(build(index, 600))
+
+    def report():
+        env = dict(os.environ, Telemetry_Database=database)
+        env.pop('Telemetry_Table', None)
+        return subprocess.run([sys.executable, os.path.join(scripts_folder, "regression_report.py"), "--latest"], env=env, capture_output=True, text=True)
+
+    result = report()
+    assert result.returncode == 0, result.stderr
+    assert "No phase regressions found." in result.stdout
+    store.put(build(4, 900))
+    result = report()
+    assert result.returncode == 1, result.stderr
+    assert "as2-app_4  Install: 900s against a baseline of 600.0s (+50%)" in result.stdout
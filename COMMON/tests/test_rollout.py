@@ -0,0 +1,126 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import botocore
+import pytest
+from as2_automation import rollout
+
+# Simulated fleet transitions, a stop takes 5 minutes and a start 10
+stop_seconds = 300
+start_seconds = 600
+
+
+# In memory AppStream fleets, a fleet named in failing stays stopped with a fleet error when it is started
+class SimulatedAppStream :
+    def __init__(self, clock):
+        self.clock = clock
+        self.changes = {}
+        self.failing = set()
+        self.calls = []
+        self.fleets = {
+            'finance' : {'Name' : 'finance', 'State' : "RUNNING", 'FleetType' : "ALWAYS_ON", 'ImageName' : "Old_Image"},
+            'engineering' : {'Name' : 'engineering', 'State' : "RUNNING", 'FleetType' : "ON_DEMAND", 'ImageName' : "Old_Image"},
+            'support' : {'Name' : 'support', 'State' : "RUNNING", 'FleetType' : "ELASTIC", 'ImageName' : "Old_Image"},
+            'training' : {'Name' : 'training', 'State' : "STOPPED", 'FleetType' : "ON_DEMAND", 'ImageName' : "Old_Image"},
+            'sales' : {'Name' : 'sales', 'State' : "RUNNING", 'FleetType' : "ALWAYS_ON", 'ImageName' : "Old_Image"}
+        }
+
+    def describe_fleets(self, Names):
+        self.calls.append(('describe_fleets', tuple(Names)))
+        for name in Names :
+            if name not in self.fleets :
+                raise botocore.exceptions.ClientError({'Error' : {'Code' : "ResourceNotFoundException", 'Message' : "Fleet not found"}}, "DescribeFleets")
+            if name in self.changes and self.clock.now >= self.changes[name][0] :
+                self.fleets[name]['State'] = self.changes.pop(name)[1]
+        return {'Fleets' : [dict(self.fleets[name]) for name in Names]}
+
+    def stop_fleet(self, Name):
+        self.calls.append(('stop_fleet', Name))
+        self.fleets[Name]['State'] = "STOPPING"
+        self.changes[Name] = (self.clock.now + stop_seconds, "STOPPED")
+
+    def start_fleet(self, Name):
+        self.calls.append(('start_fleet', Name))
+        self.fleets[Name]['State'] = "STARTING"
+        self.changes[Name] = (self.clock.now + start_seconds, "STOPPED" if Name in self.failing else "RUNNING")
+        if Name in self.failing :
+            self.fleets[Name]['FleetErrors'] = [{'ErrorCode' : "IMAGE_NOT_FOUND", 'ErrorMessage' : "Simulated start failure"}]
+
+    def update_fleet(self, Name, ImageName):
+        self.calls.append(('update_fleet', Name))
+        self.fleets[Name]['ImageName'] = ImageName
+
+
+@pytest.fixture
+def appstream(clock, monkeypatch):
+    simulated = SimulatedAppStream(clock)
+    monkeypatch.setattr(rollout, 'get_client', lambda service : simulated)
+    monkeypatch.setattr(rollout, 'put_metrics', lambda *args : None)
+    monkeypatch.setattr(rollout, 'time', clock)
+    return simulated
+
+
+# Poll the rollout every minute until it settles
+def run_rollout(state, clock):
+    for poll in range(1000) :
+        rollout.advance_rollout(state)
+        if state['Status'] != "Running" :
+            return state
+        clock.sleep(60)
+    raise AssertionError("Rollout did not settle")
+
+
+# Five fleets in waves of two, running fleets are restarted on the new image and the others are updated in place
+def test_rollout_in_waves(appstream, clock):
+    state = run_rollout(rollout.new_rollout("New_Image", "finance, engineering, support, training, sales", 2), clock)
+    assert state['Status'] == "Complete"
+    assert [entry['Wave'] for entry in state['Fleets']] == [1, 1, 2, 2, 3]
+    assert all(fleet['ImageName'] == "New_Image" for fleet in appstream.fleets.values())
+    assert appstream.fleets['training']['State'] == "STOPPED"
+    assert ('stop_fleet', 'support') not in appstream.calls
+    cutover = {entry['Fleet'] : entry['Seconds'] for entry in state['Fleets']}
+    assert cutover['support'] == cutover['training'] == 0
+    assert cutover['finance'] == cutover['engineering'] == stop_seconds + start_seconds
+    # The two restarted fleets of the first wave cut over together, one fleet at a time would take twice as long
+    assert state['Seconds'] == 2 * (stop_seconds + start_seconds)
+    assert "every fleet updated after " + str(state['Seconds']) + " seconds" in rollout.rollout_summary(state)
+
+
+# A fleet that fails to start is started again on its previous image and the waves after it are skipped
+def test_failed_fleet_halts_rollout(appstream, clock):
+    appstream.failing.add('engineering')
+    state = run_rollout(rollout.new_rollout("New_Image", ["finance", "engineering", "support", "training", "sales"], 2), clock)
+    assert state['Status'] == "Failed"
+    assert [entry['Status'] for entry in state['Fleets']] == ["Complete", "Failed", "Skipped", "Skipped", "Skipped"]
+    assert state['Fleets'][1]['Error'] == "IMAGE_NOT_FOUND: Simulated start failure"
+    assert appstream.fleets['support']['ImageName'] == "Old_Image"
+    assert "engineering (wave 1): Failed, IMAGE_NOT_FOUND" in rollout.rollout_summary(state)
+
+
+# A missing fleet fails without failing the description of the others, a fleet already on the image completes at once
+def test_missing_and_current_fleets(appstream, clock):
+    appstream.fleets['sales']['ImageName'] = "New_Image"
+    state = run_rollout(rollout.new_rollout("New_Image", ["sales", "retired"], 2), clock)
+    assert state['Status'] == "Failed"
+    assert [(entry['Status'], entry.get('Error')) for entry in state['Fleets']] == [("Complete", None), ("Failed", "Fleet not found")]
+    assert ('stop_fleet', 'sales') not in appstream.calls
+
+
+# Without restarts running fleets are updated in place and keep serving from their current instances
+def test_rollout_without_restart(appstream, clock):
+    state = run_rollout(rollout.new_rollout("New_Image", ["finance", "sales"], 1, restart=False), clock)
+    assert state['Status'] == "Complete"
+    assert [call for call in appstream.calls if call[0] != 'describe_fleets'] == [('update_fleet', 'finance'), ('update_fleet', 'sales')]
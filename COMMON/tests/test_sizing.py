@@ -0,0 +1,76 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import pytest
+from as2_automation import sizing
+
+
+@pytest.fixture(autouse=True)
+def list_prices(monkeypatch):
+    monkeypatch.delenv('Instance_Prices', raising=False)
+
+
+# Linux build on an instance type, taking the given install time with the given CPU and peak memory use
+def build(instance_type, install, cpu=50.0, memory_mib=1024, **fields):
+    return dict({
+        'InstanceType' : instance_type,
+        'Phases' : {'Install' : install},
+        'Utilisation' : {'CpuAveragePercent' : cpu, 'MemoryPeakMiB' : memory_mib}
+    }, **fields)
+
+
+# The cheapest type expected to meet the target is chosen, faster types that cost more are listed after it
+def test_cheapest_type_meeting_target():
+    builds = [build('stream.standard.large', install) for install in (1700, 1800, 1900)]
+    recommendation = sizing.recommend(builds, "Linux", 1800)
+    assert recommendation['InstanceType'] == "stream.standard.small"
+    assert recommendation['MeetsTarget']
+    assert recommendation['BasedOn'] == {'InstanceType' : "stream.standard.large", 'Builds' : 3, 'InstallSeconds' : 1800, 'CpuAveragePercent' : 50.0, 'MemoryPeakGiB' : 1.0}
+    costs = [candidate['EstimatedCost'] for candidate in recommendation['Candidates']]
+    assert costs == sorted(costs)
+    assert all(candidate['EstimatedSeconds'] <= 1800 for candidate in recommendation['Candidates'])
+
+
+# A shorter target needs more vCPUs, the CPU busy share of the install is estimated to scale with them
+def test_target_needs_more_vcpus():
+    builds = [build('stream.standard.large', 1800, cpu=80.0) for index in range(3)]
+    recommendation = sizing.recommend(builds, "Linux", 1000)
+    assert recommendation['InstanceType'] == "stream.standard.2xlarge"
+    assert recommendation['Candidates'][0]['EstimatedSeconds'] == round(1800 * (0.2 + 0.8 * 2 / 8))
+
+
+# When nothing meets the target, the fastest type is chosen
+def test_fastest_type_when_target_missed():
+    builds = [build('stream.standard.large', 1800, cpu=100.0)]
+    recommendation = sizing.recommend(builds, "Windows", 60)
+    assert not recommendation['MeetsTarget']
+    assert recommendation['InstanceType'] in ("stream.compute.8xlarge", "stream.memory.8xlarge")
+    assert recommendation['Candidates'][0]['EstimatedSeconds'] == round(1800 * 2 / 32)
+
+
+# Builds that give nothing to go on leave the choice to the default type
+def test_no_recommendation():
+    assert sizing.recommend([], "Linux", 1800) is None
+    assert sizing.recommend([build('stream.standard.large', 1800, Resumed=True), build('stream.standard.large', 1800, Error="CommandFailedError")], "Linux", 1800) is None
+    # No instance type has the memory of the builds with headroom, so there is no candidate
+    assert sizing.recommend([build('stream.standard.large', 1800, memory_mib=250 * 1024)], "Linux", 1800) is None
+
+
+# Without a recommendation the create builder task falls back to its default type
+def test_recommend_instance_type_without_candidates(monkeypatch):
+    monkeypatch.setattr(sizing, 'load_builds', lambda image_prefix : [build('stream.standard.large', 1800, memory_mib=250 * 1024)])
+    assert sizing.recommend_instance_type("as2-app", "Linux", 1800) is None
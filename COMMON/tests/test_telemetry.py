@@ -0,0 +1,126 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import json
+import pytest
+from as2_automation import telemetry
+
+
+# Telemetry record of a build recorded at the given time
+def record(recorded_at, image_prefix="as2-app", instance_type="stream.standard.large", builder="builder"):
+    return {
+        'RecordedAt' : recorded_at,
+        'ImagePrefix' : image_prefix,
+        'ImageBuilderName' : builder,
+        'InstanceType' : instance_type,
+        'InputsFingerprint' : "0123456789abcdef",
+        'Phases' : {'Install' : 600}
+    }
+
+
+# DynamoDB client keeping the items put in a table in memory, and answering queries and scans over them
+class LocalDynamo :
+    def __init__(self):
+        self.items = []
+
+    def put_item(self, TableName, Item):
+        self.items = [item for item in self.items if (item['ImagePrefix'], item['RecordKey']) != (Item['ImagePrefix'], Item['RecordKey'])]
+        self.items.append(Item)
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ScanIndexForward, Limit):
+        items = sorted((item for item in self.items if item['ImagePrefix'] == ExpressionAttributeValues[':prefix']),
+            key=lambda item : item['RecordKey']['S'], reverse=not ScanIndexForward)
+        return {'Items' : items[:Limit]}
+
+    def get_paginator(self, operation):
+        items = self.items
+
+        class Paginator :
+            def paginate(self, TableName, ProjectionExpression):
+                return [{'Items' : [{'ImagePrefix' : item['ImagePrefix']} for item in items]}]
+        return Paginator()
+
+
+@pytest.fixture(params=["sqlite", "dynamodb"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "sqlite" :
+        return telemetry.SqliteTelemetryStore(str(tmp_path / "telemetry.db"))
+    dynamo = LocalDynamo()
+    monkeypatch.setattr(telemetry, 'get_client', lambda service : dynamo)
+    return telemetry.DynamoTelemetryStore("AS2_Automation_Telemetry")
+
+
+# The latest records of a prefix are read oldest first, up to the limit, and other prefixes are kept apart
+def test_store_reads_latest_builds(store):
+    for recorded_at in (300.0, 100.0, 200.0, 400.0) :
+        store.put(record(recorded_at))
+    store.put(record(250.0, image_prefix="as2-other"))
+    assert [build['RecordedAt'] for build in store.query("as2-app", 3)] == [200.0, 300.0, 400.0]
+    assert store.prefixes() == ["as2-app", "as2-other"]
+
+
+# Records of builders of one execution are kept apart, a record put again replaces the earlier one
+def test_store_keys_records_by_builder(store):
+    store.put(record(100.0, builder="first"))
+    store.put(record(100.0, builder="second"))
+    replaced = dict(record(100.0, builder="first"), Phases={'Install' : 700})
+    store.put(replaced)
+    builds = store.query("as2-app", 10)
+    assert [build['ImageBuilderName'] for build in builds] == ["first", "second"]
+    assert builds[0]['Phases'] == {'Install' : 700}
+
+
+# Without a table or database, records are not stored and no builds are read
+def test_no_store(monkeypatch):
+    monkeypatch.setattr(telemetry, 'store', False)
+    assert telemetry.record_build(record(100.0)) is None
+    assert telemetry.load_builds("as2-app") == []
+
+
+# A failed execution records the error caught by the state machine with its cause cut short, and the phases measured
+def test_failed_build_records():
+    event = {
+        'AutomationParameters' : {'ImageOutputPrefix' : "as2-app", 'ImageBuilderName' : "builder", 'ImageBuilderType' : "stream.standard.large"},
+        'InstallStatus' : {'Builders' : [{'ImageBuilderName' : "builder", 'Phases' : {'Connect' : 1.5, 'Install' : 300}}]},
+        'Error' : {'Error' : "CommandFailedError", 'Cause' : json.dumps({'Builders' : []}) + " " * 2000}
+    }
+    records = telemetry.build_records(event, None, "FAILED", "Linux")
+    assert len(records) == 1
+    assert records[0]['ImageState'] == "FAILED"
+    assert records[0]['Error'] == "CommandFailedError"
+    assert len(records[0]['Cause']) == telemetry.max_cause_length
+    assert records[0]['Phases'] == {'Connect' : 1.5, 'Install' : 300, 'Commands' : {}}
+    assert 'Error' not in telemetry.build_records(dict(event, Error=None), "image", "AVAILABLE", "Linux")[0]
+
+
+# vmstat samples are summarised after the first line, which averages everything since boot
+def test_linux_samples():
+    lines = [
+        "MemTotal:        8000000 kB",
+        "procs -----------memory---------- ---swap-- -----io---- -system-- ------cpu-----",
+        " r  b   swpd   free   buff  cache   si   so    bi    bo   in   cs us sy id wa st",
+        " 1  0      0 6000000 100000 900000    0    0    5    5   50   80  2  1 97  0  0",
+        " 2  0      0 5000000 100000 900000    0    0  100  300  500  800 60 10 20 10  0",
+        " 1  0      0 4000000 100000 900000    0    0  300  100  500  800 30 10 50 10  0"
+    ]
+    summary = telemetry.parse_linux_samples(lines)
+    assert summary['Samples'] == 2
+    assert summary['CpuAveragePercent'] == 55.0
+    assert summary['CpuPeakPercent'] == 70.0
+    assert summary['IoWaitAveragePercent'] == 10.0
+    assert summary['MemoryPeakMiB'] == (8000000 - 4000000 - 100000 - 900000) // 1024
+    assert summary['DiskReadAverageKiBps'] == 200.0
@@ -0,0 +1,66 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import json
+import os
+import pytest
+from as2_automation import parameters, rate_limit, telemetry, trace
+
+pytest.importorskip("boto3")
+
+tests_folder = os.path.dirname(os.path.abspath(__file__))
+handler_file = os.path.join(tests_folder, "..", "..", "LINUX", "Lambda", "FN03_AS2_Linux_Automation_Run_Image_Assistant", "lambda_function.py")
+
+# Invocation of the Linux Run Image Assistant function recorded against a local SSH server, kept as plain JSON lines
+trace_file = os.path.join(tests_folder, "traces", "FN03_AS2_Linux_Automation_Run_Image_Assistant.jsonl")
+
+
+# Recorded trace, the environment it restores and the settings cleared by replay are put back after each test
+@pytest.fixture
+def lines(monkeypatch):
+    with open(trace_file) as trace_lines :
+        lines = [json.loads(line) for line in trace_lines if line.strip()]
+    for module_name, setting in trace.environment_settings :
+        module = {'parameters' : parameters, 'rate_limit' : rate_limit, 'telemetry' : telemetry}[module_name]
+        monkeypatch.setattr(module, setting, getattr(module, setting))
+    environment = dict(os.environ)
+    yield lines
+    os.environ.clear()
+    os.environ.update(environment)
+
+
+# Every call the handler makes is answered by the trace and every recorded call is used
+# Only the image name differs from the recording, as it holds the time the image was created
+def test_replay_matches_every_call(lines):
+    outcome, profiler = trace.replay(lines, handler_file, speed=0)
+
+    assert 'Error' not in outcome
+    assert outcome['Mismatches'] == []
+    assert outcome['Unused'] == 0
+    assert outcome['Replayed'] == len(lines) - 2
+    assert outcome['Differences'] == ["Arguments of command 127.0.0.1 run differ from the recording"]
+    assert outcome['Result']['Images'][0]['Name'].startswith("AS2_Linux_Image-")
+
+
+# Settings read before the replay are read again from the recorded environment
+def test_replay_applies_recorded_environment(lines):
+    rate_limit.get_limits()
+    lines[0]['Environment']['AppStream_Rate_Limit'] = "2"
+
+    trace.replay(lines, handler_file, speed=0)
+
+    assert rate_limit.get_limits()[0] == 2.0
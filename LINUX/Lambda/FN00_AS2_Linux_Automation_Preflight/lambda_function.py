@@ -0,0 +1,70 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import json
+import logging
+from as2_automation.parameters import Env, get_ssh_key_name, resolve
+from as2_automation.preflight import PreflightError, check_command_plan, check_image, check_security_group, check_ssh_key, check_subnet, get_existing_builder, run_checks
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Starting parameters read from event data, with the same defaults as the Create Builder function
+parameter_schema = [
+    ('ImageBuilderName', Env('Default_IB_Name')),
+    ('ImageBuilderImage', Env('Default_Image')),
+    ('ImageBuilderSubnet', Env('Default_Subnet')),
+    ('ImageBuilderSecurityGroup', Env('Default_SG')),
+    ('ImageBuilderCommandsLocation', False)
+]
+
+
+def lambda_handler(event, context):
+    logger.info("Beginning execution of AS2_Automation_Linux_Preflight function.")
+
+    parameters = resolve(event, parameter_schema)
+    checks = [
+        ('SSHKey', check_ssh_key, (get_ssh_key_name(event),))
+    ]
+
+    # An existing builder keeps its own network configuration, and its base image is not used
+    builder = get_existing_builder(parameters['ImageBuilderName'])
+    if builder :
+        logger.info("Image Builder %s already exists, checking its network configuration.", parameters['ImageBuilderName'])
+        subnet = builder['VpcConfig']['SubnetIds'][0]
+        security_group = builder['VpcConfig']['SecurityGroupIds'][0]
+    else :
+        subnet = parameters['ImageBuilderSubnet']
+        security_group = parameters['ImageBuilderSecurityGroup']
+        checks.append(('BaseImage', check_image, (parameters['ImageBuilderImage'],)))
+
+    checks.append(('Subnet', check_subnet, (subnet,)))
+    checks.append(('SecurityGroup', check_security_group, (security_group, 22)))
+
+    # A command plan stored outside the execution state must be readable before the builder is provisioned
+    if parameters['ImageBuilderCommandsLocation'] :
+        checks.append(('CommandPlan', check_command_plan, (parameters['ImageBuilderCommandsLocation'],)))
+
+    report = run_checks(checks)
+
+    # Fail the execution before any image builder is provisioned
+    if report['Status'] == "Failed" :
+        logger.info("Preflight checks failed, stopping execution.")
+        raise PreflightError(json.dumps(report))
+
+    logger.info("Completed AS2_Automation_Linux_Preflight function, returning to Step Function.")
+    return report
@@ -14,201 +14,601 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import asyncio
+import hashlib
+import json
 import logging
-import boto3
-import paramiko
-from io import StringIO
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor
+from as2_automation.artifacts import ArtifactTransferError, push_artifacts
+from as2_automation.commands import CommandFailedError, normalise_command, run_with_policy
+from as2_automation.envelope import get_builder_addresses
+from as2_automation.image_assistant import create_image_command, linux_image_assistant
+from as2_automation.manifest import optimise_command, optimiser_script, optimiser_script_text, parse_manifest_report, report_collect
+from as2_automation.package_plan import coalesce_package_commands
+from as2_automation.parameters import REQUIRED, resolve
+from as2_automation.plan_source import describe_plan, iter_plan_entries
+from as2_automation.remote import SSHConnectError, connect_ssh, load_ssh_key
+from as2_automation.telemetry import linux_sampler_collect, linux_sampler_start, parse_linux_samples, vmstat_pid
+from as2_automation.trace import traced
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Remaining Lambda time (ms) needed to run create-image within this invocation in combined mode
+image_creation_reserve_ms = 60000
 
-# Get parameter from SSM
-def get_parameters(param):
-    # Start SSM client
-    ssm = boto3.client('ssm')
-    
-    # Retrieve passed parameter from SSM parameter store
-    response = ssm.get_parameters(
-        Names=[param],WithDecryption=True
-    )
-    
-    for parameter in response['Parameters']:
-        return parameter['Value']
-
-
-# Establish ssh connection to instance
-def connect_ssh(ip, username):
-    connected = False
-
-    try:
-        ssh.connect(hostname=ip, port=22, username=username, pkey=privkey)
-        connected = True
-        return connected
-    except:
-        ssh.close()
-        
+# Files on the image builder used by detached command plans
+plan_script = "/tmp/as2_plan.sh"
+plan_log = "/tmp/as2_plan.log"
+plan_pid = "/tmp/as2_plan.pid"
+progress_file = "/tmp/as2_progress"
+checkpoint_prefix = "/tmp/as2_checkpoint_"
+xvfb_marker = "/tmp/as2_xvfb_preinstalled"
+strace_marker = "/tmp/as2_strace_preinstalled"
+group_failed_file = "/tmp/as2_group_failed"
 
-# Run shell command on connected instance
-def run_command(cmd):
-    stdin, stdout, stderr = ssh.exec_command(cmd)
-    stdin.flush()
-    
-    data = stdout.read().splitlines()
-    
-    for line in data:
-        print(line)        
+# Commands of a parallel group run at once on separate channels of the builder's SSH connection, up to this many by default
+default_group_concurrency = 4
+max_group_concurrency = 16
 
+# Results of successful and skipped steps are kept for this many steps, failures are always kept, so long plans
+# streamed from S3 do not grow the execution state
+command_results_limit = 200
 
-# Main function handler
-def lambda_handler(event, context):
-    logger.info("Beginning execution of AS2_Automation_Linux_Scripted_Install function.")
+# Automation parameters read from event data
+# If parameter not found, inject default values
+parameter_schema = [
+    ('ImageBuilderSSHKeyName', REQUIRED),
+    ('ImageBuilderCommands', False),
+    ('ImageBuilderArtifacts', False),
+    ('ArtifactConcurrency', 4),
+    ('ArtifactCompression', False),
+    ('CreateManifests', True),
+    ('ManifestCapture', 'lsof'),
+    ('OptimiseManifests', True),
+    ('ManifestSizeBudgetMiB', 0),
+    ('SharedBaseManifest', False),
+    ('DeleteTempManifests', False),
+    ('RemoveXvfb', True),
+    ('CombineImageCreation', False),
+    ('DetachedInstall', False),
+    ('CoalescePackageCommands', True),
+    ('ImageBuilderCommandsLocation', False),
+    ('ImageBuilderCommandsPlan', False)
+]
 
-    # Retrieve image builder SSH key name from event data
-    logger.info("Querying for image builder SSH key name.")
-    try :
-        ssh_key_name = event['AutomationParameters']['ImageBuilderSSHKeyName']
-        logger.info("SSH key name found in event data: %s.", ssh_key_name)
-    except Exception as e :
-        logger.error(e)
-        logger.info("Unable to find SSH key name in event data.")
 
-    # Retrieve option to dynamically generate AppStream application optimization manifests from event data
-    if 'CreateManifests' in event['AutomationParameters'] :
-        create_manifests = event['AutomationParameters']['CreateManifests']
-        logger.info("CreateManifests found in event data, setting to: %s.", create_manifests)
-    else :
-        create_manifests = True
-        logger.info("CreateManifests not found in event data, defaulting to True.")
+# Run shell command on connected instance, returning its output lines
+def run_command(ssh, cmd, builder):
+    builder['CommandsRun'] += 1
+    return ssh.run(cmd).std_out.splitlines()
+
 
-    # Retrieve option to delete temporary manifest files from event data
-    if 'DeleteTempManifests' in event['AutomationParameters'] :
-        delete_manifests = event['AutomationParameters']['DeleteTempManifests']
-        logger.info("DeleteTempManifests found in event data, setting to: %s.", delete_manifests)
+# Run shell command on connected instance, returning the full result with exit status
+# Output lines are labelled with the step when several steps run at once
+def run_command_status(ssh, cmd, builder, label=None):
+    builder['CommandsRun'] += 1
+    return ssh.run(cmd, label=label)
+
+
+# Expand a command into its plan steps, adding manifest generation to Image Assistant add-application commands
+def expand_command(command, options):
+    cmd = command['Command']
+    # If the command is related to adding app to AppStream catalog, check if a manifest should be dynamically generated
+    if "AppStreamImageAssistant add-application" in cmd :
+        logger.info("Image Assistant add-application command detected, parsing command.")
+        if "--absolute-manifest-path" in cmd :
+            # If the presence of manifest is detected in the command, a new one will not be dynamically generated
+            logger.info("Manifest found in passed image assistant command, using that with application import.")
+            return [command]
+        elif not options['CreateManifests'] :
+            # If no manifest command is detected and the option to generate manifests dynamically is disabled, one will not be generated
+            logger.info("No manifest found in command, but one will not be generated due to CreateManifests being set to false.")
+            return [command]
+        else :
+            # If no manifest command is detected, one will be dynamically generated
+            logger.info("No Manifest found in passed image assistant command, a manifest generation step will be added.")
+            app_path = cmd.split("--absolute-app-path ")[1] # Split off everything after absolute-app-path
+            app_path = app_path.split(" ")[0] # Split off everything before space to get path to app
+            app_exe = app_path.rsplit("/")[-1] # Split app path to get executable name
+            manifest_file = "/tmp/as2_manifest_" + app_exe + ".txt"
+            manifest_command = "xvfb-run /tmp/generate_appstream_manifest.sh " + app_path + " " + app_exe
+            # With strace capture, the files opened from launch until the app settles are traced in first-access order
+            if options['ManifestCapture'] == "strace" :
+                manifest_command += " strace"
+            # The generated manifest is deduplicated, trimmed to its budget and reported on before the application is added
+            if options['OptimiseManifests'] :
+                manifest_command += "; " + optimise_command(manifest_file, app_exe, options['ManifestSizeBudgetMiB'], options['SharedBaseManifest'])
+
+            # Generate manifest file, if generation was successful (manifest exists) append it to the image assistant command
+            command['Manifest'] = True
+            command['Command'] = manifest_command + "; if test -e " + manifest_file + "; then " + cmd + " --absolute-manifest-path " + manifest_file + "; else " + cmd + "; fi"
+            steps = [command]
+
+            # If cleanup is configured, delete the dynamically generated manifest, with the raw manifest and lsof snapshot kept next to it
+            if options['DeleteTempManifests'] :
+                manifest_base = manifest_file[:-len(".txt")]
+                steps.append(normalise_command("sudo rm -f " + " ".join([manifest_file, manifest_base + ".raw.txt", manifest_base + ".lsof.txt"]), "continue"))
+            return steps
     else :
-        delete_manifests = False
-        logger.info("DeleteTempManifests not found in event data, defaulting to False.")
+        # Commands that are not related to 'AppStreamImageAssistant add-application' run as passed
+        return [command]
+
 
-    # Retrieve option to remove Xvfb after manifest generation is complete from event data
-    if 'RemoveXvfb' in event['AutomationParameters'] :
-        remove_xvfb = event['AutomationParameters']['RemoveXvfb']
-        logger.info("RemoveXvfb found in event data, setting to: %s.", remove_xvfb)
+# Translate the command entries into the ordered shell steps run on the image builder, generated as the entries are read
+# Each step carries the failure policy of the command it came from, see as2_automation.commands
+def build_command_plan(commandArray, options):
+    # Xvfb is installed on image builder to enable launching of apps for AppStream app manifest creation, and strace for
+    # manifests captured by tracing, the manifest script falls back to lsof without it
+    # A marker is left for a package the base image already provides, so the final steps do not remove it
+    strace_capture = options['CreateManifests'] and options['ManifestCapture'] == "strace"
+    if options['RemoveXvfb'] :
+        yield normalise_command("if rpm -q --whatprovides Xvfb > /dev/null 2>&1; then touch " + xvfb_marker + "; fi", "continue")
+    if strace_capture :
+        yield normalise_command("if rpm -q strace > /dev/null 2>&1; then touch " + strace_marker + "; fi", "continue")
+
+    # The installs are plain yum steps so they coalesce with the package commands that follow them
+    # Without Xvfb manifests are not generated but applications are still added, so they are optional and a failed
+    # install does not stop the plan
+    yield dict(normalise_command("sudo yum -y install Xvfb > /dev/null", "continue"), Optional=True)
+    if strace_capture :
+        yield dict(normalise_command("sudo yum -y install strace > /dev/null", "continue"), Optional=True)
+
+    # An entry {"Parallel": [commands], "MaxConcurrency": n} is a group of independent commands run at the same time
+    # Image Assistant commands update the application catalog and generate manifests on a shared Xvfb display,
+    # so those in a group run sequentially after it
+    group = 0
+    for entry in commandArray:
+        if isinstance(entry, dict) and 'Parallel' in entry :
+            group += 1
+            deferred = []
+            for member in entry['Parallel'] :
+                command = normalise_command(member)
+                if "AppStreamImageAssistant" in command['Command'] :
+                    logger.info("Image Assistant command in parallel group %s will run after the group: %s", group, command['Command'])
+                    deferred.append(command)
+                    continue
+                command['Group'] = group
+                command['MaxConcurrency'] = min(entry.get('MaxConcurrency', default_group_concurrency), max_group_concurrency)
+                yield command
+            for command in deferred :
+                yield from expand_command(command, options)
+        else :
+            yield from expand_command(normalise_command(entry), options)
+
+    if strace_capture :
+        yield normalise_command("if test -e " + strace_marker + "; then rm -f " + strace_marker + "; else sudo yum -y remove strace > /dev/null; fi", "continue")
+
+    # Remove Xvfb package from image builder if requested
+    if options['RemoveXvfb'] :
+        yield normalise_command("if test -e " + xvfb_marker + "; then rm -f " + xvfb_marker + "; else sudo yum -y remove Xvfb > /dev/null; fi", "continue")
     else :
-        remove_xvfb = True
-        logger.info("RemoveXvfb not found in event data, defaulting to True.")
+        logger.info("Xvfb will not be removed from image builder.")
+
+
+# Read the command entries, streamed from the plan stored in S3 (or a file) or taken from the inline command array
+def iter_command_entries(options):
+    if options['PlanReference'] :
+        return iter_plan_entries(options['PlanReference'])
+    return iter(options['Commands'])
+
+
+# Stream the command plan for one image builder, every builder reads its own copy
+def stream_command_plan(options, report):
+    plan = build_command_plan(iter_command_entries(options), options)
+    if options['CoalescePackageCommands'] :
+        plan = coalesce_package_commands(plan, report)
+    return plan
+
+
+# Short hash identifying a command plan, checkpoints are keyed by it so a changed plan never reuses them
+# It covers the commands, or the content hash of a stored plan, and the options that shape the steps
+def get_plan_hash(options):
+    source = options['PlanReference']['Sha256'] if options['PlanReference'] else options['Commands']
+    shape = [source] + [options[key] for key in ('CreateManifests', 'ManifestCapture', 'OptimiseManifests', 'ManifestSizeBudgetMiB', 'SharedBaseManifest', 'DeleteTempManifests', 'RemoveXvfb', 'CoalescePackageCommands')]
+    return hashlib.sha256(json.dumps(shape).encode()).hexdigest()[:16]
+
+
+# Split the plan into stages of (step number, step) as it is read, a parallel group is one stage and every other
+# step a stage of its own. Each stage finishes before the next one starts
+def get_plan_stages(plan):
+    stage = []
+    for number, step in enumerate(plan, 1):
+        if stage and not (step.get('Group') and step.get('Group') == stage[0][1].get('Group')) :
+            yield stage
+            stage = []
+        stage.append((number, step))
+    if stage :
+        yield stage
+
+
+# Read the step numbers recorded as completed in the checkpoint file on the image builder
+def read_checkpoint(ssh, checkpoint_file, builder):
+    completed = set()
+    for line in run_command(ssh, "cat " + checkpoint_file + " 2>/dev/null", builder) :
+        if line.strip().isdigit() :
+            completed.add(int(line))
+    return completed
+
+
+# Wrap a plan step so its number is appended to the checkpoint file only when it exits successfully
+def checkpointed_step(step, number, checkpoint_file):
+    return "bash -c " + shlex.quote(step) + " && echo " + str(number) + " >> " + checkpoint_file
+
+
+# Shell lines running one plan step under its failure policy, recording its exit status and duration in the progress file
+# A step in a parallel group records its failure for the group instead of ending the script
+def build_step_script(step, number, checkpoint_file):
+    number = str(number)
+    lines = [
+        "if grep -qx " + number + " " + checkpoint_file + " 2>/dev/null; then echo 'Skipping step completed by a previous attempt.'; echo STEP " + number + " 0 0 SKIPPED >> " + progress_file + "; else",
+        "  attempt=0; step_start=$(date +%s)",
+        "  while true; do " + checkpointed_step(step['Command'], number, checkpoint_file) + "; rc=$?; [ $rc -eq 0 ] && break; attempt=$((attempt+1)); [ $attempt -gt " + str(step['Retries']) + " ] && break; sleep $((" + str(step['BackoffSeconds']) + " << (attempt-1))); done",
+        "  echo STEP " + number + " $rc $(($(date +%s) - step_start)) >> " + progress_file
+    ]
+    if step['OnFailure'] != "continue" and step.get('Group') :
+        lines.append("  [ $rc -eq 0 ] || echo " + number + " >> " + group_failed_file)
+    elif step['OnFailure'] != "continue" :
+        lines.append("  [ $rc -eq 0 ] || { echo ABORT " + number + " >> " + progress_file + "; finish_plan; exit 1; }")
+    lines.append("fi")
+    return lines
+
+
+# Generate shell script running the plan steps in order, recording each step's exit status in the progress file
+# Steps already in the checkpoint file are skipped, the checkpoint is removed once every step has succeeded
+# Failure policies are applied on the builder: retry steps are rerun with backoff, a failed step that is not
+# allowed to continue records ABORT and ends the script
+# Parallel groups run as background jobs up to their concurrency, output prefixed with the step, and are waited for
+# before the next step. The builder's bash predates wait -n, so free job slots are polled
+# The script is generated in chunks as the plan is read, the steps go in a function so the total is known before it runs
+# Builder utilisation is sampled while the plan runs, and its start and end times are recorded for build telemetry
+def build_detached_script(plan, plan_hash):
+    checkpoint_file = checkpoint_prefix + plan_hash
+    yield "#!/bin/bash\nfinish_plan() {\nkill $(cat " + vmstat_pid + " 2>/dev/null) 2>/dev/null\necho END $(date +%s) >> " + progress_file + "\necho DONE >> " + progress_file + "\n}\nrun_plan() {\n:\n"
+    total = 0
+    manifest_steps = []
+    for stage in get_plan_stages(plan):
+        total += len(stage)
+        manifest_steps += [number for number, step in stage if step.get('Manifest')]
+        script = []
+        if len(stage) == 1 and not stage[0][1].get('Group') :
+            number, step = stage[0]
+            script.append("echo '=== Step " + str(number) + "'")
+            script += build_step_script(step, number, checkpoint_file)
+        else :
+            concurrency = str(stage[0][1]['MaxConcurrency'])
+            script.append("echo '=== Parallel group " + str(stage[0][1]['Group']) + ", steps " + ", ".join(str(number) for number, step in stage) + "'")
+            script.append("rm -f " + group_failed_file)
+            for number, step in stage :
+                script.append("while [ $(jobs -rp | wc -l) -ge " + concurrency + " ]; do sleep 1; done")
+                script.append("(")
+                script += build_step_script(step, number, checkpoint_file)
+                script.append(") 2>&1 | sed -u 's/^/[step " + str(number) + "] /' &")
+            script.append("wait")
+            script.append("if [ -s " + group_failed_file + " ]; then echo ABORT $(head -n 1 " + group_failed_file + ") >> " + progress_file + "; finish_plan; exit 1; fi")
+        yield "\n".join(script) + "\n"
+
+    script = [
+        "}",
+        "echo TOTAL " + str(total) + " > " + progress_file,
+        "echo PLAN " + plan_hash + " >> " + progress_file,
+        "echo MANIFESTS " + " ".join(str(number) for number in manifest_steps if number <= command_results_limit) + " >> " + progress_file,
+        "echo START $(date +%s) >> " + progress_file,
+        linux_sampler_start()
+    ]
+    script.append("run_plan")
+    script.append("grep -q '^STEP [0-9]* [1-9]' " + progress_file + " || rm -f " + checkpoint_file)
+    script.append("finish_plan")
+    yield "\n".join(script) + "\n"
+
+
+# Upload the plan script and start it detached from the SSH session, unless a previous launch is still running
+def launch_detached(ssh, plan, plan_hash, builder):
+    ssh.put_file(plan_script, build_detached_script(plan, plan_hash))
+
+    launch_command = ("if [ -f " + plan_pid + " ] && kill -0 $(cat " + plan_pid + ") 2>/dev/null; then echo already running; "
+        "else nohup bash " + plan_script + " > " + plan_log + " 2>&1 < /dev/null & echo $! > " + plan_pid + "; echo launched; fi")
+    output = run_command(ssh, launch_command, builder)
+    logger.info("Detached command plan on %s: %s.", builder['IpAddress'], b" ".join(output).decode(errors='replace'))
+
+
+# Run one plan step under its failure policy, at most as many steps at once as the channels semaphore allows
+async def run_plan_step(ssh, step, number, checkpoint_file, builder, channels, labelled):
+    loop = asyncio.get_running_loop()
+    label = "step " + str(number) if labelled else None
+
+    def run(cmd):
+        return run_command_status(ssh, checkpointed_step(cmd, number, checkpoint_file), builder, label)
+
+    async with channels :
+        logger.info("Running step %s on %s: %s", number, builder['IpAddress'], step['Command'])
+        result = await loop.run_in_executor(None, run_with_policy, run, step)
+    result['Step'] = number
+    return result
 
-    # Retrieve image builder IP address from event data
+
+# Run the command plan on the image builder
+# Blocking paramiko calls run on the executor so the waits of the steps of a parallel group are multiplexed on one event loop
+async def install_on_builder(builder, options):
+    loop = asyncio.get_running_loop()
+
+    start = time.time()
+    logger.info("Connecting to image builder: %s.", builder['IpAddress'])
     try :
-        ip = event['BuilderStatus']['ImageBuilders'][0]['NetworkAccessConfiguration']['EniPrivateIpAddress']
-        logger.info("Image builder IP address found in event data: %s.", ip)
-    except Exception as e :
+        ssh = await loop.run_in_executor(None, lambda : connect_ssh(builder['IpAddress'], options['PrivateKey'], compress=options['ArtifactCompression']))
+    except SSHConnectError as e :
         logger.error(e)
-        logger.info("Unable to find IP address for image builder instance in event data.")
-        
-    # Retrieve commands to run on image builder from event data
-    try :
-        commandArray = event['AutomationParameters']['ImageBuilderCommands']
-        if commandArray :
-            logger.info("Installation command array found in event data: %s.", commandArray)
-        else :
-            logger.info("Unable to find array of commands to perform on the image builder in event data. Defaulting to performing a 'yum update' command.")
-            commandArray = ["sudo yum -y update"]
-    except Exception as e2 :
-        logger.error(e2)
-        logger.info("Error retreiving command array from event data: %s", e2)      
-
-    # Get RSA key from parameter store
-    logger.info("Retreiving RSA key from Parameter Store.")
-    global privkey 
-    privkey = paramiko.RSAKey.from_private_key(file_obj=StringIO(get_parameters(ssh_key_name)))
-
-    # Start SSH client
-    global ssh 
-    ssh = paramiko.SSHClient()
-
-    # Automatically adding the hostname and new host key to the local HostKeys object
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
-    # User account embeded in base image
-    username = "as2-automation"
-
-    logger.info("Connecting to image builder: %s.", ip)
-    isConnected = connect_ssh(ip, username)
-
-    # Once connected to image builder, run commands found in commands array        
-    if (isConnected) :
-        logger.info("Successfully connected to image builder.")
-
-        # Install Xvfb package on image builder to enable launching of apps for AppStream app manifest creation
-        run_command ("sudo yum -y install Xvfb > /dev/null")
-            
-        for cmd in commandArray:
-            # If the command is related to adding app to AppStream catalog, check if a manifest should be dynamically generated
-            if "AppStreamImageAssistant add-application" in cmd :
-                logger.info("Image Assistant add-application command detected, parsing command.")
-                if "--absolute-manifest-path" in cmd :
-                    # If the presence of manifest is detected in the command, a new one will not be dynamically generated
-                    logger.info("Manifest found in passed image assistant command, using that with application import.")
-                    manifest_file = False
-                elif not create_manifests :
-                    # If no manifest command is detected and the option to generate manifests dynamically is disabled, one will not be generated
-                    logger.info("No manifest found in command, but one will not be generated due to CreateManifests being set to false.")
-                    manifest_file = False
-                else :
-                    # If no manifest command is detected, one will be dynamically generated
-                    logger.info("No Manifest found in passed image assistant command, attempting to create one.")
-                    app_path = cmd.split("--absolute-app-path ")[1] # Split off everything after absolute-app-path
-                    app_path = app_path.split(" ")[0] # Split off everything before space to get path to app
-                    app_exe = app_path.rsplit("/")[-1] # Split app path to get executable name
-                    manifest_command = "xvfb-run /tmp/generate_appstream_manifest.sh " + app_path + " " + app_exe
-                    run_command(manifest_command) # Generate manifest file
-                    
-                    # Check if generation was successful (manifest exists)
-                    manifest_file = "/tmp/as2_manifest_" + app_exe + ".txt"
-                    manifest_check = "test -e " + manifest_file + " && echo exists"
-                    stdin, stdout, stderr = ssh.exec_command(manifest_check)
-                    output_data = stdout.read().splitlines()
-                    file_exists = False
-                    for lines in output_data:
-                        if "exists" in str(lines):
-                            file_exists = True
-                    
-                    # If manifest generation was successful, append image assistant command
-                    if file_exists :
-                        logger.info("Manifest generated. Appending to image assistant command.")
-                        cmd = cmd + " --absolute-manifest-path " + manifest_file
-                    else :
-                        logger.info("Manifest not generated. Using original image assistant command without a manifest.")                 
-
-                logger.info("Running image assistant command: %s", cmd)
-                run_command(cmd)
-
-                # If manifest was dynamically generated and cleanup is configured, delete manifest
-                if delete_manifests and manifest_file:
-                    logger.info("Removing temporary dynamically generated app manifest file: %s", manifest_file)
-                    delete_command = "sudo rm " + manifest_file
-                    run_command(delete_command)
-                
-                manifest_file = False    
+        builder['Status'] = "Failed"
+        builder['ConnectError'] = str(e)
+        builder['Connect'] = {
+            'Attempts' : e.attempts,
+            'LatencyMs' : e.elapsed_ms
+        }
+        return builder
+
+    logger.info("Successfully connected to image builder: %s.", builder['IpAddress'])
+    builder['Connect'] = ssh.connect_stats
+
+    # Generated manifests are optimised by a script uploaded with the plan, so it matches the function version
+    if options['CreateManifests'] and options['OptimiseManifests'] :
+        await loop.run_in_executor(None, ssh.put_file, optimiser_script, optimiser_script_text())
+
+    # Declared artifacts are streamed from their source into the builder and verified before the plan that installs them starts
+    if options['Artifacts'] :
+        try :
+            builder['Artifacts'] = await loop.run_in_executor(None, push_artifacts, ssh, options['Artifacts'], options['ArtifactConcurrency'])
+        except ArtifactTransferError as e :
+            logger.error(e)
+            ssh.close()
+            builder['Status'] = "Failed"
+            builder['ArtifactError'] = str(e)
+            builder['DurationSeconds'] = round(time.time() - start)
+            return builder
+
+    # Steps completed by a previous attempt are recorded in a checkpoint file on the builder keyed by the plan hash
+    plan_hash = get_plan_hash(options)
+    checkpoint_file = checkpoint_prefix + plan_hash
+
+    # The plan is streamed from its source while it runs, or while the detached script is uploaded
+    report = {}
+    plan = stream_command_plan(options, report)
+    if options['CoalescePackageCommands'] :
+        builder['PlanOptimisation'] = report
+
+    # In detached mode the plan runs on the builder under nohup and the Check Install Status task polls its progress
+    if options['Detached'] :
+        await loop.run_in_executor(None, launch_detached, ssh, plan, plan_hash, builder)
+        ssh.close()
+        builder['Status'] = "Running"
+        return builder
+
+    # Skip steps recorded in the checkpoint on the builder
+    completed = await loop.run_in_executor(None, read_checkpoint, ssh, checkpoint_file, builder)
+    if completed :
+        logger.info("Resuming command plan %s on %s, steps already completed: %s.", plan_hash, builder['IpAddress'], sorted(completed))
+
+    # Run each stage under the failure policies of its steps, stopping the plan after the first stage with a failed step
+    # Builder utilisation is sampled while the stages run
+    await loop.run_in_executor(None, run_command, ssh, linux_sampler_start(), builder)
+    install_start = time.time()
+    builder['Commands'] = []
+    builder['ManifestSteps'] = []
+    total = 0
+    for stage in get_plan_stages(plan):
+        total += len(stage)
+        builder['ManifestSteps'] += [number for number, step in stage if step.get('Manifest') and number <= command_results_limit]
+        pending = []
+        for number, step in stage :
+            if number in completed :
+                logger.info("Skipping step %s on %s, completed by a previous attempt: %s", number, builder['IpAddress'], step['Command'])
+                if number <= command_results_limit :
+                    builder['Commands'].append({'Step' : number, 'Command' : step['Command'], 'Status' : "Skipped"})
             else :
-                # Execute commands that are not related to 'AppStreamImageAssistant add-application'
-                logger.info("Running command: %s", cmd)
-                run_command(cmd)
-
-        # Remove Xvfb package from image builder if requested
-        if remove_xvfb :
-            run_command ("sudo yum -y remove Xvfb > /dev/null")
-            logger.info("Removed Xvfb from image builder.")
-        else :    
-            logger.info("Xvfb will not be removed from image builder.")
-            
-        logger.info("Completed all commands, closing SSH connection.")
-        ssh.close()    
+                pending.append((number, step))
+
+        # Steps of a parallel group each run on their own channel of the SSH transport, the gather is the barrier
+        channels = asyncio.Semaphore(stage[0][1].get('MaxConcurrency', 1))
+        results = await asyncio.gather(*[run_plan_step(ssh, step, number, checkpoint_file, builder, channels, len(stage) > 1) for number, step in pending])
+        builder['Commands'] += [result for result in results if result['Step'] <= command_results_limit or result['Status'] != "Succeeded"]
+
+        failed = [result['Step'] for result in results if result['Status'] == "Failed"]
+        if failed :
+            logger.info("Step %s failed on %s, stopping command plan.", failed[0], builder['IpAddress'])
+            builder['FailedStep'] = failed[0]
+            break
+
+    # A resumed plan only ran its remaining steps, so its duration is kept out of the build telemetry
+    builder['Phases'] = {
+        'Connect' : round(builder['Connect']['LatencyMs'] / 1000, 1),
+        'Install' : round(time.time() - install_start)
+    }
+    builder['Resumed'] = bool(completed)
+    samples = await loop.run_in_executor(None, ssh.run, linux_sampler_collect(), False)
+    builder['Utilisation'] = parse_linux_samples(samples.std_out.decode(errors='replace').splitlines())
+
+    # Manifest sizes before and after optimisation, as reported by the optimiser for each generated manifest
+    if builder['ManifestSteps'] and options['OptimiseManifests'] :
+        report = await loop.run_in_executor(None, ssh.run, report_collect(), False)
+        builder['Manifests'] = parse_manifest_report(report.std_out.decode(errors='replace').splitlines())
+
+    # Report the checkpoint in the task output, and clear it from the builder once every step succeeded
+    completed = await loop.run_in_executor(None, read_checkpoint, ssh, checkpoint_file, builder)
+    builder['Checkpoint'] = {
+        'PlanHash' : plan_hash,
+        'CompletedSteps' : sorted(completed)
+    }
+    builder['TotalSteps'] = total
+    if 'FailedStep' not in builder and completed.issuperset(range(1, total + 1)) :
+        await loop.run_in_executor(None, run_command, ssh, "rm -f " + checkpoint_file, builder)
     else :
-        logger.info("Connection to image builder failed.")
+        logger.info("Steps %s did not complete successfully on %s.", sorted(set(range(1, total + 1)) - completed), builder['IpAddress'])
+
+    # Never snapshot a builder whose command plan failed
+    if 'FailedStep' in builder :
+        ssh.close()
+        builder['Status'] = "Failed"
+        builder['DurationSeconds'] = round(time.time() - start)
+        return builder
+
+    # In combined mode, create the image on the existing session if it fits in the remaining Lambda time
+    if options['CreateImageCommand'] :
+        if time.time() < options['ImageCreationDeadline'] :
+            logger.info("Running image assistant command on existing session: %s", options['CreateImageCommand'])
+            image_start = time.time()
+            result = await loop.run_in_executor(None, run_command_status, ssh, options['CreateImageCommand'], builder)
+            logger.info("Results from image assistant command: %s", result.std_out)
+            if result.status_code != 0 or b"ERROR" in result.std_out :
+                logger.info("ERROR running Image Assistant, deferring to Run Image Assistant task.")
+            else :
+                builder['Phases']['ImageCreation'] = round(time.time() - image_start)
+                builder['ImageCreated'] = True
+        else :
+            logger.info("Insufficient time remaining to create image, deferring to Run Image Assistant task.")
+
+    logger.info("Completed all commands, closing SSH connection to %s.", builder['IpAddress'])
+    ssh.close()
+
+    builder['Status'] = "Complete"
+    builder['DurationSeconds'] = round(time.time() - start)
+    return builder
+
+
+# Run the command plan with an executor thread for each step of the largest parallel group a plan may have
+async def install(builder, options):
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=max_group_concurrency))
+    return await install_on_builder(builder, options)
+
+
+# Main function handler
+@traced
+def lambda_handler(event, context):
+    logger.info("Beginning execution of AS2_Automation_Linux_Scripted_Install function.")
+
+    parameters = resolve(event['AutomationParameters'], parameter_schema)
+    create_manifests = parameters['CreateManifests']
+    delete_manifests = parameters['DeleteTempManifests']
+    remove_xvfb = parameters['RemoveXvfb']
+    combine_image_creation = parameters['CombineImageCreation']
+    detached_install = parameters['DetachedInstall']
+
+    # Retrieve the IP address of the image builder the state machine created from event data
+    builders = []
+    for name, ip in get_builder_addresses(event.get('BuilderStatus', {'ImageBuilders' : []}))[:1] :
+        if not ip :
+            logger.info("Unable to find IP address for image builder instance in event data: %s.", name)
+            continue
+        logger.info("Image builder IP address found in event data: %s.", ip)
+        builders.append({
+            'ImageBuilderName' : name,
+            'IpAddress' : ip,
+            'Status' : "Pending",
+            'CommandsRun' : 0,
+            'ImageCreated' : False
+        })
+        
+    # Retrieve commands to run on image builder from event data, or the reference to a plan stored in S3
+    # A stored plan is described here if the Create Builder task did not already do so
+    plan_reference = parameters['ImageBuilderCommandsPlan']
+    if not plan_reference and parameters['ImageBuilderCommandsLocation'] :
+        plan_reference = describe_plan(parameters['ImageBuilderCommandsLocation'])
+    commandArray = parameters['ImageBuilderCommands']
+    if plan_reference :
+        logger.info("Streaming command plan of %s entries from %s.", plan_reference['Entries'], plan_reference['Location'])
+    elif not commandArray :
+        logger.info("Unable to find array of commands to perform on the image builder in event data. Defaulting to performing a 'yum update' command.")
+        commandArray = ["sudo yum -y update"]
+
+    # Get SSH key from parameter store, its type is detected from the key
+    logger.info("Retreiving SSH key from Parameter Store.")
+    privkey = load_ssh_key(parameters['ImageBuilderSSHKeyName'])
+
+    # In combined mode, the image is created on the install session if the install finishes before the deadline
+    full_image_name = None
+    options = {
+        'CreateManifests' : create_manifests,
+        'ManifestCapture' : parameters['ManifestCapture'],
+        'OptimiseManifests' : parameters['OptimiseManifests'],
+        'ManifestSizeBudgetMiB' : parameters['ManifestSizeBudgetMiB'],
+        'SharedBaseManifest' : parameters['SharedBaseManifest'],
+        'DeleteTempManifests' : delete_manifests,
+        'RemoveXvfb' : remove_xvfb,
+        'CoalescePackageCommands' : parameters['CoalescePackageCommands'],
+        'PlanReference' : plan_reference,
+        'Commands' : commandArray,
+        'Artifacts' : parameters['ImageBuilderArtifacts'],
+        'ArtifactConcurrency' : parameters['ArtifactConcurrency'],
+        'ArtifactCompression' : parameters['ArtifactCompression'],
+        'Detached' : detached_install,
+        'PrivateKey' : privkey,
+        'CreateImageCommand' : None,
+        'ImageCreationDeadline' : time.time() + (context.get_remaining_time_in_millis() - image_creation_reserve_ms) / 1000
+    }
+    if combine_image_creation and builders and not detached_install :
+        full_image_name, options['CreateImageCommand'] = create_image_command(event['AutomationParameters'], linux_image_assistant)
+
+    # Consecutive yum/dnf commands are merged into fewer transactions as the plan is read if CoalescePackageCommands is set,
+    # each one loads metadata and takes the RPM database lock
+    results = [asyncio.run(install(builder, options)) for builder in builders]
+
+    # Stop the execution before Image Assistant runs if a command failed on any builder
+    failed = [builder for builder in results if 'FailedStep' in builder]
+    if failed :
+        logger.info("Command plan failed on %s image builder(s), stopping execution.", len(failed))
+        raise CommandFailedError(json.dumps({
+            'Builders' : [
+                {
+                    'ImageBuilderName' : builder['ImageBuilderName'],
+                    'IpAddress' : builder['IpAddress'],
+                    'FailedStep' : builder['FailedStep'],
+                    'Commands' : [result for result in builder['Commands'] if result['Status'] in ("Failed", "Continued")]
+                } for builder in failed
+            ]
+        }))
+
+    # A builder that could not be reached was never provisioned, fail the task so the state machine retries it
+    unreachable = [builder for builder in results if 'ConnectError' in builder]
+    if unreachable :
+        logger.info("Unable to connect to %s image builder(s), stopping execution.", len(unreachable))
+        raise SSHConnectError(json.dumps({
+            'Builders' : [
+                {
+                    'ImageBuilderName' : builder['ImageBuilderName'],
+                    'IpAddress' : builder['IpAddress'],
+                    'ConnectError' : builder['ConnectError'],
+                    'Connect' : builder['Connect']
+                } for builder in unreachable
+            ]
+        }))
+
+    # An artifact that could not be pushed or failed its checksum leaves the builder without its installers
+    unstaged = [builder for builder in results if 'ArtifactError' in builder]
+    if unstaged :
+        logger.info("Unable to push artifacts to %s image builder(s), stopping execution.", len(unstaged))
+        raise ArtifactTransferError(json.dumps({
+            'Builders' : [
+                {
+                    'ImageBuilderName' : builder['ImageBuilderName'],
+                    'IpAddress' : builder['IpAddress'],
+                    'ArtifactError' : builder['ArtifactError']
+                } for builder in unstaged
+            ]
+        }))
+
+    image_created = any(builder['ImageCreated'] for builder in results)
 
     logger.info("Completed AS2_Automation_Linux_Scripted_Install function, returning to Step Function.")
-    return {
+    response = {
         'Method' : "Script",
-        'Status' : "Complete"
-    }
\ No newline at end of file
+        'Status' : "Running" if detached_install else "Complete",
+        'ImageCreated' : image_created,
+        'Builders' : results
+    }
+    if image_created :
+        response['Images'] = [
+            {
+                "Name": full_image_name
+            }
+        ]
+    return response
@@ -15,21 +15,164 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import logging
-import boto3
-import os
 import json
 import textwrap
+import time
+from as2_automation.clients import get_client
+from as2_automation.distribution import distribution_summary
+from as2_automation.envelope import first, get_image_name, image_envelope
+from as2_automation.manifest import manifest_summary
+from as2_automation.parameters import get_env
+from as2_automation.rollout import rollout_summary
+from as2_automation.telemetry import build_records, record_build
+from as2_automation.trace import traced
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-appstream = boto3.client('appstream')
-sns = boto3.client('sns')
+# AWS account number, read once per container
+account_id = None
 
+# SNS rejects messages larger than 256 KB, digests are kept under this size
+digest_size_limit = 250000
 
+
+# Get AWS account number from the ARN of this function, cached for the life of the container
+def get_account_id(context):
+    global account_id
+    if not account_id :
+        account_id = context.invoked_function_arn.split(":")[4]
+    return account_id
+
+
+# Store the full execution state in S3 and return a console link to it, or None if no bucket is configured
+def store_full_output(event, image_name):
+    bucket = get_env('Payload_S3_Bucket', None)
+    if not bucket :
+        return None
+
+    key = "notifications/" + image_name + ".json"
+    get_client('s3').put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(event, indent=4, separators=(',', ': '), sort_keys=False),
+        ContentType='application/json'
+    )
+    logger.info("Full execution output stored in s3://%s/%s.", bucket, key)
+    return "https://s3.console.aws.amazon.com/s3/object/" + bucket + "?prefix=" + key
+
+
+# Render the notification body, trimming the application list and full output to fit the size budget
+def render_message(header, apps, full_output, budget):
+    template = textwrap.dedent('''\
+        {0}
+        ------------------------------------------------------------------------------
+        Included Applications:
+        ------------------------------------------------------------------------------
+        {1}
+        ------------------------------------------------------------------------------
+        Full Output:
+        ------------------------------------------------------------------------------
+        {2}
+        ''')
+
+    # Only include the compact full output inline if it fits alongside the summary
+    app_list = "\n".join(apps) + "\n"
+    message = template.format(header, app_list, full_output)
+    if len(message.encode()) <= budget :
+        return message
+    full_output = "Omitted, {0} bytes exceeds the notification size budget.".format(len(full_output.encode()))
+
+    # Drop applications from the end of the list until the message fits
+    shown = len(apps)
+    message = template.format(header, app_list, full_output)
+    while len(message.encode()) > budget and shown > 0 :
+        shown -= 1
+        app_list = "\n".join(apps[:shown]) + "\n... and {0} more\n".format(len(apps) - shown)
+        message = template.format(header, app_list, full_output)
+    return message
+
+
+# Queue a rendered notification for the digest of the current time window instead of publishing it
+def queue_for_digest(topic_arn, subject, message, window_minutes):
+    window = int(time.time() // (window_minutes * 60))
+    key = "notifications/digest/{0}/{1}.json".format(window, subject.rsplit(" ", 1)[-1])
+    get_client('s3').put_object(
+        Bucket=get_env('Payload_S3_Bucket'),
+        Key=key,
+        Body=json.dumps({'TopicArn': topic_arn, 'Subject': subject, 'Message': message})
+    )
+    logger.info("Notification queued for digest window %s.", window)
+    return "Queued"
+
+
+# Publish one message per SNS topic for every digest window that has closed, then remove the queued notifications
+def flush_digests(window_minutes):
+    s3 = get_client('s3')
+    bucket = get_env('Payload_S3_Bucket')
+    current_window = int(time.time() // (window_minutes * 60))
+
+    # Collect queued notifications from closed windows, grouped by window and topic
+    groups = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix="notifications/digest/") :
+        for item in page.get('Contents', []) :
+            window = int(item['Key'].split("/")[2])
+            if window >= current_window :
+                continue
+            queued = json.loads(s3.get_object(Bucket=bucket, Key=item['Key'])['Body'].read())
+            groups.setdefault((window, queued['TopicArn']), []).append((item['Key'], queued))
+
+    published = []
+    for (window, topic_arn), notifications in sorted(groups.items()) :
+        start = time.strftime("%Y-%m-%d %H:%M", time.gmtime(window * window_minutes * 60))
+        sbj = "AppStream Image Creation Digest: {0} images".format(len(notifications))
+        msg = "{0} AppStream images completed in the {1} minute window starting {2} UTC.\n\n".format(len(notifications), window_minutes, start)
+
+        # Keep adding notifications until the SNS size limit would be reached
+        included = 0
+        for key, queued in notifications :
+            entry = queued['Subject'] + "\n" + queued['Message'] + "\n"
+            if len((msg + entry).encode()) > digest_size_limit :
+                break
+            msg += entry
+            included += 1
+        if included < len(notifications) :
+            msg += "... and {0} more notifications, omitted to stay within the SNS message size limit.\n".format(len(notifications) - included)
+
+        response = get_client('sns').publish(TopicArn=topic_arn, Message=msg, Subject=sbj)
+        published.append(response['MessageId'])
+        logger.info("Digest of %s notifications published to SNS.", len(notifications))
+
+        s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key, queued in notifications]})
+
+    return published
+
+
+@traced
 def lambda_handler(event, context):
     logger.info("Beginning execution of AS2_Automation_Linux_Image_Notification function.")
 
+    window_minutes = int(get_env('Digest_Window_Minutes', 0))
+
+    # Scheduled invocation publishing the digests of closed windows
+    if event.get('DigestFlush') :
+        logger.info("Flushing notification digests.")
+        return flush_digests(window_minutes)
+
+    # Invoked by the failure handler of the state machine with the error it caught, the build is recorded without a notification
+    # The execution failure itself is reported by the failure notification rule
+    if event.get('Error') :
+        logger.info("Execution failed with %s, recording build telemetry.", event['Error'].get('Error'))
+        image_name = get_image_name(event['ImageStatus']) if event.get('ImageStatus') else None
+        try :
+            for record in build_records(event, image_name, "FAILED", "Linux") :
+                record_build(record)
+        except Exception as e :
+            logger.error(e)
+            logger.info("Unable to record build telemetry.")
+        return None
+
     # Retrieve SNS topic ARN from event data
     # If parameter not found, inject default value defined in Lambda function environment variables
     if 'NotificationArn' in event['AutomationParameters'] :
@@ -37,49 +180,63 @@ def lambda_handler(event, context):
         if NotifyARN :
             logger.info("SNS Notification ARN found found in event data: %s.", NotifyARN)
         else :
-            NotifyARN = os.environ['NotificationARN']
+            NotifyARN = get_env('NotificationARN')
             logger.info("SNS Notification ARN not found found in event data, using default ARN from Lambda environment variable: %s.", NotifyARN)
     else :
-        NotifyARN = os.environ['NotificationARN']
+        NotifyARN = get_env('NotificationARN')
         logger.info("SNS Notification ARN not found found in event data, using default ARN from Lambda environment variable: %s.", NotifyARN)
     
     # Retrieve AppStream image name from event data
-    ImageName = event['ImageStatus']['Images'][0]['Name']
+    ImageName = get_image_name(event['ImageStatus'])
     
-    # Attempt to query status of AppStream image
+    # The state machine passes the compact image envelope, the image is only described when invoked with a name alone
     try :
-        response = appstream.describe_images(
-            Names=[
-                ImageName,
-            ]
-        )
+        image = event['ImageStatus']
+        if 'Applications' not in image :
+            response = get_client('appstream').describe_images(
+                Names=[
+                    ImageName,
+                ]
+            )
+            image = image_envelope(response['Images'][0])
         
         logger.info("Image found, generating notification content.")
         
-        # Pull required information from response
-        ImageState = response['Images'][0]['State']
-        ImagePlatform = response['Images'][0]['Platform']
-        ImageBuilderName = response['Images'][0]['ImageBuilderName']
-        AppsArray = response['Images'][0]['Applications']
-    
-        # Create list of applications detected in image
-        AppList = ""
-        for App in AppsArray:
-            AppList += App['Name'] + "\n"
+        # Pull required information from the image envelope
+        ImageState = image['State']
+        ImagePlatform = first(image['Platform'])
+        ImageBuilderName = first(image['ImageBuilderName'])
+
+        # List of applications detected in image
+        AppList = image['Applications']
 
         # Get AWS account number
-        AccountId = boto3.client('sts').get_caller_identity()['Account']
+        AccountId = get_account_id(context)
 
     except Exception as e:
         logger.error(e)
         logger.info("Unable to query status of image.")
+
+    # Record the phase durations and utilisation of each image builder for instance type right-sizing
+    try :
+        for record in build_records(event, ImageName, ImageState, "Linux") :
+            record_build(record)
+    except Exception as e4 :
+        logger.error(e4)
+        logger.info("Unable to record build telemetry.")
         
-    # Get list of all parameters sent into the Lambda function from event
-    FullOutput = json.dumps(event, indent=4, separators=(',', ': '), sort_keys=False)
+    # Store full output in S3 when configured, otherwise include the compact execution state inline
+    try :
+        FullOutput = store_full_output(event, ImageName)
+    except Exception as e3:
+        logger.error(e3)
+        FullOutput = None
+    if not FullOutput :
+        FullOutput = json.dumps(event, separators=(',', ':'), sort_keys=False)
 
     sbj = "AppStream Image Creation Notification: {0}".format(ImageName)
     
-    msg = textwrap.dedent('''\
+    header = textwrap.dedent('''\
         ------------------------------------------------------------------------------
         Image Information:
         ------------------------------------------------------------------------------
@@ -87,21 +244,30 @@ def lambda_handler(event, context):
         Platform: \t {1}
         Builder Name: \t {2} 
         Status: \t\t {3}
-        AWS Account: \t {4} \n
-        ------------------------------------------------------------------------------
-        Included Applications:
-        ------------------------------------------------------------------------------
-        {5}
-        ------------------------------------------------------------------------------
-        Full Output:
-        ------------------------------------------------------------------------------
-        {6}
-        ''').format(ImageName,ImagePlatform,ImageBuilderName,ImageState,AccountId,AppList,FullOutput)
+        AWS Account: \t {4} \n''').format(ImageName,ImagePlatform,ImageBuilderName,ImageState,AccountId)
+
+    # List when the image became available in each region it was copied to, it is usable everywhere after the slowest copy
+    if event.get('Distribution') :
+        header += distribution_summary(event['Distribution'])
+
+    # List the size of each generated manifest before and after optimisation
+    header += manifest_summary((event.get('InstallStatus') or {}).get('Builders', []))
+
+    # List the cutover time of each fleet switched to the image, and the fleets skipped after a failed wave
+    if event.get('Rollout') :
+        header += rollout_summary(event['Rollout'])
+
+    msg = render_message(header, AppList, FullOutput, int(get_env('Message_Size_Budget', 16384)))
 
+    # Queue the notification for the digest of the current window if digests are enabled
+    if window_minutes > 0 :
+        MessageID = queue_for_digest(NotifyARN, sbj, msg, window_minutes)
+        logger.info("Completed AS2_Automation_Linux_Image_Notification function, returning to Step Function.")
+        return MessageID
 
     # Publish image information to SNS Topic    
     try :
-        response = sns.publish(
+        response = get_client('sns').publish(
             TopicArn=NotifyARN,
             Message=msg,
             Subject=sbj
@@ -0,0 +1,193 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+from as2_automation.envelope import get_builder_addresses
+from as2_automation.manifest import parse_manifest_report, report_collect
+from as2_automation.parameters import REQUIRED, resolve
+from as2_automation.remote import SSHConnectError, connect_ssh, load_ssh_key
+from as2_automation.telemetry import linux_sampler_collect, parse_linux_samples
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Files on the image builder used by detached command plans
+plan_pid = "/tmp/as2_plan.pid"
+progress_file = "/tmp/as2_progress"
+
+# Steps whose durations are returned, the status of long plans stays within the execution state limit
+command_results_limit = 200
+
+# Time allowed for connecting to each image builder, the status is polled again on the next cycle
+connect_deadline_seconds = 20
+
+# Polls in a row an image builder may be unreachable before its install is treated as failed
+connect_failures_limit = 5
+
+# Automation parameters read from event data
+parameter_schema = [
+    ('ImageBuilderSSHKeyName', REQUIRED)
+]
+
+
+# Read detached plan progress from image builder and summarise it
+def check_builder(ip, privkey, connect_failures=0):
+    builder = {
+        'IpAddress' : ip,
+        'Status' : "Failed",
+        'StepsCompleted' : 0,
+        'TotalSteps' : None,
+        'FailedSteps' : [],
+        'Commands' : [],
+        'Checkpoint' : None,
+        'ConnectFailures' : 0
+    }
+    completed = []
+
+    # The detached plan keeps running while the builder is unreachable, so it is polled again until the limit is reached
+    try :
+        ssh = connect_ssh(ip, privkey, deadline_seconds=connect_deadline_seconds)
+    except SSHConnectError as e :
+        logger.error(e)
+        builder['ConnectError'] = str(e)
+        builder['ConnectFailures'] = connect_failures + 1
+        if builder['ConnectFailures'] < connect_failures_limit :
+            builder['Status'] = "Running"
+            logger.info("Image builder %s unreachable on %s polls in a row, polling again.", ip, builder['ConnectFailures'])
+        else :
+            logger.info("Image builder %s unreachable on %s polls in a row, treating install as failed.", ip, builder['ConnectFailures'])
+        return builder
+
+    # Read progress file and check whether the plan process is alive in a single round trip
+    # Once the plan is done the manifest report and the utilisation samples it recorded are collected in the same round trip
+    status_command = ("cat " + progress_file + " 2>/dev/null; if [ -f " + plan_pid + " ] && kill -0 $(cat " + plan_pid + ") 2>/dev/null; then echo ALIVE; fi; "
+        + "if grep -q '^DONE' " + progress_file + " 2>/dev/null; then " + report_collect() + "; echo SAMPLES; " + linux_sampler_collect() + "; fi")
+    output = ssh.run(status_command, log_output=False).std_out.decode(errors='replace').splitlines()
+    ssh.close()
+
+    done = False
+    alive = False
+    aborted = None
+    started = None
+    ended = None
+    samples = None
+    resumed = False
+    manifests = []
+    for line in output:
+        fields = line.split()
+        if samples is not None :
+            samples.append(line)
+            continue
+        if not fields :
+            continue
+        if fields[0] == "TOTAL" :
+            builder['TotalSteps'] = int(fields[1])
+        elif fields[0] == "PLAN" :
+            builder['Checkpoint'] = {
+                'PlanHash' : fields[1],
+                'CompletedSteps' : completed
+            }
+        elif fields[0] == "STEP" :
+            # Steps of a parallel group finish in any order, so completed steps are counted
+            builder['StepsCompleted'] += 1
+            skipped = fields[4:] == ["SKIPPED"]
+            resumed = resumed or skipped
+            if fields[2] != "0" :
+                builder['FailedSteps'].append(int(fields[1]))
+            else :
+                completed.append(int(fields[1]))
+            if int(fields[1]) <= command_results_limit :
+                builder['Commands'].append({
+                    'Step' : int(fields[1]),
+                    'Status' : "Skipped" if skipped else "Succeeded" if fields[2] == "0" else "Failed",
+                    'DurationSeconds' : int(fields[3])
+                })
+        elif fields[0] == "MANIFESTS" :
+            builder['ManifestSteps'] = [int(number) for number in fields[1:]]
+        elif fields[0] == "MANIFEST" :
+            manifests.append(line)
+        elif fields[0] == "ABORT" :
+            aborted = int(fields[1])
+        elif fields[0] == "START" :
+            started = int(fields[1])
+        elif fields[0] == "END" :
+            ended = int(fields[1])
+        elif fields[0] == "DONE" :
+            done = True
+        elif fields[0] == "ALIVE" :
+            alive = True
+        elif fields[0] == "SAMPLES" :
+            samples = []
+
+    # A step that failed under the fail or retry policy ended the plan early
+    if aborted :
+        builder['AbortedAtStep'] = aborted
+        logger.info("Command plan on %s stopped at failed step %s.", ip, aborted)
+    elif done :
+        builder['Status'] = "Complete"
+        # Plans resumed from a checkpoint skip completed steps, their duration is kept out of the build telemetry
+        if started and ended :
+            builder['Phases'] = {'Install' : ended - started}
+            builder['Resumed'] = resumed
+        builder['Utilisation'] = parse_linux_samples(samples or [])
+        if manifests :
+            builder['Manifests'] = parse_manifest_report(manifests)
+    elif alive :
+        builder['Status'] = "Running"
+    else :
+        logger.info("Command plan on %s is neither running nor complete.", ip)
+
+    logger.info("Command plan on %s: %s, %s of %s steps completed.", ip, builder['Status'], builder['StepsCompleted'], builder['TotalSteps'])
+    return builder
+
+
+def lambda_handler(event, context):
+    logger.info("Beginning execution of AS2_Automation_Linux_Check_Install_Status function.")
+
+    parameters = resolve(event['AutomationParameters'], parameter_schema)
+
+    # Get SSH key from parameter store, its type is detected from the key
+    logger.info("Retreiving SSH key from Parameter Store.")
+    privkey = load_ssh_key(parameters['ImageBuilderSSHKeyName'])
+
+    # Connect failures in a row are carried from the previous poll of each builder
+    previous = {}
+    for builder in event.get('InstallStatus', {}).get('Builders', []) :
+        previous[builder.get('ImageBuilderName')] = builder.get('ConnectFailures', 0)
+
+    # Check plan progress on every image builder the install task ran on
+    results = []
+    for name, ip in get_builder_addresses(event['BuilderStatus']) :
+        result = check_builder(ip, privkey, previous.get(name, 0))
+        result['ImageBuilderName'] = name
+        results.append(result)
+
+    # The install is failed if any builder failed, running while any builder still runs
+    statuses = [result['Status'] for result in results]
+    if "Failed" in statuses :
+        status = "Failed"
+    elif "Running" in statuses :
+        status = "Running"
+    else :
+        status = "Complete"
+
+    logger.info("Completed AS2_Automation_Linux_Check_Install_Status function, returning %s to Step Function.", status)
+    return {
+        'Method' : "Script",
+        'Status' : status,
+        'ImageCreated' : False,
+        'Builders' : results
+    }
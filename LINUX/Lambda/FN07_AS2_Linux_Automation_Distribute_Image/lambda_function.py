@@ -0,0 +1,47 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import logging
+from as2_automation.distribution import advance_distribution, new_distribution
+from as2_automation.envelope import get_image_name
+from as2_automation.parameters import REQUIRED, get_env, resolve
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Automation parameters read from event data
+parameter_schema = [
+    ('DistributionRegions', REQUIRED),
+    ('MaxConcurrentCopies', 3)
+]
+
+
+# Invoked once the image is available and again every minute while copies are in progress
+# The distribution state returned is passed back in the next invocation through the execution state
+def lambda_handler(event, context):
+    logger.info("Beginning execution of AS2_Automation_Linux_Distribute_Image function.")
+
+    parameters = resolve(event['AutomationParameters'], parameter_schema)
+
+    distribution = event.get('Distribution')
+    if not distribution :
+        distribution = new_distribution(get_image_name(event['ImageStatus']), get_env('AWS_REGION'), parameters['DistributionRegions'])
+        logger.info("Distributing %s from %s to %s.", distribution['ImageName'], distribution['SourceRegion'], [copy['Region'] for copy in distribution['Regions']])
+
+    distribution = advance_distribution(distribution, int(parameters['MaxConcurrentCopies']))
+
+    logger.info("Completed AS2_Automation_Linux_Distribute_Image function, distribution %s, returning to Step Function.", distribution['Status'])
+    return distribution
@@ -0,0 +1,37 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import logging
+from as2_automation.clients import get_client
+from as2_automation.envelope import builder_envelope, image_envelope
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+# Invoked by the status polling states of the state machine with the ImageBuilderName or the ImageName to describe
+# The call goes through the shared AppStream client, so polling waits for a token from the rate limiter like every
+# other AppStream call, and returns the compact envelope the state machine keeps as BuilderStatus or ImageStatus
+def lambda_handler(event, context):
+    if 'ImageName' in event :
+        image = get_client('appstream').describe_images(Names=[event['ImageName']])['Images'][0]
+        logger.info("Image %s is %s.", image['Name'], image['State'])
+        return image_envelope(image)
+
+    image_builder = get_client('appstream').describe_image_builders(Names=[event['ImageBuilderName']])['ImageBuilders'][0]
+    logger.info("Image builder %s is %s.", image_builder['Name'], image_builder['State'])
+    return builder_envelope(image_builder)
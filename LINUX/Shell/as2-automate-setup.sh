@@ -25,8 +25,17 @@ echo "Granting as2-user sudo rights."
 echo "as2-automation      ALL=(ALL)       NOPASSWD: ALL" | (sudo su -c 'EDITOR="tee" visudo -f /etc/sudoers.d/as2-automation-users')
 
 # Create key pair for remote ssh connection
-echo "Generating SSH key."
-ssh-keygen -m PEM -f /tmp/automate -q -N ""
+# usage as2-automate-setup.sh [ed25519|ecdsa|rsa], Ed25519 keys are the cheapest for the Lambda functions to load and sign with
+# Ed25519 keys are written in the OpenSSH format, ECDSA and RSA keys as PEM, the functions detect the type from the key
+KEY_TYPE=${1:-ed25519}
+case $KEY_TYPE in
+  ed25519) KEY_OPTIONS="-t ed25519" ;;
+  ecdsa) KEY_OPTIONS="-t ecdsa -b 256 -m PEM" ;;
+  rsa) KEY_OPTIONS="-t rsa -m PEM" ;;
+  *) echo "Unsupported key type $KEY_TYPE, use ed25519, ecdsa or rsa."; exit 1 ;;
+esac
+echo "Generating $KEY_TYPE SSH key."
+ssh-keygen $KEY_OPTIONS -f /tmp/automate -q -N ""
 
 # Move private key to AppStream temporary files location for easy download
 mv /tmp/automate /home/ImageBuilderAdmin/MyFiles/TemporaryFiles/as2-automate.pem
@@ -41,7 +50,15 @@ sudo chown as2-automation:as2-automation /home/as2-automation/.ssh/authorized_ke
 # Generate script to create AppStream 2.0 application optimization manifest files
 cat << EOF > /tmp/generate_appstream_manifest.sh
 #!/bin/bash
-# usage generate_appstream_manfiest.sh app_full_path app_exe_name
+# usage generate_appstream_manfiest.sh app_full_path app_exe_name [lsof|strace]
+
+# With strace, every file the app opens from launch until it settles is traced instead of taking an lsof snapshot
+if [[ \$3 == "strace" ]]; then
+  if command -v strace > /dev/null; then
+    exec /tmp/trace_appstream_manifest.sh \$1 \$2
+  fi
+  echo "strace is not installed, falling back to an lsof snapshot."
+fi
 
 echo "Begin execution of AppStream 2.0 app optimization manifest generation script."
 # Run passed process and wait 20sec for it to launch
@@ -65,7 +82,68 @@ fi
 echo "End execution of AppStream 2.0 manifest generation script."
 EOF
 
-# Make script executable
+# Generate script to trace the files opened by an app from launch until it settles, in first-access order
+# Files opened and closed during startup (configs, fonts, plugin scans) are missed by a single lsof snapshot
+cat << 'EOF' > /tmp/trace_appstream_manifest.sh
+#!/bin/bash
+# usage trace_appstream_manifest.sh app_full_path app_exe_name
+# Writes /tmp/as2_manifest_app_exe_name.txt, and the lsof snapshot of the same processes at settle time to
+# /tmp/as2_manifest_app_exe_name.lsof.txt for comparison
+
+# The app has settled once it opens no new file for SETTLE_SECONDS, tracing stops after MAX_WAIT_SECONDS regardless
+SETTLE_SECONDS=${SETTLE_SECONDS:-5}
+MAX_WAIT_SECONDS=${MAX_WAIT_SECONDS:-60}
+
+manifest=/tmp/as2_manifest_$2.txt
+snapshot=/tmp/as2_manifest_$2.lsof.txt
+log=/tmp/as2_trace_$2.log
+opens='(open|openat|creat)([(]| resumed>)'
+
+echo "Begin execution of AppStream 2.0 app optimization manifest trace script."
+rm -f $log $snapshot
+
+# Trace file opens and program executions of the whole process tree, -y resolves each returned descriptor to its path
+strace -f -qq -ttt -y -e trace=execve,open,openat,creat -o $log $1 &
+tracer=$!
+
+echo "Tracing $1 until it opens no new file for $SETTLE_SECONDS seconds."
+count=0; idle=0; waited=0
+while (( idle < SETTLE_SECONDS && waited < MAX_WAIT_SECONDS )) && kill -0 $tracer 2> /dev/null; do
+  sleep 1
+  waited=$((waited + 1))
+  current=$(grep -c -E "$opens" $log 2> /dev/null)
+  if (( current == count )); then idle=$((idle + 1)); else idle=0; count=$current; fi
+done
+echo "Stopped tracing after $waited seconds and $count file opens."
+
+# Snapshot the files still open, as the lsof method would, then terminate the traced processes
+pids=$(awk '{print $1}' $log | sort -un | while read -r pid; do kill -0 $pid 2> /dev/null && echo $pid; done | tr '\n' , | sed 's/,$//')
+if [[ $pids ]]; then
+  sudo lsof -p $pids | grep REG | sed -n '1!p' | awk '{print $9}' | awk 'NF' | sort -u > $snapshot
+  kill ${pids//,/ } 2> /dev/null
+fi
+kill $tracer 2> /dev/null
+
+# Successful opens and executions in time order, first access of each regular file only
+awk -v opens="$opens" '
+  $0 ~ opens && match($0, / = [0-9]+<[^>]*>$/) {
+    path = substr($0, RSTART, RLENGTH - 1); sub(/^ = [0-9]+</, "", path); print $2, path; next
+  }
+  /execve\("/ && / = 0$/ && match($0, /execve\("[^"]*"/) { print $2, substr($0, RSTART + 8, RLENGTH - 9) }
+' $log | sort -s -n -k1,1 | cut -d' ' -f2- | awk '!seen[$0]++' | grep -v -E '^/(proc|sys|dev)/' |
+  while read -r file; do [[ -f $file ]] && echo "$file"; done > $manifest
+
+total=$(wc -l < $manifest)
+echo "Manifest of $total files written to $manifest in first-access order."
+if [[ -s $snapshot ]]; then
+  both=$(comm -12 <(sort -u $manifest) $snapshot | wc -l)
+  echo "lsof snapshot: $(wc -l < $snapshot) files, $both also in the manifest, $((total - both)) only found by tracing, $(comm -13 <(sort -u $manifest) $snapshot | wc -l) only in the snapshot."
+fi
+echo "End execution of AppStream 2.0 manifest trace script."
+EOF
+
+# Make scripts executable
 chmod +x /tmp/generate_appstream_manifest.sh
+chmod +x /tmp/trace_appstream_manifest.sh
 
 echo "Script complete, proceed with next step in the automation guide."
\ No newline at end of file
@@ -0,0 +1,67 @@
+#!/bin/sh
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Builds a trimmed paramiko Lambda layer (Lambda_Layer_paramiko38_libraries.zip) and fails
+# if importing paramiko from the built layer exceeds the cold start import time budget.
+# Run on Amazon Linux (or the public.ecr.aws/sam/build-python3.8 container) so the compiled
+# libraries and bytecode match the Lambda runtime.
+#
+# usage: build-paramiko-layer.sh [output_zip]
+#   PYTHON            interpreter matching the Lambda runtime (default python3.8)
+#   IMPORT_BUDGET_MS  maximum cumulative import time of paramiko in milliseconds (default 1000)
+
+set -e
+
+PYTHON=${PYTHON:-python3.8}
+IMPORT_BUDGET_MS=${IMPORT_BUDGET_MS:-1000}
+OUTPUT=${1:-Lambda_Layer_paramiko38_libraries.zip}
+BUILD_DIR=$(mktemp -d)
+START_DIR=$(pwd)
+
+echo "Installing paramiko into $BUILD_DIR/python."
+$PYTHON -m pip install --quiet --no-compile --target "$BUILD_DIR/python" paramiko
+
+# boto3 and botocore are provided by the Lambda runtime, pip tooling is never imported
+echo "Removing packages provided by the Lambda runtime and unused files."
+cd "$BUILD_DIR/python"
+rm -rf boto3* botocore* s3transfer* jmespath* pip* setuptools* wheel* _distutils_hack
+find . -type d \( -name tests -o -name testing -o -name __pycache__ \) -prune -exec rm -rf {} +
+find . \( -name "*.pyi" -o -name "*.c" -o -name "*.h" -o -name "*.pyx" -o -name "*.pxd" \) -delete
+find . -path "*.dist-info/*" ! -name METADATA ! -name top_level.txt -delete
+
+# /opt is read only in Lambda, ship bytecode so it is not recompiled on every cold start
+echo "Precompiling bytecode for the Lambda runtime."
+$PYTHON -m compileall -q -j 0 .
+
+# Fail the build if the cold start import of paramiko has grown beyond the budget
+echo "Measuring paramiko import time against budget of ${IMPORT_BUDGET_MS}ms."
+IMPORT_US=$(PYTHONPATH="$BUILD_DIR/python" $PYTHON -X importtime -c "import paramiko" 2>&1 | awk -F'|' '$3 == " paramiko" {gsub(/ /, "", $2); print $2}')
+IMPORT_MS=$((IMPORT_US / 1000))
+echo "paramiko import time: ${IMPORT_MS}ms."
+if [ "$IMPORT_MS" -gt "$IMPORT_BUDGET_MS" ]; then
+  echo "ERROR paramiko import time ${IMPORT_MS}ms exceeds budget of ${IMPORT_BUDGET_MS}ms."
+  exit 1
+fi
+
+cd "$BUILD_DIR"
+zip -q -r -9 layer.zip python
+cd "$START_DIR"
+mv "$BUILD_DIR/layer.zip" "$OUTPUT"
+rm -rf "$BUILD_DIR"
+
+echo "Layer written to $OUTPUT, upload it to the SourceS3Bucket before deploying the CloudFormation template."
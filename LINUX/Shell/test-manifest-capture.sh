@@ -0,0 +1,69 @@
+#!/bin/bash
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Measures how much of an app's startup file set each manifest capture method finds, using a local test app that reads
+# config, font and plugin files while it starts and only keeps its data files open once it has settled
+# Uses the manifest scripts created by as2-automate-setup.sh, and extracts them from it when they are not in /tmp
+# usage test-manifest-capture.sh [lsof] [strace]
+
+APP_NAME=as2-test-app
+APP_DIR=/tmp/as2_manifest_test
+METHODS=${*:-lsof strace}
+
+if [[ ! -x /tmp/generate_appstream_manifest.sh || ! -x /tmp/trace_appstream_manifest.sh ]]; then
+  echo "Extracting the manifest scripts from as2-automate-setup.sh."
+  sed -n '/^# Generate script to create AppStream 2.0 application optimization manifest files/,/^chmod +x \/tmp\/trace_appstream_manifest.sh/p' \
+    "$(dirname "$0")/as2-automate-setup.sh" | bash
+fi
+
+# Test app and the files it opens while starting
+rm -rf $APP_DIR
+mkdir -p $APP_DIR/conf $APP_DIR/fonts $APP_DIR/plugins $APP_DIR/data
+for i in $(seq 1 5); do echo "setting$i=value" > $APP_DIR/conf/app$i.conf; done
+for i in $(seq 1 20); do head -c 4096 /dev/urandom > $APP_DIR/fonts/font$i.ttf; done
+for i in $(seq 1 10); do echo "plugin $i" > $APP_DIR/plugins/plugin$i.so; done
+for i in $(seq 1 3); do echo "data $i" > $APP_DIR/data/data$i.db; done
+
+cat << 'APP' > $APP_DIR/$APP_NAME
+#!/bin/bash
+dir=$(dirname "$0")
+# Startup: configs are read by the app itself, fonts by child processes and plugins are scanned, each file is closed again
+for file in $dir/conf/*.conf; do while read -r line; do :; done < "$file"; done
+for file in $dir/fonts/*.ttf; do cat "$file" > /dev/null; done
+for file in $dir/plugins/*.so; do head -c 16 "$file" > /dev/null; done
+# Settled: the data files stay open until the app is terminated
+exec 3< $dir/data/data1.db 4< $dir/data/data2.db 5< $dir/data/data3.db
+while true; do sleep 1; done
+APP
+chmod +x $APP_DIR/$APP_NAME
+
+expected=$(find $APP_DIR -type f | sort)
+total=$(echo "$expected" | wc -l)
+manifest=/tmp/as2_manifest_$APP_NAME.txt
+
+for method in $METHODS; do
+  rm -f $manifest
+  start=$(date +%s)
+  /tmp/generate_appstream_manifest.sh $APP_DIR/$APP_NAME $APP_NAME $method > $APP_DIR/$method.log 2>&1
+  seconds=$(($(date +%s) - start))
+  touch $manifest
+  found=$(comm -12 <(echo "$expected") <(sort -u $manifest) | wc -l)
+  echo "$method: $found of $total startup files in the manifest ($((found * 100 / total))%), $(wc -l < $manifest) files in total, captured in $seconds seconds."
+  cp $manifest $APP_DIR/manifest-$method.txt
+done
+echo "Manifests and capture logs are in $APP_DIR."
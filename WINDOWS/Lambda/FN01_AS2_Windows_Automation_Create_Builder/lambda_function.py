@@ -15,114 +15,82 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import logging
-import boto3
-import os
 import botocore
+from as2_automation.clients import get_client
+from as2_automation.distribution import parse_regions
+from as2_automation.parameters import Env, get_env, resolve
+from as2_automation.rollout import parse_fleets
+from as2_automation.sizing import recommend_instance_type
+from as2_automation.trace import traced
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-appstream = boto3.client('appstream')
-
+# Starting parameters read from event data
+# If parameter not found, inject default values defined in Lambda function
+parameter_schema = [
+    ('ImageBuilderName', Env('Default_IB_Name')),
+    ('ImageBuilderImage', Env('Default_Image')),
+    ('ImageBuilderType', Env('Default_Type')),
+    ('TargetBuildMinutes', 30),
+    ('ImageBuilderSubnet', Env('Default_Subnet')),
+    ('ImageBuilderSecurityGroup', Env('Default_SG')),
+    ('ImageBuilderIAMRole', Env('Default_Role')),
+    ('ImageBuilderDomain', Env('Default_Domain')),
+    ('ImageBuilderOU', Env('Default_OU')),
+    ('ImageBuilderDisplayName', Env('Default_DisplayName')),
+    ('ImageBuilderDescription', Env('Default_Description')),
+    ('ImageBuilderInternetAccess', False),
+    ('ImageOutputPrefix', Env('Default_Prefix')),
+    ('ImageTags', False),
+    ('UseLatestAgent', True),
+    ('DeleteBuilder', False),
+    ('DistributionRegions', Env('Default_Distribution_Regions')),
+    ('MaxConcurrentCopies', 3),
+    ('RolloutFleets', False),
+    ('RolloutWaveSize', 1),
+    ('RolloutRestartFleets', True),
+    ('CombineImageCreation', False),
+    ('DeployMethod', Env('Default_Method')),
+    ('ImageBuilderExtraCommands', False),
+    ('PackageS3Bucket', Env('Default_S3_Bucket')),
+    ('NotifyARN', False)
+]
+
+
+@traced
 def lambda_handler(event, context):
     logger.info("Beginning execution of AS2_Automation_Windows_Create_Builder function.")
 
-    # Retrieve starting parameters from event data
-    # If parameter not found, inject default values defined in Lambda function
-    if 'ImageBuilderName' in event :
-        IB_Name = event['ImageBuilderName']
-    else :
-        IB_Name = os.environ['Default_IB_Name']
-
-    if 'ImageBuilderImage' in event :
-        IB_Image = event['ImageBuilderImage']
-    else :
-        IB_Image = os.environ['Default_Image']
-
-    if 'ImageBuilderType' in event :
-        IB_Type = event['ImageBuilderType']
-    else :
-        IB_Type = os.environ['Default_Type']        
-
-    if 'ImageBuilderSubnet' in event :
-        IB_Subnet = event['ImageBuilderSubnet']
-    else :
-        IB_Subnet = os.environ['Default_Subnet']
+    parameters = resolve(event, parameter_schema)
 
-    if 'ImageBuilderSecurityGroup' in event :
-        IB_SG = event['ImageBuilderSecurityGroup']
-    else :
-        IB_SG = os.environ['Default_SG']
+    # Regions the image is copied to once available, the distribution stage is skipped when there are none
+    parameters['DistributionRegions'] = parse_regions(parameters['DistributionRegions'])
 
-    if 'ImageBuilderIAMRole' in event :
-        IB_Role = event['ImageBuilderIAMRole']
-    else :
-        IB_Role = os.environ['Default_Role']   
+    # Fleets switched to the image once it is available, in waves of RolloutWaveSize, the rollout stage is skipped when there are none
+    parameters['RolloutFleets'] = parse_fleets(parameters['RolloutFleets'])
 
-    if 'ImageBuilderDomain' in event :
-        IB_Domain = event['ImageBuilderDomain']
-    else :
-        IB_Domain = os.environ['Default_Domain']   
-        
-    if 'ImageBuilderOU' in event :
-        IB_OU = event['ImageBuilderOU']
-    else :
-        IB_OU = os.environ['Default_OU']   
-        
-    if 'ImageBuilderDisplayName' in event :
-        IB_DisplayName = event['ImageBuilderDisplayName']
-    else :
-        IB_DisplayName = os.environ['Default_DisplayName']   
+    # An ImageBuilderType of auto is replaced by the cheapest instance type expected to install within TargetBuildMinutes,
+    # based on the telemetry of earlier builds with the same image prefix, or by the default type if there are none
+    if parameters['ImageBuilderType'] == "auto" :
+        recommendation = recommend_instance_type(parameters['ImageOutputPrefix'], "Windows", float(parameters['TargetBuildMinutes']) * 60)
+        parameters['InstanceTypeRecommendation'] = recommendation
+        parameters['ImageBuilderType'] = recommendation['InstanceType'] if recommendation else get_env('Default_Type')
+        logger.info("ImageBuilderType set to %s.", parameters['ImageBuilderType'])
 
-    if 'ImageBuilderDescription' in event :
-        IB_Description = event['ImageBuilderDescription']
-    else :
-        IB_Description = os.environ['Default_Description']   
+    IB_Name = parameters['ImageBuilderName']
+    IB_Image = parameters['ImageBuilderImage']
+    IB_Type = parameters['ImageBuilderType']
+    IB_Subnet = parameters['ImageBuilderSubnet']
+    IB_SG = parameters['ImageBuilderSecurityGroup']
+    IB_Role = parameters['ImageBuilderIAMRole']
+    IB_Domain = parameters['ImageBuilderDomain']
+    IB_OU = parameters['ImageBuilderOU']
+    IB_DisplayName = parameters['ImageBuilderDisplayName']
+    IB_Description = parameters['ImageBuilderDescription']
+    IB_Internet = parameters['ImageBuilderInternetAccess']
 
-    if 'ImageBuilderInternetAccess' in event :
-        IB_Internet = event['ImageBuilderInternetAccess']
-    else :
-        IB_Internet = False
-        
-    if 'ImageOutputPrefix' in event :
-        IB_Prefix = event['ImageOutputPrefix']
-    else :
-        IB_Prefix = os.environ['Default_Prefix']
-
-    if 'ImageTags' in event :
-        Image_Tags = event['ImageTags']
-    else :
-        Image_Tags = False         
-        
-    if 'UseLatestAgent' in event :
-        UseLatestAgent = event['UseLatestAgent']
-    else :
-        UseLatestAgent = True            
-        
-    if 'DeleteBuilder' in event :
-        Delete_Builder = event['DeleteBuilder']
-    else :
-        Delete_Builder = False    
-
-    if 'DeployMethod' in event :
-        DeployMethod = event['DeployMethod']
-    else :
-        DeployMethod = os.environ['Default_Method']
-
-    if 'ImageBuilderExtraCommands' in event :
-        ImageBuilderExtraCommands = event['ImageBuilderCommands']
-    else :
-        ImageBuilderExtraCommands = False        
-
-    if 'PackageS3Bucket' in event :
-        Package_S3_Bucket = event['PackageS3Bucket']
-    else :
-        Package_S3_Bucket = os.environ['Default_S3_Bucket']   
-
-    if 'NotifyARN' in event :
-        NotifyARN = event['NotifyARN']
-    else :
-        NotifyARN = False           
+    appstream = get_client('appstream')
 
     try :
         # Checking for existing Image Builder with same name   
@@ -156,7 +124,11 @@ def lambda_handler(event, context):
         
         PreExistingBuilder = True
     
-    except :
+    except Exception as error :
+        # Only a missing builder leads to creation, a throttled or failed describe call fails the task so it is retried
+        if isinstance(error, botocore.exceptions.ClientError) and error.response['Error']['Code'] != 'ResourceNotFoundException' :
+            logger.error(error)
+            raise error
         logger.info("Image Builder does not exist, beginning creation of new Image Builder.")
         try :
             if IB_Domain == 'none' or IB_OU == 'none':
@@ -222,6 +194,7 @@ def lambda_handler(event, context):
                 logger.error(error)
                 logger.info("Image Builder Already Exists, moving on to next step.")
                 BuilderName = IB_Name
+                PreExistingBuilder = True
             else:
                 logger.error(error)
                 raise error
@@ -230,28 +203,23 @@ def lambda_handler(event, context):
             logger.error(e)
             raise e
     
+    # Reconfigured values from an existing Image Builder replace the requested ones
+    parameters.update({
+        'ImageBuilderName' : BuilderName,
+        'ImageBuilderType' : IB_Type,
+        'ImageBuilderImage' : IB_Image,
+        'ImageBuilderSubnet' : IB_Subnet,
+        'ImageBuilderSecurityGroup' : IB_SG,
+        'ImageBuilderIAMRole' : IB_Role,
+        'ImageBuilderDomain' : IB_Domain,
+        'ImageBuilderOU' : IB_OU,
+        'ImageBuilderDisplayName' : IB_DisplayName,
+        'ImageBuilderDescription' : IB_Description,
+        'ImageBuilderInternetAccess' : IB_Internet,
+        'PreExistingBuilder' : PreExistingBuilder
+    })
+
     logger.info("Completed AS2_Automation_Windows_Create_Builder function, returning to Step Function.")
     return {
-        "AutomationParameters": {
-            'ImageBuilderName' : BuilderName,
-            'ImageBuilderType' : IB_Type,
-            'ImageBuilderImage' : IB_Image,
-            'ImageBuilderSubnet' : IB_Subnet,
-            'ImageBuilderSecurityGroup' : IB_SG,
-            'ImageBuilderIAMRole' : IB_Role,
-            'ImageBuilderDomain' : IB_Domain,
-            'ImageBuilderOU' : IB_OU,
-            'ImageBuilderDisplayName' : IB_DisplayName,
-            'ImageBuilderDescription' : IB_Description,
-            'ImageBuilderInternetAccess' : IB_Internet,
-            'ImageBuilderExtraCommands' : ImageBuilderExtraCommands,            
-            'ImageOutputPrefix' : IB_Prefix,
-            'ImageTags' : Image_Tags,
-            'UseLatestAgent' : UseLatestAgent,
-            'DeployMethod' : DeployMethod,
-            'DeleteBuilder' : Delete_Builder,
-            'PreExistingBuilder' : PreExistingBuilder,
-            'PackageS3Bucket' : Package_S3_Bucket,
-            'NotifyARN' : NotifyARN
-        }
-    }
\ No newline at end of file
+        "AutomationParameters": parameters
+    }
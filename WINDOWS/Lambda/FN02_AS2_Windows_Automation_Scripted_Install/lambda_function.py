@@ -15,137 +15,216 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import logging
-import boto3
+import hashlib
 import json
-import os
-import winrm
-import base64
+import time
+from as2_automation.commands import CommandFailedError, normalise_command, run_with_policy
+from as2_automation.envelope import get_builder_addresses
+from as2_automation.image_assistant import create_image_command, windows_image_assistant
+from as2_automation.parameters import Env, resolve
+from as2_automation.remote import connect_winrm, load_builder_credentials
+from as2_automation.telemetry import parse_windows_samples, windows_sampler_collect, windows_sampler_start
+from as2_automation.trace import traced
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-appstream = boto3.client('appstream')
-secretsmgr = boto3.client('secretsmanager')
+# Remaining Lambda time (ms) needed to run create-image within this invocation in combined mode
+image_creation_reserve_ms = 60000
 
+# Automation parameters read from event data
+# If parameter not found, inject default values defined in Lambda function
+parameter_schema = [
+    ('PackageS3Bucket', Env('Default_S3_Bucket')),
+    ('ImageBuilderExtraCommands', False),
+    ('CombineImageCreation', False)
+]
+
+
+# Read the steps recorded as completed in the checkpoint file on the image builder
+def read_checkpoint(session, checkpoint_file):
+    result = session.run("Get-Content -Path '" + checkpoint_file + "' -ErrorAction SilentlyContinue")
+    return set(line.strip() for line in result.std_out.decode(errors='replace').splitlines() if line.strip())
+
+
+# Record a completed step in the checkpoint file on the image builder
+def record_checkpoint(session, checkpoint_file, completed, step):
+    session.run("Add-Content -Path '" + checkpoint_file + "' -Value '" + step + "'")
+    completed.add(step)
+
+
+@traced
 def lambda_handler(event, context):
     logger.info("Beginning execution of AS2_Automation_Windows_Scripted_Install function.")
 
+    parameters = resolve(event['AutomationParameters'], parameter_schema)
+
     # Retrieve S3 bucket for sourcefiles from event or environment variable
-    logger.info("Querying for S3 bucket containing installation files.")
-    if 'PackageS3Bucket' in event['AutomationParameters'] :
-        S3Bucket = event['AutomationParameters']['PackageS3Bucket']
-    else :
-        S3Bucket = os.environ['Default_S3_Bucket']
-    logger.info("Source S3 bucket found: %s.", S3Bucket)
+    S3Bucket = parameters['PackageS3Bucket']
 
     # Retrieve image builder IP address from event data
     logger.info("Querying for Image Builder instance IP address.")
     try :
-        host = event['BuilderStatus']['ImageBuilders'][0]['NetworkAccessConfiguration']['EniPrivateIpAddress']
+        builder_name, host = get_builder_addresses(event['BuilderStatus'])[0]
         logger.info("IP address found: %s.", host)
     except Exception as e :
         logger.error(e)
         logger.info("Unable to find IP address for Image Builder instance.")
         
     # Retrieve commands to run on image builder from event data
-    try :
-        commandArray = event['AutomationParameters']['ImageBuilderExtraCommands']
-        if commandArray :
-            logger.info("Installation command array found in event data: %s.", commandArray)
-        else :
-            logger.info("No additional commands to perform on the image builder in event data.")
-    except Exception as e2 :
-        logger.error(e2)
-        logger.info("Error retreiving command array from event data: %s", e2)     
-        
+    commandArray = parameters['ImageBuilderExtraCommands']
+    if not commandArray :
+        logger.info("No additional commands to perform on the image builder in event data.")
 
     # Read image builder administrator username and password from Secrets Manager
     logger.info("Retreiving instance username and password from Secrets Manager.")
-    secret_name = "as2/builder/pw"
-    secret_response = secretsmgr.get_secret_value(SecretId=secret_name)
-
-    if 'SecretString' in secret_response:
-        secret = json.loads(secret_response['SecretString'])
-    else:
-        secret = base64.b64decode(secret_response['SecretBinary'])
-
-    user = secret['as2_builder_admin_user']
-    password = secret['as2_builder_admin_pw']
-    logger.info("Remote access credentials obtained: %s", user)
+    credentials = load_builder_credentials()
+    logger.info("Remote access credentials obtained: %s", credentials[0])
 
     try :
         # Connect to remote image builder using pywinrm library
         logger.info("Connecting to host: %s", host)
-        session = winrm.Session(host, auth=(user, password))
+        connect_start = time.time()
+        session = connect_winrm(host, credentials)
+        connect_seconds = round(time.time() - connect_start, 1)
     except Exception as e2 :
         logger.error(e2)
         logger.info("Unable to remotely connect to the Image Builder instance.")
         
     # Create temp directory
     logger.info("Creating temp directory.")
-    result = session.run_ps("New-Item -Path c:\\ -Name \"temp\" -ItemType \"directory\" -force")
+    result = session.run("New-Item -Path c:\\ -Name \"temp\" -ItemType \"directory\" -force")
+
+    # Sample builder utilisation while the commands and installs run, for build telemetry
+    install_start = time.time()
+    session.run(windows_sampler_start())
 
-    # If an array of PowerShell commands were passed to the Step Function, run them
+    # Steps completed by a previous attempt are recorded in a checkpoint file keyed by a hash of the command plan
+    plan_hash = hashlib.sha256(json.dumps([commandArray, S3Bucket]).encode()).hexdigest()[:16]
+    checkpoint_file = "C:\\temp\\as2_checkpoint_" + plan_hash + ".txt"
+    plan_steps = ["Command-" + str(index + 1) for index in range(len(commandArray or []))] + ["NotepadPP", "PuTTY", "Drawio"]
+    completed = read_checkpoint(session, checkpoint_file)
+    resumed = bool(completed)
+    if completed :
+        logger.info("Resuming command plan %s, steps already completed: %s.", plan_hash, sorted(completed))
+
+    # If an array of PowerShell commands were passed to the Step Function, run them under their failure policies
+    command_results = []
     if commandArray:
-        for cmd in commandArray:
-            session.run_ps(cmd)
+        for index, entry in enumerate(commandArray):
+            step = "Command-" + str(index + 1)
+            command = normalise_command(entry)
+            if step in completed :
+                logger.info("Skipping %s, completed by a previous attempt: %s", step, command['Command'])
+                command_results.append({'Step' : step, 'Command' : command['Command'], 'Status' : "Skipped"})
+                continue
+            logger.info("Running %s: %s", step, command['Command'])
+            result = run_with_policy(session.run, command)
+            result['Step'] = step
+            command_results.append(result)
+            if result['Status'] == "Succeeded" :
+                record_checkpoint(session, checkpoint_file, completed, step)
+            elif result['Status'] == "Failed" :
+                logger.info("%s failed, stopping command plan before software installation.", step)
+                raise CommandFailedError(json.dumps({
+                    'FailedStep' : step,
+                    'Commands' : [result for result in command_results if result['Status'] in ("Failed", "Continued")]
+                }))
 
 
     ############################################################
     # Install  Notepad++ package and add to application catalog
-    prefix = "Read-S3Object -BucketName "
-    suffix = " -KeyPrefix NotepadPP -Folder c:\\temp\\NotepadPP -ProfileName appstream_machine_role"
-    command = prefix + S3Bucket + suffix       
-    logger.info("Downloading Notepad++ sourcefiles from S3 to temp directory using command: %s", command)
-    result = session.run_ps(command)
-    dlresult = session.run_ps("Test-Path -Path c:\\temp\\NotepadPP\\Install_NotepadPP.ps1 -PathType Leaf")
-    restext = str(dlresult.std_out)
-    if "True" in restext :
-        logger.info("Software download complete, begining software installation: Notepad++.")
-        result = session.run_ps("C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe -ExecutionPolicy Bypass -File c:\\temp\\NotepadPP\\Install_NotepadPP.ps1")
-        logger.info("Completed installation, removing local installation files: Notepad++.")
+    if "NotepadPP" in completed :
+        logger.info("Skipping Notepad++, installed by a previous attempt.")
     else :
-        logger.info("Unable to successfully download software installation aborted: Notepad++. Cleaning up any files downloaded. Confirm file path is correct and files were uploaded to SourceS3Bucket.")
-    result = session.run_ps("Remove-Item 'C:\\temp\\NotepadPP' -Recurse")
+        prefix = "Read-S3Object -BucketName "
+        suffix = " -KeyPrefix NotepadPP -Folder c:\\temp\\NotepadPP -ProfileName appstream_machine_role"
+        command = prefix + S3Bucket + suffix       
+        logger.info("Downloading Notepad++ sourcefiles from S3 to temp directory using command: %s", command)
+        result = session.run(command)
+        dlresult = session.run("Test-Path -Path c:\\temp\\NotepadPP\\Install_NotepadPP.ps1 -PathType Leaf")
+        restext = str(dlresult.std_out)
+        if "True" in restext :
+            logger.info("Software download complete, begining software installation: Notepad++.")
+            result = run_with_policy(session.run, normalise_command("C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe -ExecutionPolicy Bypass -File c:\\temp\\NotepadPP\\Install_NotepadPP.ps1", "continue"))
+            result['Step'] = "NotepadPP"
+            command_results.append(result)
+            if result['Status'] == "Succeeded" :
+                logger.info("Completed installation, removing local installation files: Notepad++.")
+                record_checkpoint(session, checkpoint_file, completed, "NotepadPP")
+            else :
+                logger.info("Installation failed, removing local installation files: Notepad++.")
+        else :
+            logger.info("Unable to successfully download software installation aborted: Notepad++. Cleaning up any files downloaded. Confirm file path is correct and files were uploaded to SourceS3Bucket.")
+        result = session.run("Remove-Item 'C:\\temp\\NotepadPP' -Recurse")
     ############################################################
     
     
     ############################################################
     # Install  PuTTY package and add to application catalog
-    prefix = "Read-S3Object -BucketName "
-    suffix = " -KeyPrefix PuTTY -Folder c:\\temp\\PuTTY -ProfileName appstream_machine_role"
-    command = prefix + S3Bucket + suffix 
-    logger.info("Downloading PuTTY sourcefiles from S3 to temp directory using command: %s", command)
-    result = session.run_ps(command)
-    dlresult = session.run_ps("Test-Path -Path c:\\temp\\PuTTY\\Install_PuTTY.ps1 -PathType Leaf")
-    restext = str(dlresult.std_out)
-    if "True" in restext :
-        logger.info("Software download complete, begining software installation: PuTTY.")
-        result = session.run_ps("C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe -ExecutionPolicy Bypass -File c:\\temp\\PuTTY\\Install_PuTTY.ps1")
-        logger.info("Completed installation, removing local installation files: PuTTY.")
+    if "PuTTY" in completed :
+        logger.info("Skipping PuTTY, installed by a previous attempt.")
     else :
-        logger.info("Unable to successfully download software installation aborted: PuTTY. Cleaning up any files downloaded. Confirm file path is correct and files were uploaded to SourceS3Bucket.")
-    result = session.run_ps("Remove-Item 'C:\\temp\\PuTTY' -Recurse") 
+        prefix = "Read-S3Object -BucketName "
+        suffix = " -KeyPrefix PuTTY -Folder c:\\temp\\PuTTY -ProfileName appstream_machine_role"
+        command = prefix + S3Bucket + suffix 
+        logger.info("Downloading PuTTY sourcefiles from S3 to temp directory using command: %s", command)
+        result = session.run(command)
+        dlresult = session.run("Test-Path -Path c:\\temp\\PuTTY\\Install_PuTTY.ps1 -PathType Leaf")
+        restext = str(dlresult.std_out)
+        if "True" in restext :
+            logger.info("Software download complete, begining software installation: PuTTY.")
+            result = run_with_policy(session.run, normalise_command("C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe -ExecutionPolicy Bypass -File c:\\temp\\PuTTY\\Install_PuTTY.ps1", "continue"))
+            result['Step'] = "PuTTY"
+            command_results.append(result)
+            if result['Status'] == "Succeeded" :
+                logger.info("Completed installation, removing local installation files: PuTTY.")
+                record_checkpoint(session, checkpoint_file, completed, "PuTTY")
+            else :
+                logger.info("Installation failed, removing local installation files: PuTTY.")
+        else :
+            logger.info("Unable to successfully download software installation aborted: PuTTY. Cleaning up any files downloaded. Confirm file path is correct and files were uploaded to SourceS3Bucket.")
+        result = session.run("Remove-Item 'C:\\temp\\PuTTY' -Recurse") 
     ############################################################
 
 
     ############################################################
     # Dynamically download Draw.io and add to application catalog
-    command = "mkdir 'C:\\Program Files\\Drawio\\'"
-    result = session.run_ps(command)
-    command = "Invoke-WebRequest -Uri https://github.com/jgraph/drawio-desktop/releases/download/v15.4.0/draw.io-15.4.0-windows-no-installer.exe -OutFile 'C:\\Program Files\\Drawio\\draw.io-15.4.0-windows-no-installer.exe'"
-    logger.info("Downloading Draw.io sourcefiles from Github using command: %s", command)
-    result = session.run_ps(command)
-    dlresult = session.run_ps("Test-Path -Path 'C:\\Program Files\\Drawio\\draw.io-15.4.0-windows-no-installer.exe' -PathType Leaf")
-    restext = str(dlresult.std_out)
-    if "True" in restext :
-        command = 'C:/PROGRA~1/Amazon/Photon/ConsoleImageBuilder/image-assistant.exe add-application --name Draw.io --display-name Draw.io --absolute-app-path C:/PROGRA~1/Drawio/draw.io-15.4.0-windows-no-installer.exe'
-        logger.info("Software download complete, adding software to catalog: Draw.io using command: %s", command)
-        result = session.run_cmd(command)
+    if "Drawio" in completed :
+        logger.info("Skipping Draw.io, installed by a previous attempt.")
     else :
-        logger.info("Unable to successfully download software installation aborted: Draw.io. Cleaning up directory.")
-        result = session.run_ps("Remove-Item 'C:\\Program Files\\Drawio' -Recurse") 
+        command = "mkdir 'C:\\Program Files\\Drawio\\'"
+        result = session.run(command)
+        command = "Invoke-WebRequest -Uri https://github.com/jgraph/drawio-desktop/releases/download/v15.4.0/draw.io-15.4.0-windows-no-installer.exe -OutFile 'C:\\Program Files\\Drawio\\draw.io-15.4.0-windows-no-installer.exe'"
+        logger.info("Downloading Draw.io sourcefiles from Github using command: %s", command)
+        result = session.run(command)
+        dlresult = session.run("Test-Path -Path 'C:\\Program Files\\Drawio\\draw.io-15.4.0-windows-no-installer.exe' -PathType Leaf")
+        restext = str(dlresult.std_out)
+        if "True" in restext :
+            command = 'C:/PROGRA~1/Amazon/Photon/ConsoleImageBuilder/image-assistant.exe add-application --name Draw.io --display-name Draw.io --absolute-app-path C:/PROGRA~1/Drawio/draw.io-15.4.0-windows-no-installer.exe'
+            logger.info("Software download complete, adding software to catalog: Draw.io using command: %s", command)
+            result = run_with_policy(session.run_cmd, normalise_command(command, "continue"))
+            result['Step'] = "Drawio"
+            command_results.append(result)
+            if result['Status'] == "Succeeded" :
+                record_checkpoint(session, checkpoint_file, completed, "Drawio")
+            else :
+                logger.info("Unable to add software to catalog: Draw.io.")
+        else :
+            logger.info("Unable to successfully download software installation aborted: Draw.io. Cleaning up directory.")
+            result = session.run("Remove-Item 'C:\\Program Files\\Drawio' -Recurse") 
     ############################################################
+
+    # Installs resumed from a checkpoint only ran part of the plan, their duration is kept out of the build telemetry
+    phases = {'Connect' : connect_seconds, 'Install' : round(time.time() - install_start)}
+    output = session.run(windows_sampler_collect()).std_out.decode(errors='replace').splitlines()
+    utilisation = parse_windows_samples(output)
+
+    # Clear the checkpoint from the builder once every step succeeded, so it is not captured in the image
+    if completed.issuperset(plan_steps) :
+        session.run("Remove-Item -Path '" + checkpoint_file + "' -ErrorAction SilentlyContinue")
+    else :
+        logger.info("Steps %s did not complete successfully.", sorted(set(plan_steps) - completed))
     
     
     # Removes the DummyApp that was required for the creation of the non-domain joined base image.
@@ -153,8 +232,42 @@ def lambda_handler(event, context):
     command = '"c:\\Program Files\\Amazon\\Photon\\ConsoleImageBuilder\\image-assistant.exe" remove-application --name DummyApp'
     result = session.run_cmd(command)
 
+    # In combined mode, create the image on the existing session if it fits in the remaining Lambda time
+    image_created = False
+    if parameters['CombineImageCreation'] :
+        if context.get_remaining_time_in_millis() > image_creation_reserve_ms :
+            full_image_name, command = create_image_command(event['AutomationParameters'], windows_image_assistant)
+            logger.info("Executing Image Assistant command on existing session: %s", command)
+            image_start = time.time()
+            result = session.run_cmd(command)
+            logger.info("Results from image assistant command: %s", result.std_out)
+            if result.status_code != 0 or b"ERROR" in result.std_out :
+                logger.info("ERROR running Image Assistant, deferring to Run Image Assistant task.")
+            else:
+                image_created = True
+                phases['ImageCreation'] = round(time.time() - image_start)
+        else :
+            logger.info("Insufficient time remaining to create image, deferring to Run Image Assistant task.")
+
     logger.info("Completed AS2_Automation_Windows_Scripted_Install function, returning to Step Function.")
-    return {
+    response = {
         'Method' : "Script",
-        'Status' : "Complete"
-    }
\ No newline at end of file
+        'Status' : "Complete",
+        'ImageCreated' : image_created,
+        'Commands' : command_results,
+        'ImageBuilderName' : builder_name,
+        'Phases' : phases,
+        'Resumed' : resumed,
+        'Utilisation' : utilisation,
+        'Checkpoint' : {
+            'PlanHash' : plan_hash,
+            'CompletedSteps' : sorted(completed)
+        }
+    }
+    if image_created :
+        response['Images'] = [
+            {
+                "Name": full_image_name
+            }
+        ]
+    return response
\ No newline at end of file
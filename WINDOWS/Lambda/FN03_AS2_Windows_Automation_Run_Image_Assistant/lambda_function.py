@@ -15,26 +15,33 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import logging
-import boto3
-import json
-import datetime
-import winrm
-import base64
 import sys
-from datetime import datetime
+from as2_automation.envelope import get_builder_addresses
+from as2_automation.image_assistant import create_image_command, windows_image_assistant
+from as2_automation.parameters import resolve
+from as2_automation.remote import connect_winrm, load_builder_credentials
+from as2_automation.trace import traced
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-secretsmgr = boto3.client('secretsmanager')
+# Automation parameters read from event data
+# If parameter not found, inject default values
+parameter_schema = [
+    ('ImageOutputPrefix', 'AS2_Automation_Image'),
+    ('UseLatestAgent', True),
+    ('ImageTags', False)
+]
 
+
+@traced
 def lambda_handler(event, context):
     logger.info("Beginning execution of AS2_Automation_Windows_Run_Image_Assistant function.")
 
     # Retrieve image builder IP address from event data
     logger.info("Querying for Image Builder instance IP address.")
     try :
-        host = event['BuilderStatus']['ImageBuilders'][0]['NetworkAccessConfiguration']['EniPrivateIpAddress']
+        host = get_builder_addresses(event['BuilderStatus'])[0][1]
         logger.info("IP address found: %s.", host)
     except Exception as e :
         logger.error(e)
@@ -42,71 +49,22 @@ def lambda_handler(event, context):
 
     # Read image builder administrator username and password from Secrets Manager
     logger.info("Retreiving instance username and password from Secrets Manager.")
-    secret_name = "as2/builder/pw"
-    secret_response = secretsmgr.get_secret_value(SecretId=secret_name)
-
-    if 'SecretString' in secret_response:
-        secret = json.loads(secret_response['SecretString'])
-    else:
-        secret = base64.b64decode(secret_response['SecretBinary'])
-
-    user = secret['as2_builder_admin_user']
-    password = secret['as2_builder_admin_pw']
-    logger.info("Remote access credentials obtained: %s", user)
+    credentials = load_builder_credentials()
+    logger.info("Remote access credentials obtained: %s", credentials[0])
     
     try :
-        # Retrieve image name from event data
-        try :
-            image_name = event['AutomationParameters']['ImageOutputPrefix']
-            logger.info("Image name prefix found in event data: %s.", image_name)
-        except Exception as e :
-            image_name = 'AS2_Automation_Image'
-            logger.info("No image name prefix found in event data, defaulting to AS2_Automation_Image.")
-        
-        # Retrieve UseLatestAgent from event data, default to True
-        try :
-            UseLatestAgent = event['AutomationParameters']['UseLatestAgent']
-            logger.info("UseLatestAgent found in event data, setting to %s.", UseLatestAgent)
-        except Exception as e2 :
-            UseLatestAgent = True
-            logger.info("UseLatestAgent not found in event data, defaulting to True")
-            
-        if UseLatestAgent :
-            latest_agent = ' --use-latest-agent-version'
-        else :
-            latest_agent = ' --no-use-latest-agent-version'
-            
-        # Retrieve image tags from event data
-        try :
-            ImageTags = event['AutomationParameters']['ImageTags']
-            if ImageTags :
-                logger.info("Image Tags found in event data: %s.", ImageTags)
-            else :
-                logger.info("No Image Tags found in event data, generated image will not be tagged.")
-        except Exception as e3 :
-            ImageTags = False
-            logger.info("No Image Tags found in event data, generated image will not be tagged.")
-            
-        if ImageTags :
-            tag_image = ' --tags ' + ImageTags
-        else :
-            tag_image = ''            
+        parameters = resolve(event['AutomationParameters'], parameter_schema)
 
-        # Base image assistant command
-        prefix = 'C:/PROGRA~1/Amazon/Photon/ConsoleImageBuilder/image-assistant.exe create-image --name '
-
-        # Generate full image name using image name prefix and timestamp
-        now = datetime.now()
-        dt_string = now.strftime("-%Y-%m-%d-%H-%M-%S")
-        full_image_name = image_name + dt_string
-        
-        # Final image assistant command
-        command = prefix + full_image_name + latest_agent + tag_image
+        # Generate full image name and final image assistant command
+        full_image_name, command = create_image_command(parameters, windows_image_assistant)
 
         # Connect to remote image builder using pywinrm library
         logger.info("Connecting to host: %s", host)
-        session = winrm.Session(host, auth=(user, password))
-        logger.info("Session connection result: %s", session)        
+        session = connect_winrm(host, credentials)
+
+        # Remove the command checkpoints whatever the outcome of the install steps, so they are not captured in the image
+        logger.info("Removing command checkpoint files from the image builder.")
+        session.run("Remove-Item -Path 'C:\\temp\\as2_checkpoint_*.txt' -ErrorAction SilentlyContinue")
 
         # Run image assistant command to create image
         logger.info("Executing Image Assistant command: %s", command)
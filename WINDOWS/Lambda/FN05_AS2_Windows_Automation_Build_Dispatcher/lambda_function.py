@@ -0,0 +1,46 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import logging
+import os
+from as2_automation.dispatch import SqsQueue, dispatch, get_running_builds, start_build
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+# Invoked on a schedule and whenever an execution of the state machine ends, to admit queued builds into the freed capacity
+def lambda_handler(event, context):
+    logger.info("Beginning execution of AS2_Automation_Windows_Build_Dispatcher function.")
+
+    state_machine_arn = os.environ['State_Machine_ARN']
+    max_builds = int(os.environ['Max_Concurrent_Builds'])
+    weights = json.loads(os.environ.get('Team_Weights') or "{}")
+
+    running = get_running_builds(state_machine_arn)
+    logger.info("Builds running by team: %s, capacity %s.", running, max_builds)
+
+    report = dispatch(
+        SqsQueue(os.environ['Build_Queue_URL']),
+        running,
+        max_builds,
+        weights,
+        lambda request : start_build(state_machine_arn, request)
+    )
+
+    logger.info("Completed AS2_Automation_Windows_Build_Dispatcher function.")
+    return report
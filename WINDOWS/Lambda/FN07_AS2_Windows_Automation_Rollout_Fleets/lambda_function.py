@@ -0,0 +1,49 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import logging
+from as2_automation.envelope import get_image_name
+from as2_automation.parameters import REQUIRED, resolve
+from as2_automation.rollout import advance_rollout, new_rollout
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Automation parameters read from event data
+parameter_schema = [
+    ('RolloutFleets', REQUIRED),
+    ('RolloutWaveSize', 1),
+    ('RolloutRestartFleets', True)
+]
+
+
+# Invoked once the image is available in this region and again every minute while fleets are being updated
+# The rollout state returned is passed back in the next invocation through the execution state
+def lambda_handler(event, context):
+    logger.info("Beginning execution of AS2_Automation_Windows_Rollout_Fleets function.")
+
+    parameters = resolve(event['AutomationParameters'], parameter_schema)
+
+    rollout = event.get('Rollout')
+    if not rollout :
+        rollout = new_rollout(get_image_name(event['ImageStatus']), parameters['RolloutFleets'], parameters['RolloutWaveSize'], parameters['RolloutRestartFleets'])
+        logger.info("Rolling %s out to %s in waves of %s.", rollout['ImageName'], [entry['Fleet'] for entry in rollout['Fleets']], parameters['RolloutWaveSize'])
+
+    rollout = advance_rollout(rollout)
+
+    logger.info("Completed AS2_Automation_Windows_Rollout_Fleets function, rollout %s, returning to Step Function.", rollout['Status'])
+    return rollout